@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Archivos estáticos con huella de contenido
+- Al iniciar se genera un manifiesto (sin paso de build): css/style.css -> css/style.<hash>.css
+- url_for('static', filename=...) devuelve el nombre con huella, de modo que cada
+  versión del archivo tiene su propia URL y se puede cachear como inmutable
+- Las variantes gzip (y brotli, si está instalado) se precalculan en memoria y se
+  sirven según Accept-Encoding
+- Las imágenes subidas ya se guardan por hash (imagenes.py) y también son inmutables
+
+brotli es opcional: sin él solo se precalcula gzip.
+"""
+
+from flask import request, current_app
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dependencia opcional
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Un año: el contenido de una URL con huella nunca cambia
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+
+# Tipos que vale la pena comprimir (las imágenes ya están comprimidas)
+EXTENSIONES_COMPRIMIBLES = {'css', 'js', 'svg', 'json', 'txt', 'html', 'map'}
+
+# Directorios de static/ que no entran al manifiesto (contenido subido por usuarios)
+DIRECTORIOS_EXCLUIDOS = {'uploads'}
+
+# Subidas guardadas por hash de contenido (imagenes.py)
+_RE_SUBIDA_INMUTABLE = re.compile(r'^uploads/repuestos/(originales|variantes)/[0-9a-f]{2}/[0-9a-f]{64}')
+
+
+class _Activo:
+    """Un archivo estático con su huella y variantes comprimidas"""
+    __slots__ = ('nombre', 'con_huella', 'huella', 'mtime', 'tipo', 'variantes')
+
+    def __init__(self, nombre, con_huella, huella, mtime, tipo, variantes):
+        self.nombre = nombre
+        self.con_huella = con_huella
+        self.huella = huella
+        self.mtime = mtime
+        self.tipo = tipo
+        self.variantes = variantes
+
+
+def _cargar_activo(carpeta, nombre, nivel_gzip):
+    ruta = os.path.join(carpeta, nombre)
+    with open(ruta, 'rb') as f:
+        contenido = f.read()
+    huella = hashlib.sha256(contenido).hexdigest()[:12]
+    base, ext = os.path.splitext(nombre)
+    ext_sin_punto = ext[1:].lower()
+
+    variantes = {'identity': contenido}
+    if ext_sin_punto in EXTENSIONES_COMPRIMIBLES and len(contenido) > 512:
+        comprimido = gzip.compress(contenido, compresslevel=nivel_gzip, mtime=0)
+        if len(comprimido) < len(contenido):
+            variantes['gzip'] = comprimido
+        if brotli is not None:
+            comprimido = brotli.compress(contenido, quality=11)
+            if len(comprimido) < len(contenido):
+                variantes['br'] = comprimido
+
+    return _Activo(
+        nombre=nombre,
+        con_huella=f'{base}.{huella}{ext}',
+        huella=huella,
+        mtime=os.path.getmtime(ruta),
+        tipo=mimetypes.guess_type(nombre)[0] or 'application/octet-stream',
+        variantes=variantes
+    )
+
+
+class ManifiestoActivos:
+    """Manifiesto nombre lógico -> archivo con huella, construido al iniciar la aplicación"""
+
+    def __init__(self, carpeta, nivel_gzip=9, recargar=False):
+        self.carpeta = carpeta
+        self.nivel_gzip = nivel_gzip
+        # En modo debug se vuelve a leer un archivo cuando cambia su fecha de modificación
+        self.recargar = recargar
+        self.por_nombre = {}
+        self.por_huella = {}
+        self._lock = threading.Lock()
+        self.construir()
+
+    def construir(self):
+        por_nombre, por_huella = {}, {}
+        for raiz, directorios, archivos in os.walk(self.carpeta):
+            if raiz == self.carpeta:
+                directorios[:] = [d for d in directorios if d not in DIRECTORIOS_EXCLUIDOS]
+            for archivo in archivos:
+                nombre = os.path.relpath(os.path.join(raiz, archivo), self.carpeta).replace(os.sep, '/')
+                activo = _cargar_activo(self.carpeta, nombre, self.nivel_gzip)
+                por_nombre[nombre] = activo
+                por_huella[activo.con_huella] = activo
+        self.por_nombre, self.por_huella = por_nombre, por_huella
+        logger.info(f"Manifiesto de estáticos: {len(por_nombre)} archivos")
+
+    def _actualizado(self, activo):
+        """Relee el archivo si cambió (solo con recargar=True)"""
+        ruta = os.path.join(self.carpeta, activo.nombre)
+        try:
+            if os.path.getmtime(ruta) == activo.mtime:
+                return activo
+        except OSError:
+            return activo
+        with self._lock:
+            nuevo = _cargar_activo(self.carpeta, activo.nombre, self.nivel_gzip)
+            self.por_nombre[nuevo.nombre] = nuevo
+            self.por_huella[nuevo.con_huella] = nuevo
+        return nuevo
+
+    def url(self, nombre):
+        """Nombre con huella para url_for (o el mismo nombre si no está en el manifiesto)"""
+        activo = self.por_nombre.get(nombre)
+        if activo is None:
+            return nombre
+        if self.recargar:
+            activo = self._actualizado(activo)
+        return activo.con_huella
+
+    def buscar(self, nombre_con_huella):
+        return self.por_huella.get(nombre_con_huella)
+
+
+def _codificacion(activo):
+    """Mejor variante aceptada por el cliente ('br' > 'gzip' > 'identity')"""
+    aceptadas = request.accept_encodings
+    for codificacion in ('br', 'gzip'):
+        if codificacion in activo.variantes and aceptadas[codificacion]:
+            return codificacion
+    return 'identity'
+
+
+def _servir_activo(activo):
+    codificacion = _codificacion(activo)
+    respuesta = current_app.response_class(activo.variantes[codificacion], mimetype=activo.tipo)
+    if codificacion != 'identity':
+        respuesta.headers['Content-Encoding'] = codificacion
+    if len(activo.variantes) > 1:
+        respuesta.vary.add('Accept-Encoding')
+    respuesta.headers['Cache-Control'] = CACHE_INMUTABLE
+    # Una ETag por variante: la representación comprimida es distinta de la original
+    respuesta.set_etag(activo.huella if codificacion == 'identity' else f'{activo.huella}-{codificacion}')
+    return respuesta.make_conditional(request)
+
+
+def init_activos(app):
+    """
+    Construye el manifiesto, reescribe url_for('static', ...) y reemplaza la vista de
+    estáticos por una que sirve los archivos con huella como inmutables.
+    """
+    if not app.config.get('ACTIVOS_HUELLA', True) or not app.static_folder:
+        return None
+
+    manifiesto = ManifiestoActivos(
+        app.static_folder,
+        nivel_gzip=app.config.get('ACTIVOS_NIVEL_GZIP', 9),
+        recargar=app.debug
+    )
+    app.extensions['activos'] = manifiesto
+    servir_original = app.view_functions['static']
+
+    @app.url_defaults
+    def huella_estaticos(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = manifiesto.url(values['filename'])
+
+    def estaticos(filename):
+        activo = manifiesto.buscar(filename)
+        if activo is not None:
+            return _servir_activo(activo)
+        respuesta = servir_original(filename=filename)
+        if _RE_SUBIDA_INMUTABLE.match(filename):
+            respuesta.headers['Cache-Control'] = CACHE_INMUTABLE
+        return respuesta
+
+    app.view_functions['static'] = estaticos
+    return manifiesto
+
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de alertas de stock
+- Evalúa un conjunto de repuestos con pocas sentencias (independiente del número de repuestos)
+- Resuelve las alertas STOCK_BAJO/AGOTADO de repuestos que vuelven a superar el mínimo
+- Crea las alertas nuevas sin duplicar (clave única sobre alertas abiertas)
+- Notifica a administradores y almacenistas con un INSERT ... SELECT
+- Barrido periódico de todo el catálogo por rangos de IDs (transacciones cortas)
+- Alertas PROXIMAMENTE_AGOTADO a partir del pronóstico de demanda (pronostico.py)
+"""
+
+from database import execute_query, execute_update, get_db
+from metricas import registrar_evento
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _filtro_repuestos(columna, repuesto_ids=None, rango=None):
+    """Condición SQL y parámetros para limitar una sentencia a un conjunto o rango de repuestos"""
+    if rango is not None:
+        return f"AND {columna} BETWEEN %s AND %s", tuple(rango)
+    if repuesto_ids is None:
+        return '', ()
+    placeholders = ', '.join(['%s'] * len(repuesto_ids))
+    return f"AND {columna} IN ({placeholders})", tuple(repuesto_ids)
+
+
+def _notificar_nuevas(tipos, filtro_alerta='', params_alerta=()):
+    """
+    Notifica a administradores y almacenistas las alertas recién creadas por el
+    último INSERT (ids desde LAST_INSERT_ID())
+    """
+    primer_id = execute_query("SELECT LAST_INSERT_ID() as id", fetch_one=True)['id']
+    placeholders = ', '.join(['%s'] * len(tipos))
+
+    execute_query(f"""
+        INSERT IGNORE INTO notificaciones_usuarios (usuario_id, alerta_id)
+        SELECT u.id, a.id
+        FROM alertas_inventario a
+        CROSS JOIN usuarios u
+        JOIN roles ro ON u.rol_id = ro.id
+        WHERE a.id >= %s
+        AND a.estado = 'NUEVA'
+        AND a.tipo_alerta IN ({placeholders})
+        {filtro_alerta}
+        AND ro.nombre IN ('SUPER_USUARIO', 'ADMINISTRADOR', 'ALMACENISTA')
+        AND u.activo = TRUE
+    """, (primer_id,) + tuple(tipos) + tuple(params_alerta))
+
+
+def evaluar_alertas_stock(repuesto_ids=None, commit=True, rango=None):
+    """
+    Evalúa las alertas de stock de un conjunto de repuestos.
+
+    Args:
+        repuesto_ids: Iterable de IDs de repuesto; None evalúa todo el catálogo
+        commit: Si True, confirma la transacción al terminar
+        rango: Tupla (id_desde, id_hasta) para evaluar un rango de IDs (barrido)
+
+    Returns:
+        Dict con el número de alertas 'resueltas' y 'creadas'
+    """
+    if repuesto_ids is not None:
+        repuesto_ids = sorted({int(r) for r in repuesto_ids if r})
+        if not repuesto_ids:
+            return {'resueltas': 0, 'creadas': 0}
+
+    filtro_alerta, params_alerta = _filtro_repuestos('a.repuesto_id', repuesto_ids, rango)
+    filtro_repuesto, params_repuesto = _filtro_repuestos('r.id', repuesto_ids, rango)
+
+    # 1. Resolver alertas que ya no corresponden al stock actual
+    #    (STOCK_BAJO sobre el mínimo, AGOTADO con existencias, repuesto inactivo)
+    resueltas = execute_update(f"""
+        UPDATE alertas_inventario a
+        JOIN repuestos r ON a.repuesto_id = r.id
+        SET a.estado = 'RESUELTA', a.fecha_resolucion = NOW()
+        WHERE a.estado IN ('NUEVA', 'EN_PROCESO')
+        AND a.tipo_alerta IN ('STOCK_BAJO', 'AGOTADO')
+        AND (
+            (a.tipo_alerta = 'STOCK_BAJO' AND r.cantidad_actual > r.cantidad_minima)
+            OR (a.tipo_alerta = 'AGOTADO' AND r.cantidad_actual > 0)
+            OR r.activo = FALSE
+        )
+        {filtro_alerta}
+    """, params_alerta)
+
+    # 2. Crear alertas nuevas; la clave única de alertas abiertas descarta duplicados
+    creadas = execute_update(f"""
+        INSERT IGNORE INTO alertas_inventario
+        (repuesto_id, tipo_alerta, nivel_prioridad, mensaje)
+        SELECT r.id,
+               IF(r.cantidad_actual = 0, 'AGOTADO', 'STOCK_BAJO'),
+               IF(r.cantidad_actual = 0, 'CRITICA', 'ALTA'),
+               IF(r.cantidad_actual = 0,
+                  CONCAT('El repuesto ', r.nombre, ' (', r.codigo, ') está AGOTADO'),
+                  CONCAT('El repuesto ', r.nombre, ' (', r.codigo, ') tiene stock bajo: ',
+                         r.cantidad_actual, ' unidades (disponible: ',
+                         r.cantidad_actual - r.cantidad_reservada, ')'))
+        FROM repuestos r
+        WHERE r.activo = TRUE
+        AND r.cantidad_actual <= r.cantidad_minima
+        {filtro_repuesto}
+        ORDER BY r.id
+    """, params_repuesto)
+
+    if creadas:
+        # 3. Notificar las alertas recién creadas
+        _notificar_nuevas(('STOCK_BAJO', 'AGOTADO'), filtro_alerta, params_alerta)
+
+    if commit:
+        get_db().commit()
+    registrar_evento('alerta', creadas)
+
+    if resueltas or creadas:
+        logger.info(f"Alertas de stock: {resueltas} resueltas, {creadas} creadas")
+
+    return {'resueltas': resueltas, 'creadas': creadas}
+
+
+def verificar_alertas_stock(repuesto_ids):
+    """
+    Evalúa alertas tras una operación de inventario ya confirmada.
+    Un fallo al evaluar alertas no debe interrumpir la operación principal.
+    """
+    try:
+        return evaluar_alertas_stock(repuesto_ids)
+    except Exception as e:
+        logger.error(f"Error verificando alertas de stock: {e}")
+        return {'resueltas': 0, 'creadas': 0}
+
+
+def barrer_alertas_stock(tamano_lote=5000):
+    """
+    Reconciliación completa de alertas de stock contra todo el catálogo.
+    Recorre los repuestos por rangos de IDs; cada rango se evalúa y confirma en
+    su propia transacción para no bloquear el tráfico normal.
+    Detecta cambios hechos fuera de las rutas (cantidad_minima editada, SQL directo, importaciones).
+
+    Args:
+        tamano_lote: Cantidad de IDs de repuesto por transacción
+
+    Returns:
+        Dict con 'repuestos', 'resueltas', 'creadas', 'lotes' y 'segundos'
+    """
+    inicio = time.monotonic()
+    limites = execute_query(
+        "SELECT MIN(id) as minimo, MAX(id) as maximo, COUNT(*) as total FROM repuestos",
+        fetch_one=True
+    )
+
+    resultado = {'repuestos': limites['total'] or 0, 'resueltas': 0, 'creadas': 0, 'lotes': 0}
+
+    if limites['minimo'] is not None:
+        for desde in range(limites['minimo'], limites['maximo'] + 1, tamano_lote):
+            cambios = evaluar_alertas_stock(rango=(desde, desde + tamano_lote - 1))
+            resultado['resueltas'] += cambios['resueltas']
+            resultado['creadas'] += cambios['creadas']
+            resultado['lotes'] += 1
+
+    resultado['segundos'] = round(time.monotonic() - inicio, 2)
+    logger.info(
+        f"Barrido de alertas: {resultado['repuestos']} repuestos en {resultado['lotes']} lotes, "
+        f"{resultado['resueltas']} resueltas, {resultado['creadas']} creadas ({resultado['segundos']} s)"
+    )
+    return resultado
+
+
+def evaluar_alertas_pronostico():
+    """
+    Alertas PROXIMAMENTE_AGOTADO a partir del último pronóstico (pronosticos_repuestos).
+    Solo para repuestos con stock sobre el mínimo: los demás ya tienen STOCK_BAJO o AGOTADO.
+
+    Returns:
+        Dict con el número de alertas 'resueltas' y 'creadas'
+    """
+    # Resolver las que ya no están en riesgo o pasaron a stock bajo/agotado
+    resueltas = execute_update("""
+        UPDATE alertas_inventario a
+        JOIN repuestos r ON a.repuesto_id = r.id
+        LEFT JOIN pronosticos_repuestos p ON p.repuesto_id = r.id
+        SET a.estado = 'RESUELTA', a.fecha_resolucion = NOW()
+        WHERE a.estado IN ('NUEVA', 'EN_PROCESO')
+        AND a.tipo_alerta = 'PROXIMAMENTE_AGOTADO'
+        AND (p.en_riesgo IS NULL OR p.en_riesgo = FALSE
+             OR r.activo = FALSE OR r.cantidad_actual <= r.cantidad_minima)
+    """)
+
+    creadas = execute_update("""
+        INSERT IGNORE INTO alertas_inventario
+        (repuesto_id, tipo_alerta, nivel_prioridad, mensaje)
+        SELECT r.id, 'PROXIMAMENTE_AGOTADO', 'MEDIA',
+               CONCAT('El repuesto ', r.nombre, ' (', r.codigo, ') se agotará en ~',
+                      ROUND(p.dias_para_agotar), ' días (consumo ', ROUND(p.demanda_diaria, 2),
+                      '/día). Mínimo sugerido: ', p.minimo_sugerido)
+        FROM pronosticos_repuestos p
+        JOIN repuestos r ON p.repuesto_id = r.id
+        WHERE p.en_riesgo = TRUE
+        AND r.activo = TRUE
+        AND r.cantidad_actual > r.cantidad_minima
+        ORDER BY r.id
+    """)
+
+    if creadas:
+        _notificar_nuevas(('PROXIMAMENTE_AGOTADO',))
+
+    get_db().commit()
+    registrar_evento('alerta', creadas)
+    logger.info(f"Alertas de pronóstico: {resueltas} resueltas, {creadas} creadas")
+    return {'resueltas': resueltas, 'creadas': creadas}
@@ -1,6 +1,25 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
 from config import config
-from database import init_db, execute_query
+from database import init_db, execute_query, execute_update, transaccion
+from reservas import reservar_stock, liberar_reserva, stock_disponible, ReservaInsuficiente
+from alertas import verificar_alertas_stock, barrer_alertas_stock, evaluar_alertas_pronostico
+from valorizacion import valorizacion_total, verificar_valorizacion
+from conciliacion import verificar_stock
+from kardex import generar_cortes
+from pronostico import calcular_pronosticos, pronostico_repuesto, numpy_disponible
+from clasificacion import clasificar_inventario, fecha_clasificacion_vigente, CLASES_ABC, CLASES_XYZ
+from activos import init_activos
+from compresion import init_compresion
+from metricas import init_metricas
+from condicional import versiones_catalogo, validadores, no_modificado, json_con_validadores
+from detalle_repuestos import validadores_detalle, detalle_repuesto
+from plantillas import init_plantillas, precompilar_plantillas, medir_carga_plantillas
+from contadores import reconstruir_contadores
+from placas import normalizar_placa, patron_placa, buscar_por_placa
+from imagenes import (
+    guardar_imagenes, eliminar_imagen, imagenes_repuesto, miniaturas_principales,
+    procesar_pendientes, limpiar_huerfanos, pillow_disponible
+)
 from auth import (
     login_user, logout_user, get_current_user, is_authenticated,
     login_required, role_required, get_permissions, hash_password,
@@ -8,8 +27,8 @@ from auth import (
 )
 import os
 import json
+import click
 from datetime import datetime, timedelta
-from werkzeug.utils import secure_filename
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -24,10 +43,151 @@ def create_app(config_name='default'):
     # Inicializar base de datos
     init_db(app)
 
+    # Métricas Prometheus en /metrics (antes de los demás before_request)
+    init_metricas(app)
+
+    # Estáticos con huella de contenido (caché inmutable y variantes precomprimidas)
+    init_activos(app)
+
+    # Compresión gzip/brotli de HTML y JSON (middleware WSGI)
+    init_compresion(app)
+
+    # Caché de bytecode de plantillas en disco
+    init_plantillas(app)
+
     # Registrar blueprints
     from routes import register_blueprints
     register_blueprints(app)
 
+    # Comandos de mantenimiento (programables con cron o el Programador de tareas)
+    @app.cli.command('barrer-alertas')
+    def barrer_alertas_comando():
+        """Reconcilia las alertas de stock de todo el catálogo"""
+        resultado = barrer_alertas_stock(app.config.get('ALERTAS_BARRIDO_LOTE', 5000))
+        print(f"Repuestos revisados: {resultado['repuestos']} ({resultado['lotes']} lotes)")
+        print(f"Alertas resueltas: {resultado['resueltas']}")
+        print(f"Alertas creadas: {resultado['creadas']}")
+        print(f"Tiempo: {resultado['segundos']} s")
+
+    @app.cli.command('verificar-valorizacion')
+    @click.option('--corregir', is_flag=True, help='Reescribir los agregados con deriva')
+    def verificar_valorizacion_comando(corregir):
+        """Recalcula la valorización de inventario y reporta la deriva"""
+        resultado = verificar_valorizacion(corregir)
+        print(f"Categorías revisadas: {resultado['categorias']}")
+        for d in resultado['diferencias']:
+            for columna in d['columnas']:
+                print(f"  Categoría {d['categoria_id']} {columna}: "
+                      f"registrado {d['registrado'][columna]}, esperado {d['esperado'][columna]}")
+        print(f"Categorías con deriva: {len(resultado['diferencias'])}")
+        if corregir:
+            print(f"Categorías corregidas: {resultado['corregidas']}")
+        print(f"Tiempo: {resultado['segundos']} s")
+
+    @app.cli.command('reconstruir-contadores')
+    @click.option('--contador', multiple=True, type=click.Choice(['clientes', 'categorias', 'facturas']),
+                  help='Contador a reconstruir (repetible; por defecto todos)')
+    def reconstruir_contadores_comando(contador):
+        """Recalcula los contadores de las listas (vehículos, repuestos por categoría, pagos)"""
+        resultado = reconstruir_contadores(app.config.get('CONTADORES_LOTE', 5000), contador or None)
+        for nombre, corregidas in resultado.items():
+            if nombre != 'segundos':
+                print(f"{nombre}: {corregidas} filas corregidas")
+        print(f"Tiempo: {resultado['segundos']} s")
+
+    @app.cli.command('verificar-stock')
+    @click.option('--corregir', is_flag=True, help='Registrar ajustes de conciliación y recalcular reservas')
+    @click.option('--usuario', type=int, help='ID del usuario que firma las correcciones')
+    def verificar_stock_comando(corregir, usuario):
+        """Reproduce el kardex y lo compara con cantidad_actual y cantidad_reservada"""
+        if corregir and not usuario:
+            raise click.UsageError('--corregir requiere --usuario')
+        resultado = verificar_stock(app.config.get('CONCILIACION_LOTE', 1000), corregir, usuario)
+        for d in resultado['diferencias']:
+            linea = (f"  {d['codigo']}: stock {d['cantidad_actual']} (kardex {d['cantidad_esperada']}), "
+                     f"reservado {d['cantidad_reservada']} (esperado {d['reserva_esperada']})")
+            if d['saldo_negativo']:
+                n = d['saldo_negativo']
+                linea += f", kardex negativo ({n['saldo']}) en {n['fuente']} {n['id']}"
+            print(linea)
+        print(f"Repuestos revisados: {resultado['repuestos']} ({resultado['eventos']} eventos)")
+        if resultado['total_diferencias'] > len(resultado['diferencias']):
+            print(f"  ... y {resultado['total_diferencias'] - len(resultado['diferencias'])} más")
+        print(f"Repuestos con diferencias: {resultado['total_diferencias']}")
+        if corregir:
+            print(f"Correcciones registradas: {resultado['correcciones']}")
+        print(f"Tiempo: {resultado['segundos']} s")
+
+    @app.cli.command('kardex-cortes')
+    @click.option('--fecha', type=click.DateTime(formats=['%Y-%m-%d']),
+                  help='Fecha del corte (por defecto, primer día del mes actual)')
+    def kardex_cortes_comando(fecha):
+        """Registra el saldo de kardex de cada repuesto a una fecha de corte"""
+        resultado = generar_cortes(fecha.date() if fecha else None,
+                                   app.config.get('CONCILIACION_LOTE', 1000))
+        print(f"Corte: {resultado['corte']}")
+        print(f"Repuestos: {resultado['repuestos']} ({resultado['lotes']} lotes)")
+        print(f"Tiempo: {resultado['segundos']} s")
+
+    @app.cli.command('pronosticar')
+    @click.option('--metodo', type=click.Choice(['suavizado', 'media']), help='Método de pronóstico')
+    def pronosticar_comando(metodo):
+        """Pronostica la demanda, sugiere mínimos y genera alertas PROXIMAMENTE_AGOTADO"""
+        if not numpy_disponible():
+            raise click.ClickException('El pronóstico requiere NumPy: pip install numpy')
+        resultado = calcular_pronosticos(
+            metodo=metodo or app.config.get('PRONOSTICO_METODO', 'suavizado'),
+            historia_dias=app.config.get('PRONOSTICO_HISTORIA_DIAS', 730),
+            ventana=app.config.get('PRONOSTICO_VENTANA_DIAS', 90),
+            alfa=app.config.get('PRONOSTICO_ALFA', 0.1),
+            dias_entrega=app.config.get('PRONOSTICO_DIAS_ENTREGA', 7),
+            factor_seguridad=app.config.get('PRONOSTICO_FACTOR_SEGURIDAD', 1.65)
+        )
+        alertas = evaluar_alertas_pronostico()
+        print(f"Repuestos: {resultado['repuestos']} ({resultado['con_demanda']} con consumo)")
+        print(f"En riesgo de agotarse: {resultado['en_riesgo']}")
+        print(f"Alertas resueltas: {alertas['resueltas']}, creadas: {alertas['creadas']}")
+        print(f"Tiempo: {resultado['segundos']} s")
+
+    @app.cli.command('clasificar')
+    def clasificar_comando():
+        """Calcula la clasificación ABC/XYZ de los repuestos activos"""
+        if not numpy_disponible():
+            raise click.ClickException('La clasificación requiere NumPy: pip install numpy')
+        resultado = clasificar_inventario(
+            dias=app.config.get('CLASIFICACION_DIAS', 365),
+            periodo_dias=app.config.get('CLASIFICACION_PERIODO_DIAS', 30)
+        )
+        print(f"Repuestos: {resultado['repuestos']} (fecha {resultado['fecha']})")
+        for clase_abc in CLASES_ABC:
+            fila = '  '.join(f"{clase_abc}{x}: {resultado['matriz'].get(clase_abc + x, 0)}" for x in CLASES_XYZ)
+            print(f"  {fila}")
+        print(f"Sin demanda: {resultado['sin_demanda']}")
+        print(f"Tiempo: {resultado['segundos']} s")
+
+    @app.cli.command('medir-plantillas')
+    @click.option('--repeticiones', default=5, show_default=True, help='Mediciones por caso')
+    def medir_plantillas_comando(repeticiones):
+        """Compara la carga de plantillas en frío, desde la caché de bytecode y en memoria"""
+        resultado = medir_carga_plantillas(app, repeticiones)
+        print(f"Plantillas: {resultado['plantillas']}")
+        print(f"En frío (compilando):     {resultado['frio_ms']} ms")
+        if resultado['bytecode_ms'] is not None:
+            print(f"Caché de bytecode:        {resultado['bytecode_ms']} ms")
+        else:
+            print("Caché de bytecode:        desactivada (PLANTILLAS_CACHE_BYTECODE = False)")
+        print(f"En memoria:               {resultado['memoria_ms']} ms")
+
+    @app.cli.command('procesar-imagenes')
+    @click.option('--reintentar', is_flag=True, help='Reintentar también las imágenes con error')
+    def procesar_imagenes_comando(reintentar):
+        """Borra los archivos sin referencia y genera las variantes pendientes (requiere Pillow)"""
+        print(f"Archivos sin referencia eliminados: {limpiar_huerfanos()}")
+        if not pillow_disponible():
+            raise click.ClickException('El procesamiento de imágenes requiere Pillow: pip install Pillow')
+        resultado = procesar_pendientes(reintentar=reintentar)
+        print(f"Imágenes procesadas: {resultado['procesadas']}, con error: {resultado['errores']}")
+
     # Crear directorio de uploads si no existe
     os.makedirs(app.config.get('UPLOAD_FOLDER', 'static/uploads'), exist_ok=True)
     os.makedirs(os.path.join(app.config.get('UPLOAD_FOLDER', 'static/uploads'), 'repuestos'), exist_ok=True)
@@ -172,15 +332,10 @@ def create_app(config_name='default'):
         user = get_current_user()
         stats = {}
 
-        stats['total_repuestos'] = execute_query(
-            "SELECT COUNT(*) as count FROM repuestos WHERE activo = TRUE",
-            fetch_one=True
-        )['count']
-
-        stats['valor_inventario'] = execute_query(
-            "SELECT COALESCE(SUM(cantidad_actual * precio_venta), 0) as total FROM repuestos WHERE activo = TRUE",
-            fetch_one=True
-        )['total'] or 0
+        # Agregados mantenidos por triggers (sin recorrer repuestos)
+        valorizacion = valorizacion_total()
+        stats['total_repuestos'] = valorizacion['repuestos']
+        stats['valor_inventario'] = valorizacion['valor']
 
         stats['alertas_activas'] = execute_query(
             "SELECT COUNT(*) as count FROM alertas_inventario WHERE estado IN ('NUEVA', 'EN_PROCESO')",
@@ -253,12 +408,24 @@ def create_app(config_name='default'):
         page = request.args.get('page', 1, type=int)
         search = request.args.get('search', '')
         categoria_id = request.args.get('categoria', type=int)
+        clase_abc = request.args.get('clase_abc', '')
+        clase_xyz = request.args.get('clase_xyz', '')
 
         per_page = app.config['ITEMS_PER_PAGE']
         offset = (page - 1) * per_page
 
-        where_clauses = ["r.activo = TRUE"]
+        # Clasificación ABC/XYZ vigente (última calculada)
+        fecha_clasificacion = fecha_clasificacion_vigente()
+        join_clasificacion = ""
         params = []
+        if fecha_clasificacion:
+            join_clasificacion = """
+                LEFT JOIN clasificacion_repuestos cl
+                ON cl.repuesto_id = r.id AND cl.fecha_calculo = %s
+            """
+            params.append(fecha_clasificacion)
+
+        where_clauses = ["r.activo = TRUE"]
 
         if search:
             where_clauses.append("(r.codigo LIKE %s OR r.nombre LIKE %s)")
@@ -269,10 +436,21 @@ def create_app(config_name='default'):
             where_clauses.append("r.categoria_id = %s")
             params.append(categoria_id)
 
+        if fecha_clasificacion and clase_abc in CLASES_ABC:
+            where_clauses.append("cl.clase_abc = %s")
+            params.append(clase_abc)
+
+        # 'N' = sin demanda en el período (clase XYZ vacía)
+        if fecha_clasificacion and clase_xyz == 'N':
+            where_clauses.append("cl.repuesto_id IS NOT NULL AND cl.clase_xyz IS NULL")
+        elif fecha_clasificacion and clase_xyz in CLASES_XYZ:
+            where_clauses.append("cl.clase_xyz = %s")
+            params.append(clase_xyz)
+
         where_sql = " AND ".join(where_clauses)
 
         total = execute_query(
-            f"SELECT COUNT(*) as count FROM repuestos r WHERE {where_sql}",
+            f"SELECT COUNT(*) as count FROM repuestos r {join_clasificacion} WHERE {where_sql}",
             tuple(params), fetch_one=True
         )['count']
 
@@ -280,8 +458,10 @@ def create_app(config_name='default'):
         repuestos = execute_query(f"""
             SELECT r.*, c.nombre as categoria_nombre,
                    (r.cantidad_actual - r.cantidad_reservada) as disponible
+                   {', cl.clase_abc, cl.clase_xyz' if fecha_clasificacion else ''}
             FROM repuestos r
             LEFT JOIN categorias_repuestos c ON r.categoria_id = c.id
+            {join_clasificacion}
             WHERE {where_sql}
             ORDER BY r.nombre ASC
             LIMIT %s OFFSET %s
@@ -296,11 +476,15 @@ def create_app(config_name='default'):
 
         return render_template('repuestos/lista.html',
                              repuestos=repuestos,
+                             miniaturas=miniaturas_principales([r['id'] for r in repuestos]),
                              categorias=categorias,
                              page=page,
                              total_pages=total_pages,
                              search=search,
-                             categoria_id=categoria_id)
+                             categoria_id=categoria_id,
+                             clase_abc=clase_abc,
+                             clase_xyz=clase_xyz,
+                             fecha_clasificacion=fecha_clasificacion)
 
     @app.route('/repuestos/nuevo', methods=['GET', 'POST'])
     @role_required('ADMINISTRADOR', 'ALMACENISTA')
@@ -408,12 +592,9 @@ def create_app(config_name='default'):
             "SELECT * FROM categorias_repuestos WHERE activo = TRUE ORDER BY nombre",
             fetch_all=True
         )
-        # Obtener imágenes existentes
-        imagenes = execute_query(
-            "SELECT * FROM imagenes_repuestos WHERE repuesto_id = %s ORDER BY es_principal DESC, orden",
-            (id,), fetch_all=True
-        )
-        return render_template('repuestos/form.html', categorias=categorias, repuesto=repuesto, imagenes=imagenes)
+        return render_template('repuestos/form.html', categorias=categorias, repuesto=repuesto,
+                             imagenes=imagenes_repuesto(id),
+                             pronostico=pronostico_repuesto(id))
 
     @app.route('/repuestos/<int:id>/eliminar', methods=['POST'])
     @role_required('ADMINISTRADOR')
@@ -466,7 +647,7 @@ def create_app(config_name='default'):
                         "UPDATE repuestos SET cantidad_actual = %s, updated_by = %s WHERE id = %s",
                         (nueva_cantidad, user['id'], id), commit=True
                     )
-                    verificar_alertas(id)
+                    verificar_alertas_stock([id])
                     flash('Cantidad ajustada exitosamente', 'success')
                 else:
                     # Almacenista: crear ajuste PENDIENTE
@@ -524,7 +705,7 @@ def create_app(config_name='default'):
             FROM historial_ajustes_inventario h
             JOIN repuestos r ON h.repuesto_id = r.id
             JOIN usuarios u ON h.usuario_id = u.id
-            WHERE h.estado = 'PENDIENTE'
+            WHERE h.estado = 'PENDIENTE' AND h.sesion_conteo_id IS NULL
             ORDER BY h.created_at DESC
         """, fetch_all=True)
         return render_template('repuestos/ajustes_pendientes.html', ajustes=ajustes)
@@ -535,7 +716,7 @@ def create_app(config_name='default'):
         try:
             user = get_current_user()
             ajuste = execute_query(
-                "SELECT * FROM historial_ajustes_inventario WHERE id = %s AND estado = 'PENDIENTE'",
+                "SELECT * FROM historial_ajustes_inventario WHERE id = %s AND estado = 'PENDIENTE' AND sesion_conteo_id IS NULL",
                 (id,), fetch_one=True
             )
             if not ajuste:
@@ -552,7 +733,7 @@ def create_app(config_name='default'):
                 "UPDATE repuestos SET cantidad_actual = %s, updated_by = %s WHERE id = %s",
                 (ajuste['cantidad_nueva'], user['id'], ajuste['repuesto_id']), commit=True
             )
-            verificar_alertas(ajuste['repuesto_id'])
+            verificar_alertas_stock([ajuste['repuesto_id']])
 
             registrar_audit_log(
                 usuario_id=user['id'], tabla='historial_ajustes_inventario', registro_id=id,
@@ -576,7 +757,7 @@ def create_app(config_name='default'):
             execute_query("""
                 UPDATE historial_ajustes_inventario
                 SET estado = 'RECHAZADO', aprobado_por = %s, fecha_aprobacion = NOW(), motivo_rechazo = %s
-                WHERE id = %s AND estado = 'PENDIENTE'
+                WHERE id = %s AND estado = 'PENDIENTE' AND sesion_conteo_id IS NULL
             """, (user['id'], motivo, id), commit=True)
 
             registrar_audit_log(
@@ -595,12 +776,7 @@ def create_app(config_name='default'):
     @role_required('ADMINISTRADOR', 'ALMACENISTA')
     def eliminar_imagen_repuesto(id):
         try:
-            imagen = execute_query("SELECT * FROM imagenes_repuestos WHERE id = %s", (id,), fetch_one=True)
-            if imagen:
-                filepath = os.path.join(app.config.get('UPLOAD_FOLDER', 'static/uploads'), 'repuestos', imagen['nombre_archivo'])
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                execute_query("DELETE FROM imagenes_repuestos WHERE id = %s", (id,), commit=True)
+            if eliminar_imagen(id):
                 flash('Imagen eliminada', 'success')
         except Exception as e:
             logger.error(f"Error eliminando imagen: {e}")
@@ -692,7 +868,7 @@ def create_app(config_name='default'):
                     WHERE id = %s
                 """, (cantidad, user['id'], repuesto_id), commit=True)
 
-                verificar_alertas(repuesto_id)
+                verificar_alertas_stock([repuesto_id])
 
                 registrar_audit_log(
                     usuario_id=user['id'], tabla='movimientos_inventario', registro_id=mov_id,
@@ -711,16 +887,13 @@ def create_app(config_name='default'):
             "SELECT * FROM categorias_repuestos WHERE activo = TRUE ORDER BY nombre",
             fetch_all=True
         )
-        repuestos = execute_query(
-            "SELECT id, codigo, nombre, categoria_id FROM repuestos WHERE activo = TRUE ORDER BY nombre",
-            fetch_all=True
-        )
+        # Los repuestos se cargan en el navegador desde /api/catalogo
         tipos_movimiento = execute_query(
             "SELECT * FROM tipos_movimiento WHERE tipo = 'ENTRADA' ORDER BY nombre",
             fetch_all=True
         )
         return render_template('movimientos/entrada.html',
-                             repuestos=repuestos, categorias=categorias,
+                             categorias=categorias,
                              tipos_movimiento=tipos_movimiento)
 
     @app.route('/movimientos/salida', methods=['GET', 'POST'])
@@ -735,18 +908,14 @@ def create_app(config_name='default'):
                 vehiculo_cliente_id = request.form.get('vehiculo_cliente_id') or None
                 user = get_current_user()
 
-                # Verificar stock disponible (actual - reservado)
-                repuesto = execute_query(
-                    "SELECT cantidad_actual, cantidad_reservada, nombre FROM repuestos WHERE id = %s",
-                    (repuesto_id,), fetch_one=True
-                )
-                disponible = repuesto['cantidad_actual'] - repuesto['cantidad_reservada']
-
-                if disponible < cantidad:
+                # Reservar stock verificando disponibilidad en la misma sentencia.
+                # No deducir de cantidad_actual, solo reservar
+                if not reservar_stock(repuesto_id, cantidad, user['id'], commit=False):
+                    disponible = stock_disponible(repuesto_id)
                     flash(f'Stock disponible insuficiente. Disponible: {disponible}', 'danger')
                     return redirect(url_for('salida_inventario'))
 
-                # CAMBIO: No deducir de cantidad_actual, solo reservar
+                # El commit del movimiento confirma también la reserva
                 mov_id = execute_query("""
                     INSERT INTO movimientos_inventario
                     (repuesto_id, tipo_movimiento_id, cantidad, usuario_id,
@@ -758,14 +927,7 @@ def create_app(config_name='default'):
                     request.form.get('observaciones', '')
                 ), commit=True)
 
-                # Solo reservar, no deducir
-                execute_query("""
-                    UPDATE repuestos
-                    SET cantidad_reservada = cantidad_reservada + %s, updated_by = %s
-                    WHERE id = %s
-                """, (cantidad, user['id'], repuesto_id), commit=True)
-
-                verificar_alertas(repuesto_id)
+                verificar_alertas_stock([repuesto_id])
 
                 registrar_audit_log(
                     usuario_id=user['id'], tabla='movimientos_inventario', registro_id=mov_id,
@@ -784,11 +946,7 @@ def create_app(config_name='default'):
             "SELECT * FROM categorias_repuestos WHERE activo = TRUE ORDER BY nombre",
             fetch_all=True
         )
-        repuestos = execute_query("""
-            SELECT id, codigo, nombre, cantidad_actual, cantidad_reservada,
-                   (cantidad_actual - cantidad_reservada) as disponible, categoria_id
-            FROM repuestos WHERE activo = TRUE ORDER BY nombre
-        """, fetch_all=True)
+        # Repuestos y clientes se cargan en el navegador desde /api/catalogo
         tipos_movimiento = execute_query(
             "SELECT * FROM tipos_movimiento WHERE tipo = 'SALIDA' ORDER BY nombre",
             fetch_all=True
@@ -799,14 +957,10 @@ def create_app(config_name='default'):
             WHERE r.nombre = 'TECNICO' AND u.activo = TRUE
             ORDER BY u.nombre_completo
         """, fetch_all=True)
-        clientes = execute_query(
-            "SELECT id, nombre_completo, numero_documento FROM clientes WHERE activo = TRUE ORDER BY nombre_completo",
-            fetch_all=True
-        )
         return render_template('movimientos/salida.html',
-                             repuestos=repuestos, categorias=categorias,
+                             categorias=categorias,
                              tipos_movimiento=tipos_movimiento,
-                             tecnicos=tecnicos, clientes=clientes)
+                             tecnicos=tecnicos)
 
     # Transiciones de estado de movimientos
     @app.route('/movimientos/<int:id>/aprobar', methods=['POST'])
@@ -819,11 +973,14 @@ def create_app(config_name='default'):
                 flash('Movimiento no encontrado o no está pendiente', 'warning')
                 return redirect(url_for('lista_movimientos'))
 
-            execute_query("""
+            # Solo desde PENDIENTE: un rechazo simultáneo ya liberó la reserva
+            if execute_update("""
                 UPDATE movimientos_inventario
                 SET estado = 'APROBADO', aprobado_por = %s, fecha_aprobacion = NOW()
-                WHERE id = %s
-            """, (user['id'], id), commit=True)
+                WHERE id = %s AND estado = 'PENDIENTE'
+            """, (user['id'], id), commit=True) != 1:
+                flash('El movimiento ya no está pendiente', 'warning')
+                return redirect(url_for('lista_movimientos'))
 
             registrar_audit_log(
                 usuario_id=user['id'], tabla='movimientos_inventario', registro_id=id,
@@ -847,19 +1004,23 @@ def create_app(config_name='default'):
 
             motivo = request.form.get('motivo_rechazo', '')
 
-            # Liberar reserva
-            execute_query("""
-                UPDATE repuestos SET cantidad_reservada = GREATEST(cantidad_reservada - %s, 0)
-                WHERE id = %s
-            """, (mov['cantidad'], mov['repuesto_id']), commit=True)
-
-            execute_query("""
-                UPDATE movimientos_inventario
-                SET estado = 'RECHAZADO', aprobado_por = %s, fecha_aprobacion = NOW(), motivo_rechazo = %s
-                WHERE id = %s
-            """, (user['id'], motivo, id), commit=True)
+            # Primero el cambio de estado condicionado: solo quien lo logra libera la
+            # reserva (una sola vez aunque haya rechazos o aprobaciones simultáneos)
+            with transaccion():
+                rechazado = execute_update("""
+                    UPDATE movimientos_inventario
+                    SET estado = 'RECHAZADO', aprobado_por = %s, fecha_aprobacion = NOW(), motivo_rechazo = %s
+                    WHERE id = %s AND estado = 'PENDIENTE'
+                """, (user['id'], motivo, id)) == 1
+                if rechazado and not liberar_reserva(mov['repuesto_id'], mov['cantidad'],
+                                                     user['id'], commit=False):
+                    raise ReservaInsuficiente()
+
+            if not rechazado:
+                flash('El movimiento ya no está pendiente', 'warning')
+                return redirect(url_for('lista_movimientos'))
 
-            verificar_alertas(mov['repuesto_id'])
+            verificar_alertas_stock([mov['repuesto_id']])
 
             registrar_audit_log(
                 usuario_id=user['id'], tabla='movimientos_inventario', registro_id=id,
@@ -867,6 +1028,9 @@ def create_app(config_name='default'):
                 datos_nuevos={'motivo_rechazo': motivo}
             )
             flash('Movimiento rechazado y reserva liberada', 'info')
+        except ReservaInsuficiente:
+            flash('La reserva del repuesto es menor que la cantidad del movimiento: no se rechazó. '
+                  'Revise la conciliación de stock.', 'danger')
         except Exception as e:
             logger.error(f"Error rechazando movimiento: {e}")
             flash('Error al rechazar el movimiento', 'danger')
@@ -909,13 +1073,16 @@ def create_app(config_name='default'):
         params = []
 
         if search:
-            where_clauses.append("""
-                (c.numero_documento LIKE %s OR c.nombre_completo LIKE %s OR
-                 EXISTS (SELECT 1 FROM vehiculos_clientes vc
-                         WHERE vc.cliente_id = c.id AND vc.placa LIKE %s AND vc.activo = TRUE))
-            """)
             search_param = f"%{search}%"
-            params.extend([search_param, search_param, search_param])
+            condiciones = ["c.numero_documento LIKE %s", "c.nombre_completo LIKE %s"]
+            params.extend([search_param, search_param])
+            placa_param = patron_placa(search)
+            if placa_param:
+                # Prefijo sobre la clave normalizada: recorre idx_placa_normalizada
+                condiciones.append("""c.id IN (SELECT vc.cliente_id FROM vehiculos_clientes vc
+                                       WHERE vc.placa_normalizada LIKE %s AND vc.activo = TRUE)""")
+                params.append(placa_param)
+            where_clauses.append(f"({' OR '.join(condiciones)})")
 
         where_sql = " AND ".join(where_clauses)
 
@@ -926,13 +1093,7 @@ def create_app(config_name='default'):
 
         params.extend([per_page, offset])
         clientes = execute_query(f"""
-            SELECT c.*,
-                   (SELECT COUNT(*) FROM vehiculos_clientes vc
-                    WHERE vc.cliente_id = c.id AND vc.activo = TRUE) as total_vehiculos,
-                   (SELECT GROUP_CONCAT(vc.placa SEPARATOR ', ')
-                    FROM vehiculos_clientes vc
-                    WHERE vc.cliente_id = c.id AND vc.activo = TRUE
-                    LIMIT 3) as placas_vehiculos
+            SELECT c.*
             FROM clientes c
             WHERE {where_sql}
             ORDER BY c.nombre_completo ASC
@@ -1055,7 +1216,7 @@ def create_app(config_name='default'):
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
                 """, (
                     cliente_id,
-                    request.form['placa'].upper(),
+                    normalizar_placa(request.form['placa']),
                     request.form['modelo_vehiculo_id'],
                     request.form.get('anio') or None,
                     request.form.get('color', ''),
@@ -1068,7 +1229,7 @@ def create_app(config_name='default'):
                 registrar_audit_log(
                     usuario_id=user['id'], tabla='vehiculos_clientes', registro_id=vehiculo_id,
                     accion='CREAR', tipo_cambio='VEHICULO',
-                    datos_nuevos={'placa': request.form['placa'].upper(), 'cliente_id': cliente_id}
+                    datos_nuevos={'placa': normalizar_placa(request.form['placa']), 'cliente_id': cliente_id}
                 )
 
                 flash('Vehículo registrado exitosamente', 'success')
@@ -1105,7 +1266,7 @@ def create_app(config_name='default'):
                         numero_motor = %s, numero_chasis = %s, kilometraje_actual = %s, observaciones = %s
                     WHERE id = %s
                 """, (
-                    request.form['placa'].upper(),
+                    normalizar_placa(request.form['placa']),
                     request.form['modelo_vehiculo_id'],
                     request.form.get('anio') or None,
                     request.form.get('color', ''),
@@ -1119,7 +1280,7 @@ def create_app(config_name='default'):
                 registrar_audit_log(
                     usuario_id=user['id'], tabla='vehiculos_clientes', registro_id=id,
                     accion='ACTUALIZAR', tipo_cambio='VEHICULO',
-                    datos_nuevos={'placa': request.form['placa'].upper()}
+                    datos_nuevos={'placa': normalizar_placa(request.form['placa'])}
                 )
 
                 flash('Vehículo actualizado exitosamente', 'success')
@@ -1301,89 +1462,11 @@ def create_app(config_name='default'):
 
     # ==================== FUNCIONES AUXILIARES ====================
 
-    def verificar_alertas(repuesto_id):
-        """Verifica y crea alertas de inventario (compatible con esquema v3)"""
-        repuesto = execute_query("""
-            SELECT id, codigo, nombre, cantidad_actual, cantidad_minima, cantidad_reservada
-            FROM repuestos WHERE id = %s
-        """, (repuesto_id,), fetch_one=True)
-
-        if not repuesto:
-            return
-
-        stock_disponible = repuesto['cantidad_actual'] - repuesto.get('cantidad_reservada', 0)
-
-        if repuesto['cantidad_actual'] > repuesto['cantidad_minima']:
-            execute_query("""
-                UPDATE alertas_inventario
-                SET estado = 'RESUELTA', fecha_resolucion = NOW()
-                WHERE repuesto_id = %s AND estado IN ('NUEVA', 'EN_PROCESO')
-                AND tipo_alerta IN ('STOCK_BAJO', 'AGOTADO')
-            """, (repuesto_id,), commit=True)
-            return
-
-        if repuesto['cantidad_actual'] == 0:
-            tipo_alerta = 'AGOTADO'
-            nivel = 'CRITICA'
-            mensaje = f"El repuesto {repuesto['nombre']} ({repuesto['codigo']}) está AGOTADO"
-        elif repuesto['cantidad_actual'] <= repuesto['cantidad_minima']:
-            tipo_alerta = 'STOCK_BAJO'
-            nivel = 'ALTA'
-            mensaje = f"El repuesto {repuesto['nombre']} ({repuesto['codigo']}) tiene stock bajo: {repuesto['cantidad_actual']} unidades (disponible: {stock_disponible})"
-        else:
-            return
-
-        alerta_existente = execute_query("""
-            SELECT id FROM alertas_inventario
-            WHERE repuesto_id = %s AND estado IN ('NUEVA', 'EN_PROCESO') AND tipo_alerta = %s
-        """, (repuesto_id, tipo_alerta), fetch_one=True)
-
-        if not alerta_existente:
-            alerta_id = execute_query("""
-                INSERT INTO alertas_inventario
-                (repuesto_id, tipo_alerta, nivel_prioridad, mensaje)
-                VALUES (%s, %s, %s, %s)
-            """, (repuesto_id, tipo_alerta, nivel, mensaje), commit=True)
-
-            usuarios_notificar = execute_query("""
-                SELECT u.id FROM usuarios u
-                JOIN roles r ON u.rol_id = r.id
-                WHERE r.nombre IN ('SUPER_USUARIO', 'ADMINISTRADOR', 'ALMACENISTA') AND u.activo = TRUE
-            """, fetch_all=True)
-
-            for usuario in usuarios_notificar:
-                execute_query("""
-                    INSERT IGNORE INTO notificaciones_usuarios (usuario_id, alerta_id)
-                    VALUES (%s, %s)
-                """, (usuario['id'], alerta_id), commit=True)
-
     def _procesar_imagenes_repuesto(repuesto_id, user_id):
-        """Procesa y guarda imágenes subidas para un repuesto"""
+        """Guarda las imágenes subidas para un repuesto (las variantes se generan en segundo plano)"""
         if 'imagenes' not in request.files:
             return
-        archivos = request.files.getlist('imagenes')
-        allowed = app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'gif', 'webp'})
-        upload_dir = os.path.join(app.config.get('UPLOAD_FOLDER', 'static/uploads'), 'repuestos')
-
-        for archivo in archivos:
-            if archivo and archivo.filename:
-                ext = archivo.filename.rsplit('.', 1)[-1].lower() if '.' in archivo.filename else ''
-                if ext not in allowed:
-                    continue
-                filename = secure_filename(f"rep_{repuesto_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{archivo.filename}")
-                filepath = os.path.join(upload_dir, filename)
-                archivo.save(filepath)
-
-                # Verificar si es la primera imagen (hacerla principal)
-                count = execute_query(
-                    "SELECT COUNT(*) as c FROM imagenes_repuestos WHERE repuesto_id = %s",
-                    (repuesto_id,), fetch_one=True
-                )['c']
-
-                execute_query("""
-                    INSERT INTO imagenes_repuestos (repuesto_id, nombre_archivo, ruta_archivo, es_principal, created_by)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (repuesto_id, filename, f"uploads/repuestos/{filename}", count == 0, user_id), commit=True)
+        guardar_imagenes(repuesto_id, request.files.getlist('imagenes'), user_id)
 
     # ==================== API ENDPOINTS ====================
 
@@ -1418,68 +1501,84 @@ def create_app(config_name='default'):
     @app.route('/api/repuestos/por-categoria/<int:categoria_id>')
     @login_required
     def api_repuestos_por_categoria(categoria_id):
-        """Obtener repuestos filtrados por categoría"""
+        """
+        Obtener repuestos filtrados por categoría. Sin cantidades: el stock no cambia la
+        versión del catálogo y se consulta al elegir el repuesto (/disponibilidad)
+        """
+        version = versiones_catalogo('repuestos')['repuestos']
+        etag, modificado = validadores('repcat', categoria_id, version['version'],
+                                       fechas=[version['updated_at']])
+        respuesta = no_modificado(etag, modificado)
+        if respuesta:
+            return respuesta
+
         repuestos = execute_query("""
-            SELECT id, codigo, nombre, cantidad_actual, cantidad_reservada,
-                   (cantidad_actual - cantidad_reservada) as disponible, precio_venta
+            SELECT id, codigo, nombre, precio_venta
             FROM repuestos
             WHERE categoria_id = %s AND activo = TRUE
             ORDER BY nombre ASC
         """, (categoria_id,), fetch_all=True)
-        return jsonify([dict(r) for r in repuestos])
+        return json_con_validadores([dict(r) for r in repuestos], etag, modificado)
 
-    @app.route('/api/repuestos/<int:id>/detalle')
+    @app.route('/api/repuestos/<int:id>/disponibilidad')
     @login_required
-    def api_repuesto_detalle(id):
-        """API para obtener detalle completo de un repuesto"""
+    def api_repuesto_disponibilidad(id):
+        """Stock actual de un repuesto al elegirlo en un formulario (no pasa por el catálogo)"""
         repuesto = execute_query("""
-            SELECT r.*, c.nombre as categoria_nombre
-            FROM repuestos r
-            LEFT JOIN categorias_repuestos c ON r.categoria_id = c.id
-            WHERE r.id = %s
+            SELECT id, cantidad_actual, cantidad_reservada,
+                   (cantidad_actual - cantidad_reservada) as disponible
+            FROM repuestos
+            WHERE id = %s AND activo = TRUE
         """, (id,), fetch_one=True)
-
         if not repuesto:
             return jsonify({'error': 'No encontrado'}), 404
+        respuesta = jsonify(dict(repuesto))
+        respuesta.headers['Cache-Control'] = 'no-store'
+        return respuesta
 
-        imagenes = execute_query(
-            "SELECT id, nombre_archivo, ruta_archivo, es_principal FROM imagenes_repuestos WHERE repuesto_id = %s ORDER BY es_principal DESC, orden",
-            (id,), fetch_all=True
-        )
-
-        compatibilidad = execute_query("""
-            SELECT rc.*, mv.nombre as modelo, ma.nombre as marca
-            FROM repuestos_compatibilidad rc
-            JOIN modelos_vehiculos mv ON rc.modelo_vehiculo_id = mv.id
-            JOIN marcas_vehiculos ma ON mv.marca_id = ma.id
-            WHERE rc.repuesto_id = %s
-        """, (id,), fetch_all=True)
-
-        equivalentes = execute_query(
-            "SELECT * FROM repuestos_equivalentes WHERE repuesto_id = %s",
-            (id,), fetch_all=True
-        )
-
-        data = dict(repuesto)
-        data['precio_venta'] = str(data.get('precio_venta', 0))
-        data['imagenes'] = [dict(i) for i in imagenes]
-        data['compatibilidad'] = [dict(c) for c in compatibilidad]
-        data['equivalentes'] = [dict(e) for e in equivalentes]
-        data['disponible'] = data.get('cantidad_actual', 0) - data.get('cantidad_reservada', 0)
+    @app.route('/api/repuestos/<int:id>/detalle')
+    @login_required
+    def api_repuesto_detalle(id):
+        """API para obtener detalle completo de un repuesto"""
+        # Validadores: versión de la fila y de las tablas relacionadas (sin armar el detalle)
+        validez = validadores_detalle(id)
+        if not validez:
+            return jsonify({'error': 'No encontrado'}), 404
+        etag, modificado = validez
+        respuesta = no_modificado(etag, modificado)
+        if respuesta:
+            return respuesta
 
-        return jsonify(data)
+        data = detalle_repuesto(id, etag, app.config.get('DETALLE_REPUESTOS_CACHE', 500))
+        if data is None:
+            return jsonify({'error': 'No encontrado'}), 404
+        return json_con_validadores(data, etag, modificado)
 
     @app.route('/api/vehiculos-cliente/<int:cliente_id>')
     @login_required
     def api_vehiculos_cliente(cliente_id):
+        version = versiones_catalogo('vehiculos')['vehiculos']
+        etag, modificado = validadores('veh', cliente_id, version['version'], fechas=[version['updated_at']])
+        respuesta = no_modificado(etag, modificado)
+        if respuesta:
+            return respuesta
+
         vehiculos = execute_query("""
-            SELECT vc.id, vc.placa, mv.nombre as modelo, ma.nombre as marca
+            SELECT vc.id, vc.placa, vc.anio, mv.nombre as modelo, ma.nombre as marca
             FROM vehiculos_clientes vc
             JOIN modelos_vehiculos mv ON vc.modelo_vehiculo_id = mv.id
             JOIN marcas_vehiculos ma ON mv.marca_id = ma.id
             WHERE vc.cliente_id = %s AND vc.activo = TRUE
             ORDER BY vc.placa ASC
         """, (cliente_id,), fetch_all=True)
+        return json_con_validadores([dict(v) for v in vehiculos], etag, modificado)
+
+    @app.route('/api/vehiculos/por-placa')
+    @login_required
+    def api_vehiculos_por_placa():
+        """Vehículos y su cliente por placa completa o prefijo (?placa=ABC1)"""
+        limite = max(1, min(request.args.get('limite', 10, type=int), 50))
+        vehiculos = buscar_por_placa(request.args.get('placa', ''), limite)
         return jsonify([dict(v) for v in vehiculos])
 
     @app.route('/api/notificaciones')
@@ -1516,6 +1615,10 @@ def create_app(config_name='default'):
         """, (user['id'],), fetch_one=True)
         return jsonify({'count': result['count']})
 
+    # Compilar las plantillas antes de la primera petición (con los filtros ya registrados)
+    if app.config.get('PLANTILLAS_PRECOMPILAR', True):
+        precompilar_plantillas(app)
+
     return app
 
 if __name__ == '__main__':
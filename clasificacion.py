@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Clasificación ABC/XYZ de repuestos
+- ABC: participación acumulada en los ingresos facturados (A hasta 80 %, B hasta 95 %, C resto)
+- XYZ: variabilidad de la demanda por períodos (coeficiente de variación);
+  sin demanda en el período la clase XYZ queda vacía (inventario sin rotación)
+- Un solo cálculo vectorial con NumPy sobre arreglos agregados de todo el catálogo
+- Se guarda por repuesto con la fecha de cálculo (clasificacion_repuestos)
+
+NumPy es opcional: sin él la aplicación funciona y solo el cálculo no está disponible.
+"""
+
+from database import execute_query, execute_many, get_db, transaccion
+from pronostico import cargar_consumo_diario, numpy_disponible
+from datetime import date, timedelta
+import logging
+import time
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dependencia opcional
+    np = None
+
+logger = logging.getLogger(__name__)
+
+CLASES_ABC = ('A', 'B', 'C')
+CLASES_XYZ = ('X', 'Y', 'Z')
+
+
+def fecha_clasificacion_vigente():
+    """Fecha de la última clasificación calculada (None si no hay)"""
+    fila = execute_query("SELECT MAX(fecha_calculo) as fecha FROM clasificacion_repuestos", fetch_one=True)
+    return fila['fecha'] if fila else None
+
+
+def clasificar_inventario(dias=365, periodo_dias=30, limite_a=0.80, limite_b=0.95,
+                          limite_x=0.5, limite_y=1.0):
+    """
+    Calcula y guarda la clasificación ABC/XYZ de los repuestos activos.
+
+    Args:
+        dias: Días de historia (facturas pagadas y consumo)
+        periodo_dias: Tamaño del período para medir la variabilidad de la demanda
+        limite_a/limite_b: Participación acumulada de ingresos hasta la que un repuesto es A/B
+        limite_x/limite_y: Coeficiente de variación máximo para X/Y
+
+    Returns:
+        Dict con 'fecha', 'repuestos', 'matriz' ({'AX': n, ...}), 'sin_demanda' y 'segundos'
+    """
+    if not numpy_disponible():
+        raise RuntimeError('La clasificación ABC/XYZ requiere NumPy (pip install numpy)')
+
+    inicio = time.monotonic()
+    get_db().commit()
+    hoy = date.today()
+    desde = hoy - timedelta(days=dias)
+
+    ids = np.fromiter(
+        (r['id'] for r in execute_query("SELECT id FROM repuestos WHERE activo = TRUE ORDER BY id",
+                                        fetch_all=True)),
+        dtype=np.int64
+    )
+    n = len(ids)
+    resultado = {'fecha': hoy, 'repuestos': n, 'matriz': {}, 'sin_demanda': 0}
+    if not n:
+        resultado['segundos'] = round(time.monotonic() - inicio, 2)
+        return resultado
+
+    # Ingresos por repuesto (facturas pagadas del período)
+    ventas = execute_query("""
+        SELECT df.repuesto_id, SUM(df.subtotal) as ingresos
+        FROM detalles_factura df
+        JOIN facturas f ON df.factura_id = f.id
+        WHERE f.estado = 'PAGADA' AND f.created_at >= %s
+        GROUP BY df.repuesto_id
+    """, (desde,), fetch_all=True)
+    ingresos = np.zeros(n)
+    if ventas:
+        venta_ids = np.fromiter((v['repuesto_id'] for v in ventas), dtype=np.int64, count=len(ventas))
+        montos = np.fromiter((float(v['ingresos'] or 0) for v in ventas), dtype=np.float64, count=len(ventas))
+        posicion = np.minimum(np.searchsorted(ids, venta_ids), n - 1)
+        validos = ids[posicion] == venta_ids
+        np.add.at(ingresos, posicion[validos], montos[validos])
+
+    # ABC: orden por ingresos y participación acumulada antes de cada repuesto
+    total = ingresos.sum()
+    orden = np.argsort(-ingresos, kind='stable')
+    participacion = ingresos / total if total > 0 else np.zeros(n)
+    acumulada = np.empty(n)
+    acumulada[orden] = np.cumsum(participacion[orden])
+    previa = acumulada - participacion
+    abc = np.where(previa < limite_a, 0, np.where(previa < limite_b, 1, 2))
+    abc[ingresos <= 0] = 2
+
+    # XYZ: demanda por período (matriz repuestos x períodos) y su coeficiente de variación
+    periodos = max(dias // periodo_dias, 1)
+    indice, dia, cantidad = cargar_consumo_diario(desde, ids)
+    periodo = np.minimum(dia // periodo_dias, periodos - 1)
+    demanda = np.bincount(indice * periodos + periodo, weights=cantidad,
+                          minlength=n * periodos).reshape(n, periodos)
+    media = demanda.mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cv = np.where(media > 0, demanda.std(axis=1) / media, np.nan)
+    xyz = np.where(cv <= limite_x, 0, np.where(cv <= limite_y, 1, 2))
+    sin_demanda = ~(media > 0)
+
+    filas = [
+        (int(ids[i]), hoy, CLASES_ABC[abc[i]],
+         None if sin_demanda[i] else CLASES_XYZ[xyz[i]],
+         round(float(ingresos[i]), 2), round(float(acumulada[i]), 6),
+         None if sin_demanda[i] else round(float(cv[i]), 4),
+         round(float(media[i]), 4))
+        for i in range(n)
+    ]
+    with transaccion():
+        for i in range(0, n, 5000):
+            execute_many("""
+                INSERT INTO clasificacion_repuestos
+                (repuesto_id, fecha_calculo, clase_abc, clase_xyz, ingresos,
+                 participacion_acumulada, coef_variacion, demanda_periodo)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    clase_abc = VALUES(clase_abc), clase_xyz = VALUES(clase_xyz),
+                    ingresos = VALUES(ingresos), participacion_acumulada = VALUES(participacion_acumulada),
+                    coef_variacion = VALUES(coef_variacion), demanda_periodo = VALUES(demanda_periodo)
+            """, filas[i:i + 5000], commit=False)
+
+    for a in range(3):
+        for x in range(3):
+            resultado['matriz'][CLASES_ABC[a] + CLASES_XYZ[x]] = int(((abc == a) & (xyz == x) & ~sin_demanda).sum())
+    resultado['sin_demanda'] = int(sin_demanda.sum())
+    resultado['segundos'] = round(time.monotonic() - inicio, 2)
+    logger.info(f"Clasificación ABC/XYZ: {n} repuestos, {resultado['sin_demanda']} sin demanda "
+                f"({resultado['segundos']} s)")
+    return resultado
+
+
+def resumen_clasificacion(limite_detalle=20):
+    """
+    Datos del reporte de clasificación a partir de la última clasificación guardada:
+    matriz ABC x XYZ (repuestos, ingresos, valor en stock), principales A e inventario sin rotación
+    """
+    fecha = fecha_clasificacion_vigente()
+    if not fecha:
+        return {'clasificacion_fecha': None}
+
+    matriz = execute_query("""
+        SELECT cl.clase_abc, IFNULL(cl.clase_xyz, '-') as clase_xyz,
+               COUNT(*) as repuestos, SUM(cl.ingresos) as ingresos,
+               SUM(r.cantidad_actual * r.precio_venta) as valor_stock
+        FROM clasificacion_repuestos cl
+        JOIN repuestos r ON cl.repuesto_id = r.id
+        WHERE cl.fecha_calculo = %s AND r.activo = TRUE
+        GROUP BY cl.clase_abc, IFNULL(cl.clase_xyz, '-')
+        ORDER BY cl.clase_abc, clase_xyz
+    """, (fecha,), fetch_all=True)
+
+    principales = execute_query("""
+        SELECT r.codigo, r.nombre, cl.clase_xyz, cl.ingresos, cl.participacion_acumulada
+        FROM clasificacion_repuestos cl
+        JOIN repuestos r ON cl.repuesto_id = r.id
+        WHERE cl.fecha_calculo = %s AND cl.clase_abc = 'A'
+        ORDER BY cl.ingresos DESC
+        LIMIT %s
+    """, (fecha, limite_detalle), fetch_all=True)
+
+    sin_rotacion = execute_query("""
+        SELECT r.codigo, r.nombre, r.cantidad_actual,
+               r.cantidad_actual * r.precio_venta as valor_stock
+        FROM clasificacion_repuestos cl
+        JOIN repuestos r ON cl.repuesto_id = r.id
+        WHERE cl.fecha_calculo = %s AND cl.clase_xyz IS NULL
+        AND r.activo = TRUE AND r.cantidad_actual > 0
+        ORDER BY valor_stock DESC
+        LIMIT %s
+    """, (fecha, limite_detalle), fetch_all=True)
+
+    return {
+        'clasificacion_fecha': fecha.isoformat(),
+        'clasificacion_matriz': [dict(m) for m in matriz],
+        'clasificacion_principales': [dict(p) for p in principales],
+        'clasificacion_sin_rotacion': [dict(s) for s in sin_rotacion]
+    }
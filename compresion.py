@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Compresión de respuestas (middleware WSGI)
+- Comprime con brotli (si está instalado y el cliente lo acepta) o gzip las respuestas
+  cuyo tipo está en la lista permitida y que superan un tamaño mínimo
+- No toca respuestas ya codificadas (catálogo en gzip, estáticos precomprimidos),
+  parciales, 204/304, HEAD ni las marcadas con Cache-Control: no-transform
+- Las respuestas generadas por partes (exportaciones CSV) se comprimen a medida que
+  llegan, sin acumularlas en memoria
+- Presupuesto de CPU por proceso: si se agota, las respuestas salen sin comprimir
+  hasta que se recupera (la red lenta no se cambia por un servidor saturado)
+
+brotli es opcional: sin él solo se usa gzip.
+"""
+
+import logging
+import threading
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dependencia opcional
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Entrada sin comprimir tras la cual se fuerza un flush en respuestas por partes
+_BLOQUE_FLUSH = 64 * 1024
+
+
+class PresupuestoCPU:
+    """
+    Cubeta de tokens de segundos de CPU: se recarga a 'por_segundo' segundos de CPU por
+    segundo de reloj, hasta 'rafaga'. Cada compresión descuenta el tiempo de CPU que usó.
+    """
+
+    def __init__(self, por_segundo, rafaga):
+        self.por_segundo = por_segundo
+        self.rafaga = rafaga
+        self._saldo = rafaga
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        self._saldo = min(self.rafaga, self._saldo + (ahora - self._ultimo) * self.por_segundo)
+        self._ultimo = ahora
+
+    def disponible(self):
+        with self._lock:
+            self._recargar()
+            return self._saldo > 0
+
+    def consumir(self, segundos):
+        with self._lock:
+            self._recargar()
+            self._saldo -= segundos
+
+
+class _Gzip:
+    nombre = 'gzip'
+
+    def __init__(self, nivel):
+        # wbits 16+: cabecera y cola gzip
+        self._z = zlib.compressobj(nivel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def comprimir(self, datos):
+        return self._z.compress(datos)
+
+    def flush(self):
+        return self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def terminar(self):
+        return self._z.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    nombre = 'br'
+
+    def __init__(self, nivel):
+        self._c = brotli.Compressor(quality=nivel)
+
+    def comprimir(self, datos):
+        return self._c.process(datos)
+
+    def flush(self):
+        return self._c.flush()
+
+    def terminar(self):
+        return self._c.finish()
+
+
+def _codificacion_aceptada(cabecera, permitir_brotli):
+    """'br', 'gzip' o None según Accept-Encoding (respeta q=0)"""
+    aceptadas = {}
+    for parte in cabecera.split(','):
+        valores = parte.strip().split(';')
+        nombre = valores[0].strip().lower()
+        if not nombre:
+            continue
+        q = 1.0
+        for v in valores[1:]:
+            v = v.strip()
+            if v.startswith('q='):
+                try:
+                    q = float(v[2:])
+                except ValueError:
+                    q = 0.0
+        aceptadas[nombre] = q
+    comodin = aceptadas.get('*', 0.0)
+    if permitir_brotli and aceptadas.get('br', comodin) > 0:
+        return 'br'
+    if aceptadas.get('gzip', comodin) > 0:
+        return 'gzip'
+    return None
+
+
+class MiddlewareCompresion:
+    """Middleware WSGI de compresión configurable (ver Config.COMPRESION_*)"""
+
+    def __init__(self, app, tipos, minimo_bytes=1024, nivel_gzip=6, nivel_brotli=4,
+                 usar_brotli=True, presupuesto=None):
+        self.app = app
+        self.tipos = frozenset(tipos)
+        self.minimo_bytes = minimo_bytes
+        self.nivel_gzip = nivel_gzip
+        self.nivel_brotli = nivel_brotli
+        self.usar_brotli = usar_brotli and brotli is not None
+        self.presupuesto = presupuesto
+
+    def _compresor(self, codificacion):
+        if codificacion == 'br':
+            return _Brotli(self.nivel_brotli)
+        return _Gzip(self.nivel_gzip)
+
+    def _elegible(self, estado, cabeceras):
+        """True si el tipo y el estado de la respuesta admiten compresión"""
+        codigo = estado.split(' ', 1)[0]
+        if codigo in ('204', '206', '304') or codigo.startswith('1'):
+            return False
+        tipo = ''
+        for nombre, valor in cabeceras:
+            nombre = nombre.lower()
+            if nombre == 'content-encoding' and valor.strip().lower() not in ('', 'identity'):
+                return False
+            if nombre == 'cache-control' and 'no-transform' in valor.lower():
+                return False
+            if nombre == 'content-type':
+                tipo = valor.split(';', 1)[0].strip().lower()
+        return tipo in self.tipos
+
+    def __call__(self, environ, start_response):
+        codificacion = None
+        if environ.get('REQUEST_METHOD') != 'HEAD':
+            codificacion = _codificacion_aceptada(environ.get('HTTP_ACCEPT_ENCODING', ''), self.usar_brotli)
+        if codificacion is None:
+            return self.app(environ, start_response)
+        return _RespuestaComprimible(self, environ, start_response, codificacion)
+
+
+class _RespuestaComprimible:
+    """
+    Iterable de respuesta: llama a start_response recién al conocer el primer bloque,
+    cuando ya se puede decidir si se comprime (tipo, tamaño y presupuesto).
+    """
+
+    def __init__(self, middleware, environ, start_response, codificacion):
+        self.middleware = middleware
+        self.start_response = start_response
+        self.codificacion = codificacion
+        self.estado = None
+        self.cabeceras = None
+        self.exc_info = None
+        self.escritos = []  # Bloques del write() heredado de WSGI
+        self.app_iter = middleware.app(environ, self._start_response)
+
+    def _start_response(self, estado, cabeceras, exc_info=None):
+        self.estado, self.cabeceras, self.exc_info = estado, cabeceras, exc_info
+        return self.escritos.append
+
+    def _iniciar(self, cabeceras):
+        self.start_response(self.estado, cabeceras, self.exc_info)
+
+    def _con_vary(self, cabeceras):
+        for i, (nombre, valor) in enumerate(cabeceras):
+            if nombre.lower() == 'vary':
+                if 'accept-encoding' not in valor.lower():
+                    cabeceras[i] = (nombre, f'{valor}, Accept-Encoding')
+                return cabeceras
+        cabeceras.append(('Vary', 'Accept-Encoding'))
+        return cabeceras
+
+    def _cabeceras_comprimidas(self):
+        cabeceras = []
+        for nombre, valor in self.cabeceras:
+            n = nombre.lower()
+            if n == 'content-length':
+                continue
+            if n == 'etag' and not valor.startswith('W/'):
+                # La representación comprimida no es idéntica byte a byte
+                valor = f'W/{valor}'
+            cabeceras.append((nombre, valor))
+        cabeceras.append(('Content-Encoding', self.codificacion))
+        return self._con_vary(cabeceras)
+
+    def _largo_declarado(self):
+        for nombre, valor in self.cabeceras:
+            if nombre.lower() == 'content-length':
+                try:
+                    return int(valor)
+                except ValueError:
+                    return None
+        return None
+
+    def __iter__(self):
+        m = self.middleware
+        iterador = iter(self.app_iter)
+        pendientes = list(self.escritos)
+        del self.escritos[:]
+        acumulado = sum(len(b) for b in pendientes)
+        terminado = False
+
+        # Aplicaciones que llaman a start_response al producir el primer bloque
+        if self.estado is None:
+            try:
+                pendientes.append(next(iterador))
+                acumulado += len(pendientes[-1])
+            except StopIteration:
+                terminado = True
+
+        elegible = self.estado is not None and m._elegible(self.estado, self.cabeceras)
+        largo = self._largo_declarado() if elegible else None
+
+        # Hasta decidir se acumulan bloques (como máximo el tamaño mínimo)
+        if elegible and not terminado and (largo is None or largo >= m.minimo_bytes):
+            while acumulado < m.minimo_bytes:
+                try:
+                    bloque = next(iterador)
+                except StopIteration:
+                    terminado = True
+                    break
+                if bloque:
+                    pendientes.append(bloque)
+                    acumulado += len(bloque)
+            # Los bloques de write() llegan durante la iteración
+            pendientes.extend(self.escritos)
+            acumulado += sum(len(b) for b in self.escritos)
+            del self.escritos[:]
+
+        comprimir = (elegible and acumulado >= m.minimo_bytes
+                     and (m.presupuesto is None or m.presupuesto.disponible()))
+
+        if not comprimir:
+            cabeceras = list(self.cabeceras or [])
+            if elegible:
+                cabeceras = self._con_vary(cabeceras)
+            self._iniciar(cabeceras)
+            yield from pendientes
+            if not terminado:
+                for bloque in iterador:
+                    yield from self.escritos
+                    del self.escritos[:]
+                    yield bloque
+            yield from self.escritos
+            return
+
+        self._iniciar(self._cabeceras_comprimidas())
+        compresor = m._compresor(self.codificacion)
+        cpu = 0.0
+        sin_flush = 0
+
+        inicio = time.thread_time()
+        salida = compresor.comprimir(b''.join(pendientes))
+        cpu += time.thread_time() - inicio
+        sin_flush += acumulado
+        if salida:
+            yield salida
+
+        if not terminado:
+            for bloque in iterador:
+                bloques = self.escritos + [bloque]
+                del self.escritos[:]
+                for b in bloques:
+                    if not b:
+                        continue
+                    inicio = time.thread_time()
+                    salida = compresor.comprimir(b)
+                    sin_flush += len(b)
+                    # Respuestas por partes: enviar lo comprimido cada cierto volumen
+                    if sin_flush >= _BLOQUE_FLUSH:
+                        salida += compresor.flush()
+                        sin_flush = 0
+                    cpu += time.thread_time() - inicio
+                    if salida:
+                        yield salida
+
+        inicio = time.thread_time()
+        salida = b''.join(compresor.comprimir(b) for b in self.escritos) + compresor.terminar()
+        cpu += time.thread_time() - inicio
+        if m.presupuesto is not None:
+            m.presupuesto.consumir(cpu)
+        yield salida
+
+    def close(self):
+        if hasattr(self.app_iter, 'close'):
+            self.app_iter.close()
+
+
+def init_compresion(app):
+    """Envuelve app.wsgi_app con el middleware según Config.COMPRESION_*"""
+    if not app.config.get('COMPRESION_HABILITADA', True):
+        return None
+    cpu_por_segundo = app.config.get('COMPRESION_CPU_POR_SEGUNDO', 0.5)
+    presupuesto = PresupuestoCPU(
+        cpu_por_segundo, app.config.get('COMPRESION_CPU_RAFAGA', 2.0)
+    ) if cpu_por_segundo else None
+    app.wsgi_app = MiddlewareCompresion(
+        app.wsgi_app,
+        tipos=app.config.get('COMPRESION_TIPOS', ('text/html', 'application/json')),
+        minimo_bytes=app.config.get('COMPRESION_MINIMO_BYTES', 1024),
+        nivel_gzip=app.config.get('COMPRESION_NIVEL_GZIP', 6),
+        nivel_brotli=app.config.get('COMPRESION_NIVEL_BROTLI', 4),
+        usar_brotli=app.config.get('COMPRESION_BROTLI', True),
+        presupuesto=presupuesto
+    )
+    return app.wsgi_app
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Conciliación de stock contra el kardex
+- Reproduce por repuesto, en orden cronológico, los movimientos confirmados/facturados
+  y los ajustes aprobados a partir del saldo inicial (cantidad_inicial)
+- Calcula la reserva esperada a partir de los documentos abiertos
+  (salidas pendientes/aprobadas e items de solicitudes sin facturar)
+- Recorre el catálogo por rangos de IDs leyendo los eventos con un cursor sin
+  buffer: la memoria no depende del número de movimientos
+- Reporta diferencias y, opcionalmente, registra ajustes de conciliación
+"""
+
+from database import execute_query, execute_update, get_db, transaccion
+from kardex import sql_eventos
+from pymysql.cursors import SSCursor
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+MOTIVO_CONCILIACION = 'Conciliación de kardex'
+MAX_DIFERENCIAS_REPORTE = 200
+
+
+def _sql_reservas(filtro):
+    """Reserva esperada por repuesto según los documentos abiertos"""
+    return f"""
+        SELECT repuesto_id, SUM(cantidad) as reservado
+        FROM (
+            SELECT m.repuesto_id, m.cantidad
+            FROM movimientos_inventario m
+            WHERE m.estado IN ('PENDIENTE', 'APROBADO')
+            AND m.repuesto_id {filtro}
+            UNION ALL
+            SELECT i.repuesto_id,
+                   CASE i.estado
+                       WHEN 'RESERVADO' THEN i.cantidad_solicitada
+                       WHEN 'APROBADO' THEN i.cantidad_aprobada - i.cantidad_devuelta
+                       ELSE i.cantidad_entregada - i.cantidad_devuelta
+                   END
+            FROM items_solicitud i
+            WHERE i.estado IN ('RESERVADO', 'APROBADO', 'ENTREGADO')
+            AND i.repuesto_id {filtro}
+        ) abiertos
+        GROUP BY repuesto_id
+    """
+
+
+def _conciliar_rango(desde, hasta, resultado):
+    """
+    Reproduce el kardex de un rango de IDs, suma los contadores al resultado
+    y devuelve las diferencias del rango
+    """
+    db = get_db()
+    db.commit()  # Instantánea nueva por rango (lecturas consistentes entre sí)
+
+    repuestos = execute_query("""
+        SELECT id, codigo, nombre, cantidad_actual, cantidad_reservada, cantidad_inicial
+        FROM repuestos
+        WHERE id BETWEEN %s AND %s
+        ORDER BY id
+    """, (desde, hasta), fetch_all=True)
+    if not repuestos:
+        return []
+
+    reservas = {f['repuesto_id']: int(f['reservado'] or 0) for f in execute_query(
+        _sql_reservas('BETWEEN %s AND %s'), (desde, hasta, desde, hasta), fetch_all=True
+    )}
+
+    diferencias = []
+    # Cursor sin buffer: las filas llegan del servidor a medida que se recorren
+    cursor = db.cursor(SSCursor)
+    try:
+        cursor.execute(sql_eventos('BETWEEN %s AND %s') + " ORDER BY 1, 2, 3, 4",
+                       (desde, hasta, desde, hasta))
+        evento = cursor.fetchone()
+
+        for r in repuestos:
+            saldo = r['cantidad_inicial'] or 0
+            negativo = None
+            while evento is not None and evento[0] <= r['id']:
+                if evento[0] == r['id']:
+                    saldo += evento[4]
+                    resultado['eventos'] += 1
+                    # Primer punto en que el kardex queda negativo: allí un GREATEST(..., 0)
+                    # o una salida sin stock ocultó la diferencia
+                    if saldo < 0 and negativo is None:
+                        negativo = {
+                            'fuente': 'movimiento' if evento[2] == 0 else 'ajuste',
+                            'id': evento[3], 'fecha': evento[1], 'saldo': saldo
+                        }
+                evento = cursor.fetchone()
+
+            reserva = reservas.get(r['id'], 0)
+            resultado['repuestos'] += 1
+            if saldo != r['cantidad_actual'] or reserva != r['cantidad_reservada'] or negativo:
+                diferencias.append({
+                    'repuesto_id': r['id'],
+                    'codigo': r['codigo'],
+                    'nombre': r['nombre'],
+                    'cantidad_actual': r['cantidad_actual'],
+                    'cantidad_esperada': saldo,
+                    'cantidad_reservada': r['cantidad_reservada'],
+                    'reserva_esperada': reserva,
+                    'saldo_negativo': negativo
+                })
+    finally:
+        cursor.close()
+    return diferencias
+
+
+def _corregir(diferencias, usuario_id):
+    """
+    Registra ajustes de conciliación para los repuestos con diferencias.
+    El stock registrado se toma como real: el ajuste (APROBADO) lleva el kardex al
+    stock actual sin modificarlo; para corregir el stock físico use un conteo.
+    La reserva se recalcula desde los documentos abiertos.
+    Se vuelve a calcular bajo bloqueo para no cruzarse con operaciones en curso.
+    """
+    ids = [d['repuesto_id'] for d in diferencias]
+    placeholders = ', '.join(['%s'] * len(ids))
+    corregidos = 0
+
+    with transaccion():
+        actuales = {r['id']: r for r in execute_query(f"""
+            SELECT id, cantidad_actual, cantidad_reservada, IFNULL(cantidad_inicial, 0) as cantidad_inicial
+            FROM repuestos WHERE id IN ({placeholders})
+            FOR UPDATE
+        """, tuple(ids), fetch_all=True)}
+
+        netos = {f['repuesto_id']: int(f['neto'] or 0) for f in execute_query(f"""
+            SELECT repuesto_id, SUM(delta) as neto
+            FROM ({sql_eventos(f'IN ({placeholders})')}) eventos
+            GROUP BY repuesto_id
+        """, tuple(ids) * 2, fetch_all=True)}
+
+        reservas = {f['repuesto_id']: int(f['reservado'] or 0) for f in execute_query(
+            _sql_reservas(f'IN ({placeholders})'), tuple(ids) * 2, fetch_all=True
+        )}
+
+        for repuesto_id, r in actuales.items():
+            esperado = r['cantidad_inicial'] + netos.get(repuesto_id, 0)
+            reserva = reservas.get(repuesto_id, 0)
+
+            if esperado != r['cantidad_actual']:
+                execute_query("""
+                    INSERT INTO historial_ajustes_inventario
+                    (repuesto_id, cantidad_anterior, cantidad_nueva, diferencia, usuario_id, motivo,
+                     estado, aprobado_por, fecha_aprobacion)
+                    VALUES (%s, %s, %s, %s, %s, %s, 'APROBADO', %s, NOW())
+                """, (repuesto_id, esperado, r['cantidad_actual'], r['cantidad_actual'] - esperado,
+                      usuario_id, MOTIVO_CONCILIACION, usuario_id))
+                corregidos += 1
+
+            if reserva != r['cantidad_reservada']:
+                execute_update(
+                    "UPDATE repuestos SET cantidad_reservada = %s, updated_by = %s WHERE id = %s",
+                    (reserva, usuario_id, repuesto_id)
+                )
+                corregidos += 1
+
+    return corregidos
+
+
+def verificar_stock(tamano_lote=1000, corregir=False, usuario_id=None):
+    """
+    Reproduce el kardex de todo el catálogo y lo compara con el stock registrado.
+
+    Args:
+        tamano_lote: Cantidad de IDs de repuesto por recorrido
+        corregir: Si True, registra ajustes de conciliación y recalcula reservas
+        usuario_id: Usuario que firma las correcciones (obligatorio si corregir)
+
+    Returns:
+        Dict con 'repuestos', 'eventos', 'diferencias' (solo las primeras
+        MAX_DIFERENCIAS_REPORTE), 'total_diferencias', 'correcciones' y 'segundos'
+    """
+    if corregir and not usuario_id:
+        raise ValueError('Se requiere un usuario para registrar las correcciones')
+
+    inicio = time.monotonic()
+    limites = execute_query("SELECT MIN(id) as minimo, MAX(id) as maximo FROM repuestos", fetch_one=True)
+    resultado = {'repuestos': 0, 'eventos': 0, 'diferencias': [], 'total_diferencias': 0, 'correcciones': 0}
+
+    if limites['minimo'] is not None:
+        for desde in range(limites['minimo'], limites['maximo'] + 1, tamano_lote):
+            diferencias = _conciliar_rango(desde, desde + tamano_lote - 1, resultado)
+            if not diferencias:
+                continue
+            resultado['total_diferencias'] += len(diferencias)
+            libres = MAX_DIFERENCIAS_REPORTE - len(resultado['diferencias'])
+            resultado['diferencias'].extend(diferencias[:max(libres, 0)])
+            # Se corrige por rango: la memoria no depende del total de diferencias
+            if corregir:
+                resultado['correcciones'] += _corregir(diferencias, usuario_id)
+    get_db().commit()
+
+    resultado['segundos'] = round(time.monotonic() - inicio, 2)
+    logger.info(
+        f"Conciliación de stock: {resultado['repuestos']} repuestos, {resultado['eventos']} eventos, "
+        f"{resultado['total_diferencias']} con diferencias, {resultado['correcciones']} correcciones "
+        f"({resultado['segundos']} s)"
+    )
+    return resultado
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Validadores HTTP para las APIs JSON (GET condicional)
+- ETag armado con la versión de la fila (version_catalogo) y los contadores de
+  catalogo_versiones que mantienen los triggers de cada tabla
+- Last-Modified con el updated_at más reciente de esos contadores / filas
+- Si el cliente ya tiene la versión (If-None-Match, o If-Modified-Since cuando no
+  envía ETag) se responde 304 antes de ejecutar las consultas pesadas
+"""
+
+from flask import request, make_response, jsonify
+from database import execute_query
+
+
+def versiones_catalogo(*catalogos):
+    """{catalogo: {'version', 'updated_at'}} de catalogo_versiones en una consulta"""
+    placeholders = ', '.join(['%s'] * len(catalogos))
+    filas = execute_query(
+        f"SELECT catalogo, version, updated_at FROM catalogo_versiones WHERE catalogo IN ({placeholders})",
+        catalogos, fetch_all=True
+    )
+    versiones = {c: {'version': 0, 'updated_at': None} for c in catalogos}
+    for f in filas:
+        versiones[f['catalogo']] = {'version': f['version'], 'updated_at': f['updated_at']}
+    return versiones
+
+
+def validadores(prefijo, *partes, fechas=()):
+    """
+    ETag y Last-Modified a partir de versiones y fechas.
+
+    Returns:
+        Tupla (etag, ultima_modificacion)
+    """
+    etag = '-'.join([prefijo] + [str(p) for p in partes])
+    fechas = [f for f in fechas if f is not None]
+    return etag, (max(fechas) if fechas else None)
+
+
+def no_modificado(etag, ultima_modificacion=None):
+    """Respuesta 304 si el cliente ya tiene esta versión, o None"""
+    if request.if_none_match:
+        # Comparación débil: el middleware de compresión convierte las ETag en W/"..."
+        vigente = request.if_none_match.contains_weak(etag)
+    elif ultima_modificacion is not None and request.if_modified_since is not None:
+        vigente = ultima_modificacion.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    else:
+        vigente = False
+    if not vigente:
+        return None
+    respuesta = make_response('', 304)
+    return _con_validadores(respuesta, etag, ultima_modificacion)
+
+
+def _con_validadores(respuesta, etag, ultima_modificacion):
+    respuesta.set_etag(etag)
+    if ultima_modificacion is not None:
+        respuesta.last_modified = ultima_modificacion
+    # El navegador guarda la respuesta pero la revalida en cada uso
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta
+
+
+def json_con_validadores(datos, etag, ultima_modificacion=None):
+    """jsonify(datos) con ETag, Last-Modified y Cache-Control de revalidación"""
+    return _con_validadores(jsonify(datos), etag, ultima_modificacion)
@@ -37,15 +37,86 @@ class Config:
     # Prefijos para numeración
     PREFIJO_SOLICITUD = 'SOL'
     PREFIJO_FACTURA = 'FAC'
+    SECUENCIAS_BLOQUE = 1  # Números reservados por proceso (1 = consecutivos estrictos)
 
     # Configuración de uploads
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+    IMAGENES_WORKERS = 2  # Hilos que generan miniaturas y variantes WebP (requiere Pillow)
+    IMAGENES_GRACIA_HUERFANOS = 3600  # Segundos sin uso antes de borrar un archivo sin referencia
+
+    # Estáticos con huella de contenido: URLs versionadas, caché inmutable y gzip/brotli precalculados
+    ACTIVOS_HUELLA = True
+    ACTIVOS_NIVEL_GZIP = 9
+
+    # Compresión de respuestas (middleware WSGI): ancho de banda contra CPU
+    COMPRESION_HABILITADA = True
+    COMPRESION_MINIMO_BYTES = 1024  # Respuestas menores salen sin comprimir
+    COMPRESION_TIPOS = ('text/html', 'application/json', 'text/csv', 'text/plain',
+                        'text/css', 'application/javascript', 'image/svg+xml')
+    COMPRESION_NIVEL_GZIP = 6  # 1 (rápido) a 9 (máxima compresión)
+    COMPRESION_BROTLI = True  # Usar brotli si está instalado y el navegador lo acepta
+    COMPRESION_NIVEL_BROTLI = 4  # 0 a 11
+    COMPRESION_CPU_POR_SEGUNDO = 0.5  # Segundos de CPU por segundo y proceso (0 = sin límite)
+    COMPRESION_CPU_RAFAGA = 2.0  # Saldo máximo acumulable
+
+    # Plantillas: caché de bytecode en disco y precompilación al iniciar
+    PLANTILLAS_CACHE_BYTECODE = True
+    PLANTILLAS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'plantillas')
+    PLANTILLAS_PRECOMPILAR = True
+
+    # Detalle de repuesto (modal): entradas de la caché LRU por proceso (0 = sin caché)
+    DETALLE_REPUESTOS_CACHE = 500
+
+    # Contadores de listas (flask reconstruir-contadores): IDs por transacción
+    CONTADORES_LOTE = 5000
+
+    # Servidor de producción (python servidor.py): gunicorn prefork o waitress en Windows
+    SERVIDOR_HOST = os.environ.get('SERVIDOR_HOST') or '0.0.0.0'
+    SERVIDOR_PUERTO = int(os.environ.get('SERVIDOR_PUERTO') or 8000)
+    SERVIDOR_PROCESOS = int(os.environ.get('SERVIDOR_PROCESOS') or 0)  # 0 = 2 x núcleos + 1
+    SERVIDOR_HILOS = int(os.environ.get('SERVIDOR_HILOS') or 4)  # Hilos por proceso
+    SERVIDOR_MAX_PETICIONES = 2000  # Peticiones tras las que se recicla un proceso (0 = nunca)
+    SERVIDOR_MAX_PETICIONES_VARIACION = 200  # Variación aleatoria del reciclaje
+    SERVIDOR_TIEMPO_LIMITE = 120  # Segundos sin respuesta antes de reiniciar un proceso (exportaciones)
+    SERVIDOR_TIEMPO_GRACIA = 30  # Segundos para terminar las peticiones en curso al recargar
+    SERVIDOR_KEEPALIVE = 5
+    SERVIDOR_REGISTRO_ACCESOS = False
+    SERVIDOR_CALENTAR_DETALLES = 50  # Detalles de repuestos precargados por proceso (0 = ninguno)
+
+    # Métricas Prometheus (/metrics, requiere prometheus-client)
+    METRICAS_HABILITADAS = True
+    METRICAS_PERMITIR_LOCAL = False  # Sin sesión desde 127.0.0.1 (no usar detrás de un proxy local)
+
+    # Importación CSV de repuestos y entradas
+    IMPORTACION_LOTE = 500  # Filas por transacción
+
+    # Configuración de caché de reportes
+    REPORTES_CACHE_TTL_MINUTOS = 15  # Vigencia de reportes cuyo período incluye hoy
+
+    # Barrido periódico de alertas de stock (flask barrer-alertas)
+    ALERTAS_BARRIDO_LOTE = 5000  # IDs de repuesto por transacción
+
+    # Conciliación del kardex contra el stock (flask verificar-stock)
+    CONCILIACION_LOTE = 1000  # IDs de repuesto por recorrido
+
+    # Pronóstico de demanda (flask pronosticar, requiere NumPy)
+    PRONOSTICO_METODO = 'suavizado'  # 'suavizado' (exponencial) o 'media' (media móvil)
+    PRONOSTICO_HISTORIA_DIAS = 730
+    PRONOSTICO_VENTANA_DIAS = 90  # Media móvil
+    PRONOSTICO_ALFA = 0.1  # Suavizado exponencial
+    PRONOSTICO_DIAS_ENTREGA = 7  # Tiempo de reposición
+    PRONOSTICO_FACTOR_SEGURIDAD = 1.65  # z del stock de seguridad (95 %)
+
+    # Clasificación ABC/XYZ (flask clasificar, requiere NumPy)
+    CLASIFICACION_DIAS = 365
+    CLASIFICACION_PERIODO_DIAS = 30  # Períodos para medir la variabilidad (XYZ)
 
 class DevelopmentConfig(Config):
     """Configuración para desarrollo"""
     DEBUG = True
+    METRICAS_PERMITIR_LOCAL = True
 
 class ProductionConfig(Config):
     """Configuración para producción"""
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Contadores desnormalizados de las listas
+- clientes.total_vehiculos / placas_resumen (vehículos activos del cliente)
+- categorias_repuestos.total_repuestos (repuestos activos de la categoría)
+- facturas.total_pagado (suma de pagos_factura)
+- Los mantienen los triggers de vehiculos_clientes, repuestos y pagos_factura en la
+  misma transacción que cada escritura; las listas los leen sin subconsultas
+- Reconstrucción por rangos de IDs: recalcula desde las tablas de origen y solo
+  reescribe las filas con diferencias (flask reconstruir-contadores)
+"""
+
+from database import execute_query, execute_update, transaccion
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Placas que se guardan en clientes.placas_resumen (el total va en total_vehiculos)
+PLACAS_RESUMEN = 5
+
+# Contador -> (tabla, sentencia de reconstrucción para un rango de IDs)
+_RECONSTRUCCION = {
+    'clientes': ('clientes', f"""
+        UPDATE clientes c
+        LEFT JOIN (
+            SELECT cliente_id, COUNT(*) as total,
+                   SUBSTRING_INDEX(GROUP_CONCAT(placa ORDER BY placa SEPARATOR ', '), ', ', {PLACAS_RESUMEN}) as placas
+            FROM vehiculos_clientes
+            WHERE activo = TRUE AND cliente_id BETWEEN %s AND %s
+            GROUP BY cliente_id
+        ) v ON v.cliente_id = c.id
+        SET c.total_vehiculos = IFNULL(v.total, 0), c.placas_resumen = v.placas
+        WHERE c.id BETWEEN %s AND %s
+        AND (c.total_vehiculos <> IFNULL(v.total, 0) OR NOT (c.placas_resumen <=> v.placas))
+    """),
+    'categorias': ('categorias_repuestos', """
+        UPDATE categorias_repuestos c
+        LEFT JOIN (
+            SELECT categoria_id, COUNT(*) as total
+            FROM repuestos
+            WHERE activo = TRUE AND categoria_id BETWEEN %s AND %s
+            GROUP BY categoria_id
+        ) r ON r.categoria_id = c.id
+        SET c.total_repuestos = IFNULL(r.total, 0)
+        WHERE c.id BETWEEN %s AND %s
+        AND c.total_repuestos <> IFNULL(r.total, 0)
+    """),
+    'facturas': ('facturas', """
+        UPDATE facturas f
+        LEFT JOIN (
+            SELECT factura_id, SUM(monto) as total
+            FROM pagos_factura
+            WHERE factura_id BETWEEN %s AND %s
+            GROUP BY factura_id
+        ) p ON p.factura_id = f.id
+        SET f.total_pagado = IFNULL(p.total, 0)
+        WHERE f.id BETWEEN %s AND %s
+        AND f.total_pagado <> IFNULL(p.total, 0)
+    """)
+}
+
+
+def reconstruir_contadores(tamano_lote=5000, contadores=None):
+    """
+    Recalcula los contadores desnormalizados, un rango de IDs por transacción.
+
+    Args:
+        tamano_lote: Cantidad de IDs por transacción
+        contadores: Nombres a reconstruir ('clientes', 'categorias', 'facturas'); todos si None
+
+    Returns:
+        Dict con las filas corregidas por contador y 'segundos'
+    """
+    inicio = time.monotonic()
+    resultado = {}
+    for nombre in contadores or _RECONSTRUCCION:
+        tabla, sentencia = _RECONSTRUCCION[nombre]
+        limites = execute_query(f"SELECT MIN(id) as minimo, MAX(id) as maximo FROM {tabla}", fetch_one=True)
+        corregidas = 0
+        if limites['minimo'] is not None:
+            for desde in range(limites['minimo'], limites['maximo'] + 1, tamano_lote):
+                hasta = desde + tamano_lote - 1
+                with transaccion():
+                    corregidas += execute_update(sentencia, (desde, hasta, desde, hasta))
+        resultado[nombre] = corregidas
+        if corregidas:
+            logger.warning(f"Contadores de {tabla}: {corregidas} filas corregidas")
+
+    resultado['segundos'] = round(time.monotonic() - inicio, 2)
+    return resultado
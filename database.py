@@ -1,39 +1,76 @@
 import pymysql
 from pymysql.cursors import DictCursor
 from flask import g, current_app
+from contextlib import contextmanager
+from metricas import observar_sql, observar_conexion, conexion_cerrada
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+def _conectar(autocommit=False):
+    """Abre una conexión nueva con la configuración de la aplicación"""
+    inicio = time.perf_counter()
+    try:
+        conexion = pymysql.connect(
+            host=current_app.config['MYSQL_HOST'],
+            user=current_app.config['MYSQL_USER'],
+            password=current_app.config['MYSQL_PASSWORD'],
+            database=current_app.config['MYSQL_DB'],
+            port=current_app.config['MYSQL_PORT'],
+            charset=current_app.config['MYSQL_CHARSET'],
+            cursorclass=DictCursor,
+            autocommit=autocommit
+        )
+    except Exception as e:
+        observar_conexion(time.perf_counter() - inicio, error=True)
+        logger.error(f"Error conectando a la base de datos: {e}")
+        raise
+    observar_conexion(time.perf_counter() - inicio)
+    return conexion
+
 def get_db():
     """Obtiene una conexión a la base de datos"""
     if 'db' not in g:
-        try:
-            g.db = pymysql.connect(
-                host=current_app.config['MYSQL_HOST'],
-                user=current_app.config['MYSQL_USER'],
-                password=current_app.config['MYSQL_PASSWORD'],
-                database=current_app.config['MYSQL_DB'],
-                port=current_app.config['MYSQL_PORT'],
-                charset=current_app.config['MYSQL_CHARSET'],
-                cursorclass=DictCursor,
-                autocommit=False
-            )
-        except Exception as e:
-            logger.error(f"Error conectando a la base de datos: {e}")
-            raise
+        g.db = _conectar()
     return g.db
 
+def get_db_autocommit():
+    """
+    Conexión aparte en modo autocommit: sus escrituras se confirman de inmediato sin
+    confirmar ni deshacer la transacción en curso de get_db() (numeración de documentos)
+    """
+    if 'db_autocommit' not in g:
+        g.db_autocommit = _conectar(autocommit=True)
+    return g.db_autocommit
+
 def close_db(e=None):
-    """Cierra la conexión a la base de datos"""
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+    """Cierra las conexiones a la base de datos"""
+    for clave in ('db', 'db_autocommit'):
+        db = g.pop(clave, None)
+        if db is not None:
+            db.close()
+            conexion_cerrada()
 
 def init_db(app):
     """Inicializa la base de datos con la aplicación Flask"""
     app.teardown_appcontext(close_db)
 
+@contextmanager
+def transaccion():
+    """
+    Agrupa varias consultas en una sola transacción.
+    Dentro del bloque las consultas deben ejecutarse con commit=False;
+    al salir se hace commit, o rollback si se produjo una excepción.
+    """
+    db = get_db()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
 def execute_query(query, params=None, fetch_one=False, fetch_all=False, commit=False):
     """
     Ejecuta una consulta SQL
@@ -50,9 +87,11 @@ def execute_query(query, params=None, fetch_one=False, fetch_all=False, commit=F
     """
     db = get_db()
     cursor = db.cursor()
+    inicio = time.perf_counter()
     
     try:
         cursor.execute(query, params or ())
+        observar_sql(query, time.perf_counter() - inicio)
         
         if commit:
             db.commit()
@@ -67,6 +106,7 @@ def execute_query(query, params=None, fetch_one=False, fetch_all=False, commit=F
         return cursor.lastrowid
     
     except Exception as e:
+        observar_sql(query, time.perf_counter() - inicio, error=True)
         db.rollback()
         logger.error(f"Error ejecutando query: {e}")
         logger.error(f"Query: {query}")
@@ -76,26 +116,66 @@ def execute_query(query, params=None, fetch_one=False, fetch_all=False, commit=F
     finally:
         cursor.close()
 
-def execute_many(query, params_list):
+def execute_update(query, params=None, commit=False):
+    """
+    Ejecuta un INSERT/UPDATE/DELETE y retorna el número de filas afectadas
+
+    Args:
+        query: Consulta SQL a ejecutar
+        params: Parámetros para la consulta (tupla o dict)
+        commit: Si True, hace commit de la transacción
+
+    Returns:
+        Número de filas afectadas por la sentencia
+    """
+    db = get_db()
+    cursor = db.cursor()
+    inicio = time.perf_counter()
+
+    try:
+        filas = cursor.execute(query, params or ())
+        observar_sql(query, time.perf_counter() - inicio)
+        if commit:
+            db.commit()
+        return filas
+
+    except Exception as e:
+        observar_sql(query, time.perf_counter() - inicio, error=True)
+        db.rollback()
+        logger.error(f"Error ejecutando update: {e}")
+        logger.error(f"Query: {query}")
+        logger.error(f"Params: {params}")
+        raise
+
+    finally:
+        cursor.close()
+
+def execute_many(query, params_list, commit=True):
     """
     Ejecuta una consulta múltiple veces con diferentes parámetros
+    (los INSERT ... VALUES se envían como una inserción de varias filas)
     
     Args:
         query: Consulta SQL a ejecutar
         params_list: Lista de tuplas con parámetros
+        commit: Si True, hace commit de la transacción
     
     Returns:
         True si se ejecutó correctamente
     """
     db = get_db()
     cursor = db.cursor()
+    inicio = time.perf_counter()
     
     try:
         cursor.executemany(query, params_list)
-        db.commit()
+        observar_sql(query, time.perf_counter() - inicio)
+        if commit:
+            db.commit()
         return True
     
     except Exception as e:
+        observar_sql(query, time.perf_counter() - inicio, error=True)
         db.rollback()
         logger.error(f"Error ejecutando query múltiple: {e}")
         raise
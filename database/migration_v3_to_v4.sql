@@ -0,0 +1,875 @@
+-- Migración de la base de datos del Taller Automotriz de V3 a V4
+-- IMPORTANTE: Ejecutar con precaución. Hacer backup antes de ejecutar.
+-- Este script es idempotente - puede ejecutarse múltiples veces sin problemas.
+-- Aplica sobre una base creada con schema_v3.sql o migrada con migration_v1_to_v3.sql.
+-- Requiere MySQL 8.0+ o MariaDB 10.5+ (funciones de ventana, JSON_ARRAYAGG, REGEXP_REPLACE).
+
+USE taller_inventario;
+
+-- ==================== 1. CACHÉ DE REPORTES ====================
+
+-- Resultados de reportes por (tipo, rango de fechas, versión de datos).
+-- expira_at NULL = período cerrado, la entrada se conserva indefinidamente.
+CREATE TABLE IF NOT EXISTS reportes_cache (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    tipo_reporte VARCHAR(20) NOT NULL,
+    fecha_inicio DATE NOT NULL,
+    fecha_fin DATE NOT NULL,
+    version_datos INT NOT NULL,
+    reporte_id INT NOT NULL COMMENT 'Reporte generado que contiene los datos',
+    expira_at TIMESTAMP NULL COMMENT 'NULL para períodos cerrados',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (reporte_id) REFERENCES reportes_generados(id) ON DELETE CASCADE,
+    UNIQUE KEY unique_reporte_cache (tipo_reporte, fecha_inicio, fecha_fin, version_datos),
+    INDEX idx_rango (fecha_inicio, fecha_fin)
+) ENGINE=InnoDB;
+
+-- ==================== 2. COMPRESIÓN DE DATOS DE REPORTES ====================
+
+-- Los datos se guardan comprimidos; datos_codec indica el formato:
+--   'zlib'  = escrito por la aplicación (zlib.compress)
+--   'mysql' = escrito por esta migración (COMPRESS de MySQL)
+ALTER TABLE reportes_generados ADD COLUMN IF NOT EXISTS datos_comprimidos LONGBLOB NULL COMMENT 'Datos del reporte comprimidos';
+ALTER TABLE reportes_generados ADD COLUMN IF NOT EXISTS datos_codec VARCHAR(10) NULL COMMENT 'Formato de datos_comprimidos';
+ALTER TABLE reportes_generados MODIFY COLUMN datos_json JSON NULL;
+
+-- Comprimir reportes existentes y liberar la columna sin comprimir
+UPDATE reportes_generados
+SET datos_comprimidos = COMPRESS(datos_json),
+    datos_codec = 'mysql',
+    datos_json = NULL
+WHERE datos_json IS NOT NULL AND datos_comprimidos IS NULL;
+
+-- Recuperar el espacio liberado en disco
+OPTIMIZE TABLE reportes_generados;
+
+-- ==================== 3. ALERTAS DE STOCK SIN DUPLICADOS ====================
+
+-- Resolver duplicados abiertos (se conserva la alerta más antigua por repuesto y tipo)
+UPDATE alertas_inventario a
+JOIN (
+    SELECT repuesto_id, tipo_alerta, MIN(id) as id_conservar
+    FROM alertas_inventario
+    WHERE estado IN ('NUEVA', 'EN_PROCESO') AND tipo_alerta IN ('STOCK_BAJO', 'AGOTADO')
+    GROUP BY repuesto_id, tipo_alerta
+    HAVING COUNT(*) > 1
+) d ON a.repuesto_id = d.repuesto_id AND a.tipo_alerta = d.tipo_alerta
+SET a.estado = 'RESUELTA', a.fecha_resolucion = NOW()
+WHERE a.id <> d.id_conservar AND a.estado IN ('NUEVA', 'EN_PROCESO');
+
+-- Clave de alerta de stock abierta: solo una por repuesto y tipo (NULL en alertas cerradas)
+ALTER TABLE alertas_inventario ADD COLUMN IF NOT EXISTS clave_stock_abierta VARCHAR(40)
+    GENERATED ALWAYS AS (
+        IF(estado IN ('NUEVA', 'EN_PROCESO') AND tipo_alerta IN ('STOCK_BAJO', 'AGOTADO'),
+           CONCAT(repuesto_id, ':', tipo_alerta), NULL)
+    ) STORED COMMENT 'Evita alertas de stock abiertas duplicadas';
+ALTER TABLE alertas_inventario ADD UNIQUE INDEX IF NOT EXISTS unique_alerta_stock_abierta (clave_stock_abierta);
+ALTER TABLE alertas_inventario ADD INDEX IF NOT EXISTS idx_repuesto_estado (repuesto_id, estado, tipo_alerta);
+
+-- ==================== 4. VERSIÓN DEL CATÁLOGO ====================
+
+-- Contador de versión por catálogo; cada alta o cambio de una fila lo incrementa
+-- y la fila guarda la versión en que cambió (permite enviar solo las diferencias).
+CREATE TABLE IF NOT EXISTS catalogo_versiones (
+    catalogo VARCHAR(20) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB;
+
+INSERT IGNORE INTO catalogo_versiones (catalogo, version) VALUES ('repuestos', 1), ('clientes', 1);
+
+ALTER TABLE repuestos ADD COLUMN IF NOT EXISTS version_catalogo BIGINT NOT NULL DEFAULT 0 COMMENT 'Versión del catálogo en que cambió la fila';
+ALTER TABLE repuestos ADD INDEX IF NOT EXISTS idx_version_catalogo (version_catalogo);
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS version_catalogo BIGINT NOT NULL DEFAULT 0 COMMENT 'Versión del catálogo en que cambió la fila';
+ALTER TABLE clientes ADD INDEX IF NOT EXISTS idx_version_catalogo (version_catalogo);
+
+DROP TRIGGER IF EXISTS version_repuestos_insert;
+DROP TRIGGER IF EXISTS version_repuestos_update;
+DROP TRIGGER IF EXISTS version_clientes_insert;
+DROP TRIGGER IF EXISTS version_clientes_update;
+
+DELIMITER //
+
+CREATE TRIGGER version_repuestos_insert
+BEFORE INSERT ON repuestos
+FOR EACH ROW
+BEGIN
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo = 'repuestos';
+    SET NEW.version_catalogo = (SELECT version FROM catalogo_versiones WHERE catalogo = 'repuestos');
+END//
+
+-- Solo los cambios de columnas del catálogo: los movimientos de stock (cantidad_actual,
+-- cantidad_reservada) no pasan por la fila compartida del contador
+CREATE TRIGGER version_repuestos_update
+BEFORE UPDATE ON repuestos
+FOR EACH ROW
+BEGIN
+    IF NOT (OLD.codigo <=> NEW.codigo AND OLD.nombre <=> NEW.nombre
+            AND OLD.descripcion <=> NEW.descripcion
+            AND OLD.descripcion_detallada <=> NEW.descripcion_detallada
+            AND OLD.categoria_id <=> NEW.categoria_id AND OLD.precio_venta <=> NEW.precio_venta
+            AND OLD.cantidad_minima <=> NEW.cantidad_minima
+            AND OLD.ubicacion_fisica <=> NEW.ubicacion_fisica
+            AND OLD.marca_fabricante <=> NEW.marca_fabricante
+            AND OLD.observaciones <=> NEW.observaciones AND OLD.activo <=> NEW.activo) THEN
+        UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo = 'repuestos';
+        SET NEW.version_catalogo = (SELECT version FROM catalogo_versiones WHERE catalogo = 'repuestos');
+    END IF;
+END//
+
+CREATE TRIGGER version_clientes_insert
+BEFORE INSERT ON clientes
+FOR EACH ROW
+BEGIN
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo = 'clientes';
+    SET NEW.version_catalogo = (SELECT version FROM catalogo_versiones WHERE catalogo = 'clientes');
+END//
+
+-- Igual para clientes: los contadores mantenidos por triggers (sección 15) no cuentan
+CREATE TRIGGER version_clientes_update
+BEFORE UPDATE ON clientes
+FOR EACH ROW
+BEGIN
+    IF NOT (OLD.tipo_documento <=> NEW.tipo_documento
+            AND OLD.numero_documento <=> NEW.numero_documento
+            AND OLD.nombre_completo <=> NEW.nombre_completo AND OLD.telefono <=> NEW.telefono
+            AND OLD.email <=> NEW.email AND OLD.direccion <=> NEW.direccion
+            AND OLD.activo <=> NEW.activo) THEN
+        UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo = 'clientes';
+        SET NEW.version_catalogo = (SELECT version FROM catalogo_versiones WHERE catalogo = 'clientes');
+    END IF;
+END//
+
+DELIMITER ;
+
+-- ==================== 5. SECUENCIAS DE NUMERACIÓN ====================
+
+-- Contador por prefijo y día para FAC-YYYYMMDD-XXXX / SOL-YYYYMMDD-XXXX
+CREATE TABLE IF NOT EXISTS secuencias (
+    prefijo VARCHAR(20) NOT NULL,
+    fecha DATE NOT NULL,
+    valor INT NOT NULL DEFAULT 0 COMMENT 'Último número asignado',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (prefijo, fecha)
+) ENGINE=InnoDB;
+
+-- Continuar la numeración ya emitida con el método anterior
+INSERT INTO secuencias (prefijo, fecha, valor)
+SELECT SUBSTRING_INDEX(numero_factura, '-', 1),
+       STR_TO_DATE(SUBSTRING_INDEX(SUBSTRING_INDEX(numero_factura, '-', 2), '-', -1), '%Y%m%d'),
+       MAX(CAST(SUBSTRING_INDEX(numero_factura, '-', -1) AS UNSIGNED))
+FROM facturas
+WHERE numero_factura REGEXP '^[A-Z]+-[0-9]{8}-[0-9]+$'
+GROUP BY 1, 2
+ON DUPLICATE KEY UPDATE valor = GREATEST(valor, VALUES(valor));
+
+INSERT INTO secuencias (prefijo, fecha, valor)
+SELECT SUBSTRING_INDEX(numero_solicitud, '-', 1),
+       STR_TO_DATE(SUBSTRING_INDEX(SUBSTRING_INDEX(numero_solicitud, '-', 2), '-', -1), '%Y%m%d'),
+       MAX(CAST(SUBSTRING_INDEX(numero_solicitud, '-', -1) AS UNSIGNED))
+FROM solicitudes_repuestos
+WHERE numero_solicitud REGEXP '^[A-Z]+-[0-9]{8}-[0-9]+$'
+GROUP BY 1, 2
+ON DUPLICATE KEY UPDATE valor = GREATEST(valor, VALUES(valor));
+
+-- ==================== 6. IMPORTACIONES CSV ====================
+
+-- Un registro por archivo importado (repuestos o entradas de inventario)
+CREATE TABLE IF NOT EXISTS importaciones (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    tipo ENUM('repuestos', 'entradas') NOT NULL,
+    nombre_archivo VARCHAR(255) NOT NULL,
+    sha256 CHAR(64) NOT NULL COMMENT 'Checksum del archivo importado',
+    filas INT NOT NULL DEFAULT 0,
+    creados INT NOT NULL DEFAULT 0,
+    actualizados INT NOT NULL DEFAULT 0,
+    entradas INT NOT NULL DEFAULT 0,
+    errores INT NOT NULL DEFAULT 0,
+    usuario_id INT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
+    INDEX idx_sha256 (tipo, sha256)
+) ENGINE=InnoDB;
+
+-- ==================== 7. CONTEOS FÍSICOS ====================
+
+-- Sesión de conteo por categoría y/o ubicación; sus ajustes se aprueban en bloque
+CREATE TABLE IF NOT EXISTS conteos_sesiones (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    descripcion VARCHAR(200) NULL,
+    categoria_id INT NULL,
+    ubicacion VARCHAR(100) NULL COMMENT 'Prefijo de ubicacion_fisica (estante)',
+    estado ENUM('ABIERTA', 'EN_REVISION', 'APROBADA', 'RECHAZADA', 'CANCELADA') DEFAULT 'ABIERTA',
+    total_ajustes INT NOT NULL DEFAULT 0,
+    creado_por INT NOT NULL,
+    cerrado_por INT NULL,
+    fecha_cierre TIMESTAMP NULL,
+    aprobado_por INT NULL,
+    fecha_aprobacion TIMESTAMP NULL,
+    motivo_rechazo TEXT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (categoria_id) REFERENCES categorias_repuestos(id),
+    FOREIGN KEY (creado_por) REFERENCES usuarios(id),
+    FOREIGN KEY (cerrado_por) REFERENCES usuarios(id),
+    FOREIGN KEY (aprobado_por) REFERENCES usuarios(id),
+    INDEX idx_estado (estado)
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS conteos_items (
+    sesion_id INT NOT NULL,
+    repuesto_id INT NOT NULL,
+    cantidad_sistema INT NOT NULL COMMENT 'Stock al abrir la sesión',
+    cantidad_contada INT NULL,
+    contado_por INT NULL,
+    contado_at TIMESTAMP NULL,
+    ajuste_id INT NULL COMMENT 'Ajuste generado al cerrar',
+    PRIMARY KEY (sesion_id, repuesto_id),
+    FOREIGN KEY (sesion_id) REFERENCES conteos_sesiones(id) ON DELETE CASCADE,
+    FOREIGN KEY (repuesto_id) REFERENCES repuestos(id),
+    FOREIGN KEY (contado_por) REFERENCES usuarios(id),
+    FOREIGN KEY (ajuste_id) REFERENCES historial_ajustes_inventario(id)
+) ENGINE=InnoDB;
+
+ALTER TABLE historial_ajustes_inventario ADD COLUMN IF NOT EXISTS sesion_conteo_id INT NULL COMMENT 'Sesión de conteo que generó el ajuste';
+ALTER TABLE historial_ajustes_inventario ADD INDEX IF NOT EXISTS idx_sesion_conteo (sesion_conteo_id, estado);
+
+-- ==================== 8. VALORIZACIÓN DE INVENTARIO ====================
+
+-- Agregados por categoría de los repuestos activos (categoria_id 0 = sin categoría).
+-- Los mantienen los triggers de repuestos dentro de la misma transacción que el
+-- cambio de stock o precio; el total es la suma de pocas filas.
+CREATE TABLE IF NOT EXISTS valorizacion_inventario (
+    categoria_id INT PRIMARY KEY,
+    repuestos INT NOT NULL DEFAULT 0,
+    unidades BIGINT NOT NULL DEFAULT 0,
+    valor DECIMAL(18, 2) NOT NULL DEFAULT 0.00,
+    agotados INT NOT NULL DEFAULT 0,
+    stock_bajo INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB;
+
+DROP TRIGGER IF EXISTS valorizacion_repuestos_insert;
+DROP TRIGGER IF EXISTS valorizacion_repuestos_update;
+DROP TRIGGER IF EXISTS valorizacion_repuestos_delete;
+
+DELIMITER //
+
+CREATE TRIGGER valorizacion_repuestos_insert
+AFTER INSERT ON repuestos
+FOR EACH ROW
+BEGIN
+    IF NEW.activo THEN
+        INSERT INTO valorizacion_inventario (categoria_id, repuestos, unidades, valor, agotados, stock_bajo)
+        VALUES (IFNULL(NEW.categoria_id, 0), 1, NEW.cantidad_actual,
+                NEW.cantidad_actual * NEW.precio_venta,
+                NEW.cantidad_actual = 0,
+                NEW.cantidad_actual > 0 AND NEW.cantidad_actual <= NEW.cantidad_minima)
+        ON DUPLICATE KEY UPDATE
+            repuestos = repuestos + VALUES(repuestos),
+            unidades = unidades + VALUES(unidades),
+            valor = valor + VALUES(valor),
+            agotados = agotados + VALUES(agotados),
+            stock_bajo = stock_bajo + VALUES(stock_bajo);
+    END IF;
+END//
+
+CREATE TRIGGER valorizacion_repuestos_update
+AFTER UPDATE ON repuestos
+FOR EACH ROW
+BEGIN
+    -- Los cambios de reservas, ubicación o descripción no afectan la valorización
+    IF NOT (OLD.activo <=> NEW.activo
+            AND OLD.categoria_id <=> NEW.categoria_id
+            AND OLD.cantidad_actual <=> NEW.cantidad_actual
+            AND OLD.precio_venta <=> NEW.precio_venta
+            AND OLD.cantidad_minima <=> NEW.cantidad_minima) THEN
+        IF OLD.activo THEN
+            INSERT INTO valorizacion_inventario (categoria_id, repuestos, unidades, valor, agotados, stock_bajo)
+            VALUES (IFNULL(OLD.categoria_id, 0), -1, -OLD.cantidad_actual,
+                    -(OLD.cantidad_actual * OLD.precio_venta),
+                    -(OLD.cantidad_actual = 0),
+                    -(OLD.cantidad_actual > 0 AND OLD.cantidad_actual <= OLD.cantidad_minima))
+            ON DUPLICATE KEY UPDATE
+                repuestos = repuestos + VALUES(repuestos),
+                unidades = unidades + VALUES(unidades),
+                valor = valor + VALUES(valor),
+                agotados = agotados + VALUES(agotados),
+                stock_bajo = stock_bajo + VALUES(stock_bajo);
+        END IF;
+        IF NEW.activo THEN
+            INSERT INTO valorizacion_inventario (categoria_id, repuestos, unidades, valor, agotados, stock_bajo)
+            VALUES (IFNULL(NEW.categoria_id, 0), 1, NEW.cantidad_actual,
+                    NEW.cantidad_actual * NEW.precio_venta,
+                    NEW.cantidad_actual = 0,
+                    NEW.cantidad_actual > 0 AND NEW.cantidad_actual <= NEW.cantidad_minima)
+            ON DUPLICATE KEY UPDATE
+                repuestos = repuestos + VALUES(repuestos),
+                unidades = unidades + VALUES(unidades),
+                valor = valor + VALUES(valor),
+                agotados = agotados + VALUES(agotados),
+                stock_bajo = stock_bajo + VALUES(stock_bajo);
+        END IF;
+    END IF;
+END//
+
+CREATE TRIGGER valorizacion_repuestos_delete
+AFTER DELETE ON repuestos
+FOR EACH ROW
+BEGIN
+    IF OLD.activo THEN
+        UPDATE valorizacion_inventario
+        SET repuestos = repuestos - 1,
+            unidades = unidades - OLD.cantidad_actual,
+            valor = valor - OLD.cantidad_actual * OLD.precio_venta,
+            agotados = agotados - (OLD.cantidad_actual = 0),
+            stock_bajo = stock_bajo - (OLD.cantidad_actual > 0 AND OLD.cantidad_actual <= OLD.cantidad_minima)
+        WHERE categoria_id = IFNULL(OLD.categoria_id, 0);
+    END IF;
+END//
+
+DELIMITER ;
+
+-- Carga inicial (recalcula desde cero si la migración se ejecuta de nuevo)
+DELETE FROM valorizacion_inventario;
+INSERT INTO valorizacion_inventario (categoria_id, repuestos, unidades, valor, agotados, stock_bajo)
+SELECT IFNULL(categoria_id, 0), COUNT(*), SUM(cantidad_actual),
+       SUM(cantidad_actual * precio_venta),
+       SUM(cantidad_actual = 0),
+       SUM(cantidad_actual > 0 AND cantidad_actual <= cantidad_minima)
+FROM repuestos
+WHERE activo = TRUE
+GROUP BY IFNULL(categoria_id, 0);
+
+-- ==================== 9. CONCILIACIÓN DE STOCK ====================
+
+-- Saldo inicial de cada repuesto: stock con que se creó (los altas no generan movimiento).
+-- El kardex esperado es cantidad_inicial + movimientos confirmados/facturados + ajustes aprobados.
+ALTER TABLE repuestos ADD COLUMN IF NOT EXISTS cantidad_inicial INT NULL COMMENT 'Stock al crear el repuesto (saldo inicial del kardex)';
+
+DROP TRIGGER IF EXISTS inicial_repuestos_insert;
+
+DELIMITER //
+
+CREATE TRIGGER inicial_repuestos_insert
+BEFORE INSERT ON repuestos
+FOR EACH ROW
+BEGIN
+    SET NEW.cantidad_inicial = NEW.cantidad_actual;
+END//
+
+DELIMITER ;
+
+-- Las devoluciones antes de facturar solo liberan reserva (no suman stock físico):
+-- se distinguen de las entradas confirmadas con el estado DEVUELTO
+UPDATE movimientos_inventario
+SET estado = 'DEVUELTO'
+WHERE estado = 'CONFIRMADO' AND observaciones = 'Devolución antes de facturar';
+
+-- Repuestos existentes: el saldo inicial se deduce del stock actual, de modo que la
+-- conciliación parte sin diferencias desde esta migración
+UPDATE repuestos r
+LEFT JOIN (
+    SELECT m.repuesto_id,
+           SUM(CASE WHEN m.estado = 'FACTURADO' OR t.tipo = 'SALIDA' THEN -m.cantidad ELSE m.cantidad END) as neto
+    FROM movimientos_inventario m
+    LEFT JOIN tipos_movimiento t ON m.tipo_movimiento_id = t.id
+    WHERE m.estado IN ('CONFIRMADO', 'FACTURADO')
+    GROUP BY m.repuesto_id
+) mov ON mov.repuesto_id = r.id
+LEFT JOIN (
+    SELECT repuesto_id, SUM(diferencia) as neto
+    FROM historial_ajustes_inventario
+    WHERE estado = 'APROBADO'
+    GROUP BY repuesto_id
+) aj ON aj.repuesto_id = r.id
+SET r.cantidad_inicial = r.cantidad_actual - IFNULL(mov.neto, 0) - IFNULL(aj.neto, 0)
+WHERE r.cantidad_inicial IS NULL;
+
+-- Recorrido del kardex por repuesto en orden cronológico
+ALTER TABLE movimientos_inventario ADD INDEX IF NOT EXISTS idx_repuesto_fecha (repuesto_id, created_at);
+ALTER TABLE historial_ajustes_inventario ADD INDEX IF NOT EXISTS idx_repuesto_estado (repuesto_id, estado);
+
+-- ==================== 10. CORTES DE SALDO DEL KARDEX ====================
+
+-- Saldo de cada repuesto al inicio del día 'corte' (eventos con fecha anterior).
+-- Los genera periódicamente 'flask kardex-cortes'; el kardex parte del último corte
+-- en lugar de reproducir toda la historia.
+CREATE TABLE IF NOT EXISTS kardex_saldos (
+    repuesto_id INT NOT NULL,
+    corte DATE NOT NULL,
+    saldo INT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (repuesto_id, corte),
+    FOREIGN KEY (repuesto_id) REFERENCES repuestos(id) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- ==================== 11. PRONÓSTICO DE DEMANDA ====================
+
+-- Último pronóstico por repuesto (lo escribe 'flask pronosticar')
+CREATE TABLE IF NOT EXISTS pronosticos_repuestos (
+    repuesto_id INT PRIMARY KEY,
+    demanda_diaria DECIMAL(12, 4) NOT NULL DEFAULT 0,
+    desviacion_diaria DECIMAL(12, 4) NOT NULL DEFAULT 0,
+    dias_para_agotar DECIMAL(10, 1) NULL COMMENT 'NULL = sin consumo',
+    minimo_sugerido INT NOT NULL DEFAULT 0,
+    en_riesgo BOOLEAN NOT NULL DEFAULT FALSE COMMENT 'Cobertura menor al tiempo de entrega',
+    metodo VARCHAR(20) NOT NULL,
+    calculado_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (repuesto_id) REFERENCES repuestos(id) ON DELETE CASCADE,
+    INDEX idx_en_riesgo (en_riesgo)
+) ENGINE=InnoDB;
+
+-- Una sola alerta PROXIMAMENTE_AGOTADO abierta por repuesto (misma clave que STOCK_BAJO/AGOTADO)
+ALTER TABLE alertas_inventario MODIFY COLUMN clave_stock_abierta VARCHAR(40)
+    GENERATED ALWAYS AS (
+        IF(estado IN ('NUEVA', 'EN_PROCESO') AND tipo_alerta IN ('STOCK_BAJO', 'AGOTADO', 'PROXIMAMENTE_AGOTADO'),
+           CONCAT(repuesto_id, ':', tipo_alerta), NULL)
+    ) STORED COMMENT 'Evita alertas de stock abiertas duplicadas';
+
+-- ==================== 12. CLASIFICACIÓN ABC/XYZ ====================
+
+-- Clasificación por repuesto y fecha de cálculo (la escribe 'flask clasificar').
+-- clase_xyz NULL = sin demanda en el período (inventario sin rotación).
+CREATE TABLE IF NOT EXISTS clasificacion_repuestos (
+    repuesto_id INT NOT NULL,
+    fecha_calculo DATE NOT NULL,
+    clase_abc CHAR(1) NOT NULL,
+    clase_xyz CHAR(1) NULL,
+    ingresos DECIMAL(15, 2) NOT NULL DEFAULT 0,
+    participacion_acumulada DECIMAL(9, 6) NOT NULL DEFAULT 0,
+    coef_variacion DECIMAL(10, 4) NULL,
+    demanda_periodo DECIMAL(12, 4) NOT NULL DEFAULT 0,
+    PRIMARY KEY (repuesto_id, fecha_calculo),
+    FOREIGN KEY (repuesto_id) REFERENCES repuestos(id) ON DELETE CASCADE,
+    INDEX idx_fecha_clases (fecha_calculo, clase_abc, clase_xyz)
+) ENGINE=InnoDB;
+
+ALTER TABLE reportes_generados MODIFY COLUMN tipo_reporte
+    ENUM('INVENTARIO', 'VENTAS', 'MOVIMIENTOS', 'ALERTAS', 'USUARIOS', 'CLIENTES', 'CLASIFICACION', 'GENERAL') NOT NULL;
+
+-- ==================== 13. VARIANTES DE IMÁGENES ====================
+
+-- Original guardado por hash de contenido; dimensiones y estado del procesamiento
+ALTER TABLE imagenes_repuestos
+    ADD COLUMN IF NOT EXISTS hash_contenido CHAR(64) NULL AFTER ruta_archivo,
+    ADD COLUMN IF NOT EXISTS ancho INT NULL AFTER hash_contenido,
+    ADD COLUMN IF NOT EXISTS alto INT NULL AFTER ancho,
+    ADD COLUMN IF NOT EXISTS bytes INT NULL AFTER alto,
+    ADD COLUMN IF NOT EXISTS estado_proceso ENUM('PENDIENTE', 'PROCESADA', 'ERROR') NOT NULL DEFAULT 'PENDIENTE' AFTER bytes,
+    ADD INDEX IF NOT EXISTS idx_hash_contenido (hash_contenido),
+    ADD INDEX IF NOT EXISTS idx_estado_proceso (estado_proceso),
+    ADD INDEX IF NOT EXISTS idx_repuesto_principal (repuesto_id, es_principal);
+
+-- Variantes generadas (miniatura, media y sus WebP), sin EXIF
+CREATE TABLE IF NOT EXISTS variantes_imagenes_repuestos (
+    imagen_id INT NOT NULL,
+    variante VARCHAR(20) NOT NULL,
+    formato VARCHAR(10) NOT NULL,
+    ruta_archivo VARCHAR(500) NOT NULL,
+    ancho INT NOT NULL,
+    alto INT NOT NULL,
+    bytes INT NOT NULL,
+    PRIMARY KEY (imagen_id, variante),
+    FOREIGN KEY (imagen_id) REFERENCES imagenes_repuestos(id) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- ==================== 14. VERSIONES PARA GET CONDICIONAL ====================
+
+-- Contadores de versión de las tablas que alimentan las APIs JSON (ETag / 304).
+-- Cualquier alta, cambio o baja incrementa el contador del grupo correspondiente
+-- ('modelos': solo marcas y modelos, los nombres que muestra el detalle de repuestos).
+INSERT IGNORE INTO catalogo_versiones (catalogo, version) VALUES
+    ('categorias', 1), ('vehiculos', 1), ('modelos', 1);
+
+-- Imágenes (y sus variantes), compatibilidad y equivalentes cambian solo la versión del
+-- detalle de su repuesto: una escritura no invalida el detalle de los demás
+ALTER TABLE repuestos ADD COLUMN IF NOT EXISTS version_detalle BIGINT NOT NULL DEFAULT 0 COMMENT 'Cambios de imágenes, compatibilidad y equivalentes del repuesto';
+
+DROP TRIGGER IF EXISTS version_categorias_repuestos_insert;
+DROP TRIGGER IF EXISTS version_categorias_repuestos_update;
+DROP TRIGGER IF EXISTS version_categorias_repuestos_delete;
+DROP TRIGGER IF EXISTS version_imagenes_repuestos_insert;
+DROP TRIGGER IF EXISTS version_imagenes_repuestos_update;
+DROP TRIGGER IF EXISTS version_imagenes_repuestos_delete;
+DROP TRIGGER IF EXISTS version_variantes_imagenes_repuestos_insert;
+DROP TRIGGER IF EXISTS version_variantes_imagenes_repuestos_update;
+DROP TRIGGER IF EXISTS version_variantes_imagenes_repuestos_delete;
+DROP TRIGGER IF EXISTS version_repuestos_compatibilidad_insert;
+DROP TRIGGER IF EXISTS version_repuestos_compatibilidad_update;
+DROP TRIGGER IF EXISTS version_repuestos_compatibilidad_delete;
+DROP TRIGGER IF EXISTS version_repuestos_equivalentes_insert;
+DROP TRIGGER IF EXISTS version_repuestos_equivalentes_update;
+DROP TRIGGER IF EXISTS version_repuestos_equivalentes_delete;
+DROP TRIGGER IF EXISTS version_vehiculos_clientes_insert;
+DROP TRIGGER IF EXISTS version_vehiculos_clientes_update;
+DROP TRIGGER IF EXISTS version_vehiculos_clientes_delete;
+DROP TRIGGER IF EXISTS version_modelos_vehiculos_insert;
+DROP TRIGGER IF EXISTS version_modelos_vehiculos_update;
+DROP TRIGGER IF EXISTS version_modelos_vehiculos_delete;
+DROP TRIGGER IF EXISTS version_marcas_vehiculos_insert;
+DROP TRIGGER IF EXISTS version_marcas_vehiculos_update;
+DROP TRIGGER IF EXISTS version_marcas_vehiculos_delete;
+DROP TRIGGER IF EXISTS audit_repuestos_update;
+
+DELIMITER //
+
+-- Igual que en schema_v3, sin auditar los cambios que solo incrementan version_detalle
+CREATE TRIGGER audit_repuestos_update
+AFTER UPDATE ON repuestos
+FOR EACH ROW
+BEGIN
+    IF OLD.version_detalle <=> NEW.version_detalle
+       OR NOT (OLD.codigo <=> NEW.codigo AND OLD.nombre <=> NEW.nombre
+               AND OLD.cantidad_actual <=> NEW.cantidad_actual
+               AND OLD.precio_venta <=> NEW.precio_venta) THEN
+        INSERT INTO audit_log (usuario_id, tabla_afectada, registro_id, accion, tipo_cambio, datos_anteriores, datos_nuevos)
+        VALUES (
+            NEW.updated_by,
+            'repuestos',
+            NEW.id,
+            'ACTUALIZAR',
+            'INVENTARIO',
+            JSON_OBJECT('codigo', OLD.codigo, 'nombre', OLD.nombre, 'cantidad_actual', OLD.cantidad_actual, 'precio_venta', OLD.precio_venta),
+            JSON_OBJECT('codigo', NEW.codigo, 'nombre', NEW.nombre, 'cantidad_actual', NEW.cantidad_actual, 'precio_venta', NEW.precio_venta)
+        );
+    END IF;
+END//
+
+CREATE TRIGGER version_categorias_repuestos_insert
+AFTER INSERT ON categorias_repuestos
+FOR EACH ROW
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo = 'categorias'//
+
+CREATE TRIGGER version_categorias_repuestos_update
+AFTER UPDATE ON categorias_repuestos
+FOR EACH ROW
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo = 'categorias'//
+
+CREATE TRIGGER version_categorias_repuestos_delete
+AFTER DELETE ON categorias_repuestos
+FOR EACH ROW
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo = 'categorias'//
+
+CREATE TRIGGER version_imagenes_repuestos_insert
+AFTER INSERT ON imagenes_repuestos
+FOR EACH ROW
+    UPDATE repuestos SET version_detalle = version_detalle + 1 WHERE id = NEW.repuesto_id//
+
+CREATE TRIGGER version_imagenes_repuestos_update
+AFTER UPDATE ON imagenes_repuestos
+FOR EACH ROW
+BEGIN
+    UPDATE repuestos SET version_detalle = version_detalle + 1 WHERE id = NEW.repuesto_id;
+    IF NOT (OLD.repuesto_id <=> NEW.repuesto_id) THEN
+        UPDATE repuestos SET version_detalle = version_detalle + 1 WHERE id = OLD.repuesto_id;
+    END IF;
+END//
+
+CREATE TRIGGER version_imagenes_repuestos_delete
+AFTER DELETE ON imagenes_repuestos
+FOR EACH ROW
+    UPDATE repuestos SET version_detalle = version_detalle + 1 WHERE id = OLD.repuesto_id//
+
+CREATE TRIGGER version_variantes_imagenes_repuestos_insert
+AFTER INSERT ON variantes_imagenes_repuestos
+FOR EACH ROW
+    UPDATE repuestos r JOIN imagenes_repuestos i ON i.repuesto_id = r.id
+    SET r.version_detalle = r.version_detalle + 1 WHERE i.id = NEW.imagen_id//
+
+CREATE TRIGGER version_variantes_imagenes_repuestos_update
+AFTER UPDATE ON variantes_imagenes_repuestos
+FOR EACH ROW
+    UPDATE repuestos r JOIN imagenes_repuestos i ON i.repuesto_id = r.id
+    SET r.version_detalle = r.version_detalle + 1 WHERE i.id = NEW.imagen_id//
+
+CREATE TRIGGER version_variantes_imagenes_repuestos_delete
+AFTER DELETE ON variantes_imagenes_repuestos
+FOR EACH ROW
+    UPDATE repuestos r JOIN imagenes_repuestos i ON i.repuesto_id = r.id
+    SET r.version_detalle = r.version_detalle + 1 WHERE i.id = OLD.imagen_id//
+
+CREATE TRIGGER version_repuestos_compatibilidad_insert
+AFTER INSERT ON repuestos_compatibilidad
+FOR EACH ROW
+    UPDATE repuestos SET version_detalle = version_detalle + 1 WHERE id = NEW.repuesto_id//
+
+CREATE TRIGGER version_repuestos_compatibilidad_update
+AFTER UPDATE ON repuestos_compatibilidad
+FOR EACH ROW
+BEGIN
+    UPDATE repuestos SET version_detalle = version_detalle + 1 WHERE id = NEW.repuesto_id;
+    IF NOT (OLD.repuesto_id <=> NEW.repuesto_id) THEN
+        UPDATE repuestos SET version_detalle = version_detalle + 1 WHERE id = OLD.repuesto_id;
+    END IF;
+END//
+
+CREATE TRIGGER version_repuestos_compatibilidad_delete
+AFTER DELETE ON repuestos_compatibilidad
+FOR EACH ROW
+    UPDATE repuestos SET version_detalle = version_detalle + 1 WHERE id = OLD.repuesto_id//
+
+CREATE TRIGGER version_repuestos_equivalentes_insert
+AFTER INSERT ON repuestos_equivalentes
+FOR EACH ROW
+    UPDATE repuestos SET version_detalle = version_detalle + 1 WHERE id = NEW.repuesto_id//
+
+CREATE TRIGGER version_repuestos_equivalentes_update
+AFTER UPDATE ON repuestos_equivalentes
+FOR EACH ROW
+BEGIN
+    UPDATE repuestos SET version_detalle = version_detalle + 1 WHERE id = NEW.repuesto_id;
+    IF NOT (OLD.repuesto_id <=> NEW.repuesto_id) THEN
+        UPDATE repuestos SET version_detalle = version_detalle + 1 WHERE id = OLD.repuesto_id;
+    END IF;
+END//
+
+CREATE TRIGGER version_repuestos_equivalentes_delete
+AFTER DELETE ON repuestos_equivalentes
+FOR EACH ROW
+    UPDATE repuestos SET version_detalle = version_detalle + 1 WHERE id = OLD.repuesto_id//
+
+CREATE TRIGGER version_vehiculos_clientes_insert
+AFTER INSERT ON vehiculos_clientes
+FOR EACH ROW
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo = 'vehiculos'//
+
+CREATE TRIGGER version_vehiculos_clientes_update
+AFTER UPDATE ON vehiculos_clientes
+FOR EACH ROW
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo = 'vehiculos'//
+
+CREATE TRIGGER version_vehiculos_clientes_delete
+AFTER DELETE ON vehiculos_clientes
+FOR EACH ROW
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo = 'vehiculos'//
+
+CREATE TRIGGER version_modelos_vehiculos_insert
+AFTER INSERT ON modelos_vehiculos
+FOR EACH ROW
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo IN ('vehiculos', 'modelos')//
+
+CREATE TRIGGER version_modelos_vehiculos_update
+AFTER UPDATE ON modelos_vehiculos
+FOR EACH ROW
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo IN ('vehiculos', 'modelos')//
+
+CREATE TRIGGER version_modelos_vehiculos_delete
+AFTER DELETE ON modelos_vehiculos
+FOR EACH ROW
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo IN ('vehiculos', 'modelos')//
+
+CREATE TRIGGER version_marcas_vehiculos_insert
+AFTER INSERT ON marcas_vehiculos
+FOR EACH ROW
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo IN ('vehiculos', 'modelos')//
+
+CREATE TRIGGER version_marcas_vehiculos_update
+AFTER UPDATE ON marcas_vehiculos
+FOR EACH ROW
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo IN ('vehiculos', 'modelos')//
+
+CREATE TRIGGER version_marcas_vehiculos_delete
+AFTER DELETE ON marcas_vehiculos
+FOR EACH ROW
+    UPDATE catalogo_versiones SET version = version + 1 WHERE catalogo IN ('vehiculos', 'modelos')//
+
+DELIMITER ;
+
+-- ==================== 15. CONTADORES DE LISTAS ====================
+
+-- Valores que las listas calculaban con subconsultas por fila
+ALTER TABLE clientes
+    ADD COLUMN IF NOT EXISTS total_vehiculos INT NOT NULL DEFAULT 0 COMMENT 'Vehículos activos',
+    ADD COLUMN IF NOT EXISTS placas_resumen VARCHAR(255) NULL COMMENT 'Primeras placas activas, en orden';
+ALTER TABLE categorias_repuestos
+    ADD COLUMN IF NOT EXISTS total_repuestos INT NOT NULL DEFAULT 0 COMMENT 'Repuestos activos';
+ALTER TABLE facturas
+    ADD COLUMN IF NOT EXISTS total_pagado DECIMAL(15, 2) NOT NULL DEFAULT 0 COMMENT 'Suma de pagos_factura';
+
+ALTER TABLE clientes ADD INDEX IF NOT EXISTS idx_activo_nombre (activo, nombre_completo);
+ALTER TABLE vehiculos_clientes ADD INDEX IF NOT EXISTS idx_cliente_activo (cliente_id, activo, placa);
+
+DROP TRIGGER IF EXISTS contador_vehiculos_insert;
+DROP TRIGGER IF EXISTS contador_vehiculos_update;
+DROP TRIGGER IF EXISTS contador_vehiculos_delete;
+DROP TRIGGER IF EXISTS contador_categorias_insert;
+DROP TRIGGER IF EXISTS contador_categorias_update;
+DROP TRIGGER IF EXISTS contador_categorias_delete;
+DROP TRIGGER IF EXISTS contador_pagos_insert;
+DROP TRIGGER IF EXISTS contador_pagos_update;
+DROP TRIGGER IF EXISTS contador_pagos_delete;
+DROP TRIGGER IF EXISTS audit_facturas_update;
+
+DELIMITER //
+
+-- Vehículos: se recalcula el resumen del cliente (solo sus vehículos, por índice)
+CREATE TRIGGER contador_vehiculos_insert
+AFTER INSERT ON vehiculos_clientes
+FOR EACH ROW
+BEGIN
+    UPDATE clientes SET
+        total_vehiculos = (SELECT COUNT(*) FROM vehiculos_clientes
+                           WHERE cliente_id = NEW.cliente_id AND activo = TRUE),
+        placas_resumen = (SELECT SUBSTRING_INDEX(GROUP_CONCAT(placa ORDER BY placa SEPARATOR ', '), ', ', 5)
+                          FROM vehiculos_clientes WHERE cliente_id = NEW.cliente_id AND activo = TRUE)
+    WHERE id = NEW.cliente_id;
+END//
+
+CREATE TRIGGER contador_vehiculos_update
+AFTER UPDATE ON vehiculos_clientes
+FOR EACH ROW
+BEGIN
+    IF NOT (OLD.cliente_id <=> NEW.cliente_id AND OLD.activo <=> NEW.activo AND OLD.placa <=> NEW.placa) THEN
+        UPDATE clientes SET
+            total_vehiculos = (SELECT COUNT(*) FROM vehiculos_clientes
+                               WHERE cliente_id = clientes.id AND activo = TRUE),
+            placas_resumen = (SELECT SUBSTRING_INDEX(GROUP_CONCAT(placa ORDER BY placa SEPARATOR ', '), ', ', 5)
+                              FROM vehiculos_clientes WHERE cliente_id = clientes.id AND activo = TRUE)
+        WHERE id IN (OLD.cliente_id, NEW.cliente_id);
+    END IF;
+END//
+
+CREATE TRIGGER contador_vehiculos_delete
+AFTER DELETE ON vehiculos_clientes
+FOR EACH ROW
+BEGIN
+    UPDATE clientes SET
+        total_vehiculos = (SELECT COUNT(*) FROM vehiculos_clientes
+                           WHERE cliente_id = OLD.cliente_id AND activo = TRUE),
+        placas_resumen = (SELECT SUBSTRING_INDEX(GROUP_CONCAT(placa ORDER BY placa SEPARATOR ', '), ', ', 5)
+                          FROM vehiculos_clientes WHERE cliente_id = OLD.cliente_id AND activo = TRUE)
+    WHERE id = OLD.cliente_id;
+END//
+
+-- Repuestos activos por categoría (los cambios de stock no tocan la categoría)
+CREATE TRIGGER contador_categorias_insert
+AFTER INSERT ON repuestos
+FOR EACH ROW
+BEGIN
+    IF NEW.activo AND NEW.categoria_id IS NOT NULL THEN
+        UPDATE categorias_repuestos SET total_repuestos = total_repuestos + 1 WHERE id = NEW.categoria_id;
+    END IF;
+END//
+
+CREATE TRIGGER contador_categorias_update
+AFTER UPDATE ON repuestos
+FOR EACH ROW
+BEGIN
+    IF NOT (OLD.categoria_id <=> NEW.categoria_id AND OLD.activo <=> NEW.activo) THEN
+        IF OLD.activo AND OLD.categoria_id IS NOT NULL THEN
+            UPDATE categorias_repuestos SET total_repuestos = total_repuestos - 1 WHERE id = OLD.categoria_id;
+        END IF;
+        IF NEW.activo AND NEW.categoria_id IS NOT NULL THEN
+            UPDATE categorias_repuestos SET total_repuestos = total_repuestos + 1 WHERE id = NEW.categoria_id;
+        END IF;
+    END IF;
+END//
+
+CREATE TRIGGER contador_categorias_delete
+AFTER DELETE ON repuestos
+FOR EACH ROW
+BEGIN
+    IF OLD.activo AND OLD.categoria_id IS NOT NULL THEN
+        UPDATE categorias_repuestos SET total_repuestos = total_repuestos - 1 WHERE id = OLD.categoria_id;
+    END IF;
+END//
+
+-- Total pagado por factura
+CREATE TRIGGER contador_pagos_insert
+AFTER INSERT ON pagos_factura
+FOR EACH ROW
+    UPDATE facturas SET total_pagado = total_pagado + NEW.monto WHERE id = NEW.factura_id//
+
+CREATE TRIGGER contador_pagos_update
+AFTER UPDATE ON pagos_factura
+FOR EACH ROW
+BEGIN
+    UPDATE facturas SET total_pagado = total_pagado - OLD.monto WHERE id = OLD.factura_id;
+    UPDATE facturas SET total_pagado = total_pagado + NEW.monto WHERE id = NEW.factura_id;
+END//
+
+CREATE TRIGGER contador_pagos_delete
+AFTER DELETE ON pagos_factura
+FOR EACH ROW
+    UPDATE facturas SET total_pagado = total_pagado - OLD.monto WHERE id = OLD.factura_id//
+
+-- Auditoría de facturas: igual que antes, pero sin registrar los cambios que solo
+-- actualizan total_pagado (el pago ya se audita en pagos_factura)
+CREATE TRIGGER audit_facturas_update
+AFTER UPDATE ON facturas
+FOR EACH ROW
+BEGIN
+    DECLARE accion_tipo VARCHAR(20);
+    IF OLD.total_pagado <=> NEW.total_pagado
+       OR NOT (OLD.estado <=> NEW.estado AND OLD.total <=> NEW.total) THEN
+        SET accion_tipo = CASE
+            WHEN NEW.estado = 'ANULADA' AND OLD.estado != 'ANULADA' THEN 'ANULAR'
+            WHEN NEW.estado = 'PAGADA' AND OLD.estado != 'PAGADA' THEN 'FACTURAR'
+            ELSE 'ACTUALIZAR'
+        END;
+
+        INSERT INTO audit_log (usuario_id, tabla_afectada, registro_id, accion, tipo_cambio, datos_anteriores, datos_nuevos)
+        VALUES (
+            COALESCE(NEW.anulado_por, NEW.vendedor_id),
+            'facturas',
+            NEW.id,
+            accion_tipo,
+            'FACTURA',
+            JSON_OBJECT('numero_factura', OLD.numero_factura, 'estado', OLD.estado, 'total', OLD.total),
+            JSON_OBJECT('numero_factura', NEW.numero_factura, 'estado', NEW.estado, 'total', NEW.total)
+        );
+    END IF;
+END//
+
+DELIMITER ;
+
+-- Carga inicial (después se mantienen con los triggers; flask reconstruir-contadores los verifica)
+UPDATE clientes c
+LEFT JOIN (
+    SELECT cliente_id, COUNT(*) as total,
+           SUBSTRING_INDEX(GROUP_CONCAT(placa ORDER BY placa SEPARATOR ', '), ', ', 5) as placas
+    FROM vehiculos_clientes WHERE activo = TRUE GROUP BY cliente_id
+) v ON v.cliente_id = c.id
+SET c.total_vehiculos = IFNULL(v.total, 0), c.placas_resumen = v.placas;
+
+UPDATE categorias_repuestos c
+LEFT JOIN (
+    SELECT categoria_id, COUNT(*) as total FROM repuestos WHERE activo = TRUE GROUP BY categoria_id
+) r ON r.categoria_id = c.id
+SET c.total_repuestos = IFNULL(r.total, 0);
+
+UPDATE facturas f
+LEFT JOIN (
+    SELECT factura_id, SUM(monto) as total FROM pagos_factura GROUP BY factura_id
+) p ON p.factura_id = f.id
+SET f.total_pagado = IFNULL(p.total, 0);
+
+-- ==================== 16. CLAVE NORMALIZADA DE PLACAS ====================
+
+-- Misma regla que formatearPlaca (validacion_placas.js) y placas.normalizar_placa:
+-- mayúsculas, solo letras y números. Búsquedas exactas y por prefijo usan el índice.
+-- Requiere REGEXP_REPLACE (MySQL 8.0+ o MariaDB 10.0.5+; no existe en MySQL 5.7).
+ALTER TABLE vehiculos_clientes
+    ADD COLUMN IF NOT EXISTS placa_normalizada VARCHAR(10) NULL COMMENT 'Placa sin espacios ni guiones, en mayúsculas' AFTER placa,
+    ADD INDEX IF NOT EXISTS idx_placa_normalizada (placa_normalizada, activo);
+
+DROP TRIGGER IF EXISTS placa_vehiculos_insert;
+DROP TRIGGER IF EXISTS placa_vehiculos_update;
+
+DELIMITER //
+
+CREATE TRIGGER placa_vehiculos_insert
+BEFORE INSERT ON vehiculos_clientes
+FOR EACH ROW
+    SET NEW.placa_normalizada = REGEXP_REPLACE(UPPER(NEW.placa), '[^A-Z0-9]', '')//
+
+CREATE TRIGGER placa_vehiculos_update
+BEFORE UPDATE ON vehiculos_clientes
+FOR EACH ROW
+    SET NEW.placa_normalizada = REGEXP_REPLACE(UPPER(NEW.placa), '[^A-Z0-9]', '')//
+
+DELIMITER ;
+
+UPDATE vehiculos_clientes
+SET placa_normalizada = REGEXP_REPLACE(UPPER(placa), '[^A-Z0-9]', '')
+WHERE placa_normalizada IS NULL;
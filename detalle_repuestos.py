@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Detalle de repuesto para el modal (/api/repuestos/<id>/detalle)
+- Validadores (versión de la fila y de las tablas relacionadas) en una consulta por PK
+- Detalle completo en una sola consulta: repuesto, categoría e imágenes con sus
+  variantes, compatibilidad y equivalentes como subconsultas de agregación JSON
+- Caché LRU por proceso y por repuesto, guardada junto con su ETag: cualquier escritura
+  del repuesto, de sus imágenes, compatibilidad o equivalentes (version_detalle de la
+  fila), o de las categorías, marcas y modelos (contadores de catalogo_versiones) cambia
+  el ETag y la entrada deja de servirse, también en los demás procesos. Las escrituras
+  de otros repuestos no la afectan. El stock no cambia las versiones: las cantidades de
+  la fila forman parte del ETag
+
+Requiere JSON_ARRAYAGG / JSON_OBJECTAGG (MariaDB 10.5+ o MySQL 5.7.22+).
+"""
+
+from collections import OrderedDict
+from database import execute_query
+from condicional import validadores
+from imagenes import urls_imagenes
+from metricas import registrar_cache, entradas_cache
+import json
+import os
+import threading
+
+# Catálogos compartidos cuya versión forma parte del ETag: nombre de la categoría y
+# nombres de marca y modelo de la compatibilidad ('modelos': marcas_vehiculos y
+# modelos_vehiculos, sin los vehículos de los clientes). Imágenes, compatibilidad y
+# equivalentes cambian version_detalle del propio repuesto
+CATALOGOS_DETALLE = ('categorias', 'modelos')
+
+
+class CacheLRU:
+    """Diccionario acotado: al superar 'capacidad' descarta la entrada usada hace más tiempo"""
+
+    def __init__(self, capacidad):
+        self.capacidad = capacidad
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            valor = self._datos.get(clave)
+            if valor is not None:
+                self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor):
+        if self.capacidad <= 0:
+            return
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.capacidad:
+                self._datos.popitem(last=False)
+
+    def quitar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def __len__(self):
+        return len(self._datos)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _reiniciar_tras_fork():
+    """Proceso hijo (servidor prefork): caché y lock propios de cada proceso"""
+    global _cache, _cache_lock
+    _cache = None
+    _cache_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):  # Solo POSIX
+    os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+
+def _cache_detalles(capacidad):
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.capacidad != capacidad:
+            _cache = CacheLRU(capacidad)
+        return _cache
+
+
+def validadores_detalle(repuesto_id):
+    """
+    ETag y Last-Modified del detalle, sin armarlo.
+
+    Returns:
+        Tupla (etag, ultima_modificacion), o None si el repuesto no existe
+    """
+    placeholders = ', '.join(['%s'] * len(CATALOGOS_DETALLE))
+    fila = execute_query(f"""
+        SELECT r.version_catalogo, r.version_detalle, r.cantidad_actual, r.cantidad_reservada,
+               r.updated_at,
+               GROUP_CONCAT(cv.version ORDER BY cv.catalogo SEPARATOR '-') as versiones,
+               MAX(cv.updated_at) as versiones_at
+        FROM repuestos r
+        LEFT JOIN catalogo_versiones cv ON cv.catalogo IN ({placeholders})
+        WHERE r.id = %s
+        GROUP BY r.id, r.version_catalogo, r.version_detalle, r.cantidad_actual,
+                 r.cantidad_reservada, r.updated_at
+    """, CATALOGOS_DETALLE + (repuesto_id,), fetch_one=True)
+    if not fila:
+        return None
+    return validadores('rep', repuesto_id, fila['version_catalogo'], fila['version_detalle'],
+                       fila['cantidad_actual'], fila['cantidad_reservada'], fila['versiones'] or 0,
+                       fechas=[fila['updated_at'], fila['versiones_at']])
+
+
+def _json(valor):
+    """Columna JSON a objeto (MariaDB devuelve como texto los JSON anidados en subconsultas)"""
+    while isinstance(valor, (str, bytes)):
+        valor = json.loads(valor)
+    return valor
+
+
+def _consultar_detalle(repuesto_id):
+    """Repuesto con sus relaciones en una sola consulta"""
+    repuesto = execute_query("""
+        SELECT r.*, c.nombre as categoria_nombre,
+               (SELECT JSON_ARRAYAGG(JSON_OBJECT(
+                        'id', i.id, 'nombre_archivo', i.nombre_archivo, 'ruta_archivo', i.ruta_archivo,
+                        'es_principal', i.es_principal, 'orden', i.orden, 'ancho', i.ancho, 'alto', i.alto,
+                        'variantes', (SELECT JSON_OBJECTAGG(v.variante, JSON_OBJECT(
+                                          'ruta_archivo', v.ruta_archivo, 'ancho', v.ancho, 'alto', v.alto))
+                                      FROM variantes_imagenes_repuestos v
+                                      WHERE v.imagen_id = i.id)))
+                FROM imagenes_repuestos i
+                WHERE i.repuesto_id = r.id) as imagenes_json,
+               (SELECT JSON_ARRAYAGG(JSON_OBJECT(
+                        'id', rc.id, 'modelo_vehiculo_id', rc.modelo_vehiculo_id,
+                        'observaciones', rc.observaciones, 'modelo', mv.nombre, 'marca', ma.nombre))
+                FROM repuestos_compatibilidad rc
+                JOIN modelos_vehiculos mv ON rc.modelo_vehiculo_id = mv.id
+                JOIN marcas_vehiculos ma ON mv.marca_id = ma.id
+                WHERE rc.repuesto_id = r.id) as compatibilidad_json,
+               (SELECT JSON_ARRAYAGG(JSON_OBJECT(
+                        'id', e.id, 'marca_equivalente', e.marca_equivalente,
+                        'codigo_equivalente', e.codigo_equivalente, 'observaciones', e.observaciones))
+                FROM repuestos_equivalentes e
+                WHERE e.repuesto_id = r.id) as equivalentes_json
+        FROM repuestos r
+        LEFT JOIN categorias_repuestos c ON r.categoria_id = c.id
+        WHERE r.id = %s
+    """, (repuesto_id,), fetch_one=True)
+    if not repuesto:
+        return None
+
+    data = dict(repuesto)
+    imagenes = _json(data.pop('imagenes_json')) or []
+    # JSON_ARRAYAGG no garantiza orden: principal primero, luego 'orden'
+    imagenes.sort(key=lambda i: (not i['es_principal'], i['orden'] or 0, i['id']))
+    variantes = {i['id']: _json(i.pop('variantes')) or {} for i in imagenes}
+
+    compatibilidad = _json(data.pop('compatibilidad_json')) or []
+    compatibilidad.sort(key=lambda c: (c['marca'], c['modelo']))
+
+    data['precio_venta'] = str(data.get('precio_venta', 0))
+    data['imagenes'] = urls_imagenes(imagenes, variantes)
+    data['compatibilidad'] = compatibilidad
+    data['equivalentes'] = sorted(_json(data.pop('equivalentes_json')) or [], key=lambda e: e['id'])
+    data['disponible'] = data.get('cantidad_actual', 0) - data.get('cantidad_reservada', 0)
+    return data
+
+
+def detalle_repuesto(repuesto_id, etag, capacidad=500):
+    """
+    Detalle del repuesto para el ETag dado, desde la caché si está vigente.
+
+    Returns:
+        Dict del detalle, o None si el repuesto no existe
+    """
+    cache = _cache_detalles(capacidad)
+    entrada = cache.obtener(repuesto_id)
+    if entrada is not None and entrada[0] == etag:
+        registrar_cache('detalles', True)
+        return entrada[1]
+    registrar_cache('detalles', False)
+
+    data = _consultar_detalle(repuesto_id)
+    if data is None:
+        cache.quitar(repuesto_id)
+    else:
+        cache.guardar(repuesto_id, (etag, data))
+    entradas_cache('detalles', len(cache))
+    return data
@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""
+Imágenes de repuestos
+- El original se guarda una sola vez, con el hash SHA-256 de su contenido como nombre
+  (la misma foto subida dos veces ocupa un solo archivo)
+- Un grupo de hilos genera en segundo plano las variantes (miniatura y media, cada una
+  en el formato original y en WebP), orientadas según EXIF y sin metadatos
+- imagenes_repuestos guarda las dimensiones del original y variantes_imagenes_repuestos
+  las de cada variante; las listas y el detalle sirven el tamaño adecuado
+- Los archivos por hash que ninguna imagen usa se borran en el barrido de
+  flask procesar-imagenes (no al eliminar: otra subida puede estar reutilizándolos)
+
+Pillow es opcional: sin él las imágenes quedan PENDIENTES y se sirve el original
+(flask procesar-imagenes las procesa cuando esté instalado).
+"""
+
+from flask import current_app, url_for
+from database import execute_query, transaccion
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.utils import secure_filename
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - dependencia opcional
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Variantes generadas: nombre -> lado máximo en píxeles
+VARIANTES = {'miniatura': 160, 'media': 640}
+
+# Archivos guardados por hash: <hash>.<ext> (original) y <hash>_<variante>.<ext>
+_NOMBRE_POR_HASH = re.compile(r'^([0-9a-f]{64})(?:_[a-z_]+)?\.[a-z0-9]+$')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _reiniciar_tras_fork():
+    """Proceso hijo (servidor prefork): los hilos del grupo no sobreviven al fork"""
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):  # Solo POSIX
+    os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+
+def pillow_disponible():
+    """True si Pillow está instalado"""
+    return Image is not None
+
+
+def _directorio(*partes):
+    return os.path.join(current_app.config.get('UPLOAD_FOLDER', 'static/uploads'), 'repuestos', *partes)
+
+
+def _ruta_relativa(ruta_absoluta):
+    """Ruta relativa a static/ (la que se guarda en la base de datos y se sirve con url_for)"""
+    return os.path.relpath(ruta_absoluta, current_app.static_folder).replace(os.sep, '/')
+
+
+def _ruta_absoluta(ruta_archivo):
+    return os.path.join(current_app.static_folder, ruta_archivo)
+
+
+def _hash_archivo(ruta):
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def _guardar_original(archivo, ext):
+    """
+    Guarda el archivo subido por su hash de contenido.
+    Se escribe en bloques a un temporal calculando el hash (sin cargarlo entero en memoria).
+
+    Returns:
+        Tupla (hash, ruta_absoluta, bytes)
+    """
+    sha = hashlib.sha256()
+    directorio_tmp = _directorio('originales')
+    os.makedirs(directorio_tmp, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(dir=directorio_tmp, suffix='.tmp')
+    tamano = 0
+    try:
+        with os.fdopen(fd, 'wb') as destino:
+            for bloque in iter(lambda: archivo.stream.read(1024 * 1024), b''):
+                sha.update(bloque)
+                destino.write(bloque)
+                tamano += len(bloque)
+        hash_contenido = sha.hexdigest()
+        directorio = _directorio('originales', hash_contenido[:2])
+        os.makedirs(directorio, exist_ok=True)
+        ruta = os.path.join(directorio, f'{hash_contenido}.{ext}')
+        if os.path.exists(ruta):
+            os.remove(temporal)
+            # Archivo en uso otra vez: el barrido de huérfanos respeta los recientes
+            os.utime(ruta)
+        else:
+            os.replace(temporal, ruta)
+        return hash_contenido, ruta, tamano
+    except Exception:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def guardar_imagenes(repuesto_id, archivos, usuario_id):
+    """
+    Guarda las imágenes subidas para un repuesto y encola la generación de variantes.
+    La primera imagen del repuesto queda como principal.
+
+    Returns:
+        Lista de IDs de imagenes_repuestos creados
+    """
+    allowed = current_app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'gif', 'webp'})
+    existentes = execute_query(
+        "SELECT hash_contenido, es_principal FROM imagenes_repuestos WHERE repuesto_id = %s",
+        (repuesto_id,), fetch_all=True
+    )
+    hashes = {i['hash_contenido'] for i in existentes}
+    hay_principal = any(i['es_principal'] for i in existentes)
+    creadas = []
+
+    with transaccion():
+        for archivo in archivos:
+            if not archivo or not archivo.filename:
+                continue
+            ext = archivo.filename.rsplit('.', 1)[-1].lower() if '.' in archivo.filename else ''
+            if ext not in allowed:
+                continue
+            hash_contenido, ruta, tamano = _guardar_original(archivo, ext)
+            if hash_contenido in hashes:
+                continue  # La misma imagen ya está asociada al repuesto
+            hashes.add(hash_contenido)
+
+            imagen_id = execute_query("""
+                INSERT INTO imagenes_repuestos
+                (repuesto_id, nombre_archivo, ruta_archivo, hash_contenido, bytes, es_principal, created_by)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (repuesto_id, secure_filename(archivo.filename) or os.path.basename(ruta),
+                  _ruta_relativa(ruta), hash_contenido, tamano, not hay_principal, usuario_id))
+            hay_principal = True
+            creadas.append(imagen_id)
+
+    encolar_procesamiento(creadas)
+    return creadas
+
+
+def _pool_imagenes():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=current_app.config.get('IMAGENES_WORKERS', 2),
+                thread_name_prefix='imagenes'
+            )
+        return _pool
+
+
+def _procesar_en_contexto(app, imagen_id):
+    with app.app_context():
+        try:
+            procesar_imagen(imagen_id)
+        except Exception as e:
+            logger.error(f"Error procesando imagen {imagen_id}: {e}")
+
+
+def encolar_procesamiento(imagen_ids):
+    """Genera las variantes en segundo plano (sin Pillow las imágenes quedan PENDIENTES)"""
+    if not imagen_ids or not pillow_disponible():
+        return
+    app = current_app._get_current_object()
+    pool = _pool_imagenes()
+    for imagen_id in imagen_ids:
+        pool.submit(_procesar_en_contexto, app, imagen_id)
+
+
+def _guardar_variante(imagen, nombre, formato, hash_contenido):
+    """Guarda una variante (sin EXIF: Pillow no copia metadatos salvo que se le pidan)"""
+    ext = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}[formato]
+    directorio = _directorio('variantes', hash_contenido[:2])
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f'{hash_contenido}_{nombre}.{ext}')
+    if os.path.exists(ruta):
+        os.utime(ruta)
+    else:
+        temporal = f'{ruta}.{threading.get_ident()}.tmp'
+        opciones = {'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+                    'PNG': {'optimize': True},
+                    'WEBP': {'quality': 80, 'method': 4}}[formato]
+        imagen.save(temporal, formato, **opciones)
+        os.replace(temporal, ruta)
+    return ruta
+
+
+def procesar_imagen(imagen_id):
+    """
+    Genera las variantes de una imagen y registra sus dimensiones.
+
+    Returns:
+        True si quedó PROCESADA
+    """
+    if not pillow_disponible():
+        raise RuntimeError('El procesamiento de imágenes requiere Pillow (pip install Pillow)')
+
+    fila = execute_query(
+        "SELECT id, ruta_archivo, hash_contenido FROM imagenes_repuestos WHERE id = %s",
+        (imagen_id,), fetch_one=True
+    )
+    if not fila:
+        return False
+    ruta = _ruta_absoluta(fila['ruta_archivo'])
+
+    try:
+        # Imágenes anteriores al almacenamiento por hash
+        hash_contenido = fila['hash_contenido'] or _hash_archivo(ruta)
+        with Image.open(ruta) as original:
+            original = ImageOps.exif_transpose(original)
+            ancho, alto = original.size
+            con_alfa = original.mode in ('RGBA', 'LA', 'P') and (
+                original.mode != 'P' or 'transparency' in original.info
+            )
+            base = original.convert('RGBA' if con_alfa else 'RGB')
+            formato_base = 'PNG' if con_alfa else 'JPEG'
+
+            variantes = []
+            for nombre, lado in VARIANTES.items():
+                reducida = base.copy()
+                reducida.thumbnail((lado, lado), Image.LANCZOS)
+                for variante, formato in ((nombre, formato_base), (f'{nombre}_webp', 'WEBP')):
+                    destino = _guardar_variante(reducida, variante, formato, hash_contenido)
+                    variantes.append((imagen_id, variante, formato.lower(), _ruta_relativa(destino),
+                                      reducida.width, reducida.height, os.path.getsize(destino)))
+    except Exception as e:
+        logger.error(f"Imagen {imagen_id} ({fila['ruta_archivo']}) no procesada: {e}")
+        execute_query("UPDATE imagenes_repuestos SET estado_proceso = 'ERROR' WHERE id = %s",
+                      (imagen_id,), commit=True)
+        return False
+
+    with transaccion():
+        for v in variantes:
+            execute_query("""
+                INSERT INTO variantes_imagenes_repuestos
+                (imagen_id, variante, formato, ruta_archivo, ancho, alto, bytes)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    formato = VALUES(formato), ruta_archivo = VALUES(ruta_archivo),
+                    ancho = VALUES(ancho), alto = VALUES(alto), bytes = VALUES(bytes)
+            """, v)
+        execute_query("""
+            UPDATE imagenes_repuestos
+            SET hash_contenido = %s, ancho = %s, alto = %s, bytes = %s, estado_proceso = 'PROCESADA'
+            WHERE id = %s
+        """, (hash_contenido, ancho, alto, os.path.getsize(ruta), imagen_id))
+    return True
+
+
+def procesar_pendientes(reintentar=False):
+    """
+    Procesa en este proceso las imágenes pendientes (y con error si reintentar).
+
+    Returns:
+        Dict con 'procesadas' y 'errores'
+    """
+    estados = ('PENDIENTE', 'ERROR') if reintentar else ('PENDIENTE',)
+    placeholders = ', '.join(['%s'] * len(estados))
+    pendientes = execute_query(
+        f"SELECT id FROM imagenes_repuestos WHERE estado_proceso IN ({placeholders}) ORDER BY id",
+        estados, fetch_all=True
+    )
+    resultado = {'procesadas': 0, 'errores': 0}
+    for p in pendientes:
+        if procesar_imagen(p['id']):
+            resultado['procesadas'] += 1
+        else:
+            resultado['errores'] += 1
+    return resultado
+
+
+def eliminar_imagen(imagen_id):
+    """
+    Elimina una imagen. Los archivos guardados por hash quedan para limpiar_huerfanos:
+    decidir aquí que nadie más los usa competiría con una subida concurrente del mismo
+    contenido, que ya encontró el archivo y aún no insertó su fila.
+
+    Returns:
+        True si existía
+    """
+    imagen = execute_query("SELECT * FROM imagenes_repuestos WHERE id = %s", (imagen_id,), fetch_one=True)
+    if not imagen:
+        return False
+
+    with transaccion():
+        execute_query("DELETE FROM imagenes_repuestos WHERE id = %s", (imagen_id,))
+        # La siguiente imagen pasa a ser la principal
+        if imagen['es_principal']:
+            execute_query("""
+                UPDATE imagenes_repuestos SET es_principal = TRUE
+                WHERE repuesto_id = %s
+                ORDER BY orden, id
+                LIMIT 1
+            """, (imagen['repuesto_id'],))
+
+    # Original anterior al almacenamiento por hash: es solo de esta fila
+    if not _NOMBRE_POR_HASH.match(os.path.basename(imagen['ruta_archivo'])):
+        ruta = _ruta_absoluta(imagen['ruta_archivo'])
+        if os.path.exists(ruta):
+            os.remove(ruta)
+    return True
+
+
+def limpiar_huerfanos(antiguedad=None):
+    """
+    Borra los originales y variantes guardados por hash que ninguna imagen usa, y los
+    temporales abandonados. Solo considera archivos sin modificar en 'antiguedad'
+    segundos (IMAGENES_GRACIA_HUERFANOS): una subida que reutiliza un archivo lo
+    actualiza antes de insertar su fila.
+
+    Returns:
+        Cantidad de archivos eliminados
+    """
+    if antiguedad is None:
+        antiguedad = current_app.config.get('IMAGENES_GRACIA_HUERFANOS', 3600)
+    limite = time.time() - antiguedad
+
+    por_hash = {}
+    temporales = []
+    for carpeta in ('originales', 'variantes'):
+        for raiz, _, nombres in os.walk(_directorio(carpeta)):
+            for nombre in nombres:
+                ruta = os.path.join(raiz, nombre)
+                try:
+                    if os.path.getmtime(ruta) > limite:
+                        continue
+                except OSError:
+                    continue
+                if nombre.endswith('.tmp'):
+                    temporales.append(ruta)
+                    continue
+                coincidencia = _NOMBRE_POR_HASH.match(nombre)
+                if coincidencia:
+                    por_hash.setdefault(coincidencia.group(1), []).append(ruta)
+
+    hashes = list(por_hash)
+    for i in range(0, len(hashes), 500):
+        lote = hashes[i:i + 500]
+        placeholders = ', '.join(['%s'] * len(lote))
+        for fila in execute_query(f"""
+            SELECT DISTINCT hash_contenido FROM imagenes_repuestos
+            WHERE hash_contenido IN ({placeholders})
+        """, tuple(lote), fetch_all=True):
+            por_hash.pop(fila['hash_contenido'], None)
+
+    eliminados = 0
+    for ruta in temporales + [r for rutas in por_hash.values() for r in rutas]:
+        try:
+            os.remove(ruta)
+            eliminados += 1
+        except FileNotFoundError:
+            pass
+    if eliminados:
+        logger.info(f"Imágenes: {eliminados} archivos sin referencia eliminados")
+    return eliminados
+
+
+def _variantes(imagen_ids):
+    """{imagen_id: {variante: fila}} en una sola consulta"""
+    if not imagen_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(imagen_ids))
+    resultado = {}
+    for v in execute_query(f"""
+        SELECT imagen_id, variante, ruta_archivo, ancho, alto
+        FROM variantes_imagenes_repuestos
+        WHERE imagen_id IN ({placeholders})
+    """, tuple(imagen_ids), fetch_all=True):
+        resultado.setdefault(v['imagen_id'], {})[v['variante']] = v
+    return resultado
+
+
+def urls_imagenes(imagenes, variantes=None):
+    """
+    URLs por tamaño para filas de imagenes_repuestos ('original', 'miniatura', 'media' y
+    sus '_webp'). Mientras no haya variantes se usa el original (sin WebP).
+    'variantes' ({imagen_id: {variante: fila}}) evita la consulta si ya se tienen.
+    """
+    if variantes is None:
+        variantes = _variantes([i['id'] for i in imagenes])
+    resultado = []
+    for i in imagenes:
+        original = url_for('static', filename=i['ruta_archivo'])
+        propias = variantes.get(i['id'], {})
+        datos = {
+            'id': i['id'],
+            'nombre_archivo': i['nombre_archivo'],
+            'es_principal': bool(i['es_principal']),
+            'ancho': i.get('ancho'),
+            'alto': i.get('alto'),
+            'original': original
+        }
+        for nombre in VARIANTES:
+            for variante in (nombre, f'{nombre}_webp'):
+                v = propias.get(variante)
+                datos[variante] = url_for('static', filename=v['ruta_archivo']) if v else (
+                    None if variante.endswith('_webp') else original
+                )
+            v = propias.get(nombre)
+            datos[f'{nombre}_ancho'] = v['ancho'] if v else None
+            datos[f'{nombre}_alto'] = v['alto'] if v else None
+        resultado.append(datos)
+    return resultado
+
+
+def imagenes_repuesto(repuesto_id):
+    """Imágenes de un repuesto con sus URLs por tamaño (principal primero)"""
+    return urls_imagenes(execute_query("""
+        SELECT id, nombre_archivo, ruta_archivo, es_principal, ancho, alto
+        FROM imagenes_repuestos
+        WHERE repuesto_id = %s
+        ORDER BY es_principal DESC, orden, id
+    """, (repuesto_id,), fetch_all=True))
+
+
+def miniaturas_principales(repuesto_ids):
+    """{repuesto_id: urls} de la imagen principal de cada repuesto (para listas)"""
+    if not repuesto_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(repuesto_ids))
+    principales = execute_query(f"""
+        SELECT id, repuesto_id, nombre_archivo, ruta_archivo, es_principal, ancho, alto
+        FROM imagenes_repuestos
+        WHERE repuesto_id IN ({placeholders}) AND es_principal = TRUE
+    """, tuple(repuesto_ids), fetch_all=True)
+    return {p['repuesto_id']: u for p, u in zip(principales, urls_imagenes(principales))}
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Kardex de repuestos (tarjeta de stock)
+- Eventos que mueven cantidad_actual: movimientos confirmados/facturados y ajustes aprobados
+- Orden del kardex por (fecha, fuente, id); paginación por clave (seek), sin OFFSET
+- Saldo acumulado con funciones de ventana sobre la página
+- Cortes periódicos de saldo (kardex_saldos) para no reproducir toda la historia
+
+Requiere funciones de ventana (MySQL 8.0+ o MariaDB 10.2+).
+"""
+
+from database import execute_query, execute_many
+from datetime import datetime, date, timedelta
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Efecto de cada movimiento sobre cantidad_actual: las entradas confirmadas suman,
+# las ventas facturadas y las salidas confirmadas restan. PENDIENTE/APROBADO solo
+# reservan; DEVUELTO, RECHAZADO y ANULADO no cambian el stock físico.
+DELTA_MOVIMIENTO = "CASE WHEN m.estado = 'FACTURADO' OR t.tipo = 'SALIDA' THEN -m.cantidad ELSE m.cantidad END"
+
+# Clave (fecha, fuente, id) menor que la dada
+CLAVE_MENOR = "(e.fecha < %s OR (e.fecha = %s AND (e.fuente < %s OR (e.fuente = %s AND e.id < %s))))"
+
+
+def sql_eventos(filtro, desde=False, hasta=False, detalle=False):
+    """
+    Consulta de eventos del kardex (sin ORDER BY) con las columnas
+    repuesto_id, fecha, fuente (0 movimiento, 1 ajuste), id y delta; con detalle=True
+    agrega concepto, estado, precio_unitario, usuario_id y observaciones.
+
+    Args:
+        filtro: Condición sobre repuesto_id (ej: '= %s', 'BETWEEN %s AND %s')
+        desde/hasta: Si son True, cada rama agrega 'fecha >= %s' / 'fecha < %s'.
+                     Parámetros por rama, en orden: los del filtro, desde, hasta
+    """
+    fecha_ajuste = 'COALESCE(h.fecha_aprobacion, h.created_at)'
+    rango_mov = (' AND m.created_at >= %s' if desde else '') + (' AND m.created_at < %s' if hasta else '')
+    rango_aj = (f' AND {fecha_ajuste} >= %s' if desde else '') + (f' AND {fecha_ajuste} < %s' if hasta else '')
+    columnas_mov = columnas_aj = ''
+    if detalle:
+        columnas_mov = (", t.nombre as concepto, m.estado, m.precio_unitario,"
+                        " m.usuario_id, m.observaciones")
+        columnas_aj = ", 'Ajuste de inventario', h.estado, NULL, h.usuario_id, h.motivo"
+    return f"""
+        SELECT m.repuesto_id, m.created_at as fecha, 0 as fuente, m.id,
+               {DELTA_MOVIMIENTO} as delta{columnas_mov}
+        FROM movimientos_inventario m
+        LEFT JOIN tipos_movimiento t ON m.tipo_movimiento_id = t.id
+        WHERE m.estado IN ('CONFIRMADO', 'FACTURADO')
+        AND m.repuesto_id {filtro}{rango_mov}
+        UNION ALL
+        SELECT h.repuesto_id, {fecha_ajuste}, 1, h.id, h.diferencia{columnas_aj}
+        FROM historial_ajustes_inventario h
+        WHERE h.estado = 'APROBADO'
+        AND h.repuesto_id {filtro}{rango_aj}
+    """
+
+
+def clave_texto(evento):
+    """Clave de paginación 'YYYYmmddHHMMSS-fuente-id' de un evento"""
+    return f"{evento['fecha']:%Y%m%d%H%M%S}-{evento['fuente']}-{evento['id']}"
+
+
+def leer_clave(texto):
+    """Convierte una clave de paginación en (fecha, fuente, id); None si no es válida"""
+    try:
+        fecha, fuente, id_ = texto.split('-')
+        return datetime.strptime(fecha, '%Y%m%d%H%M%S'), int(fuente), int(id_)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _params_clave(clave):
+    fecha, fuente, id_ = clave
+    return (fecha, fecha, fuente, fuente, id_)
+
+
+def saldo_antes(repuesto_id, clave):
+    """
+    Saldo del kardex justo antes del evento con la clave dada.
+    Parte del último corte no posterior a la fecha (o del saldo inicial del
+    repuesto) y suma solo los eventos entre el corte y la clave.
+    """
+    # Las fechas se guardan con resolución de segundos: fecha < clave + 1 s equivale a <= clave
+    hasta = clave[0] + timedelta(seconds=1)
+    corte = execute_query("""
+        SELECT corte, saldo FROM kardex_saldos
+        WHERE repuesto_id = %s AND corte <= %s
+        ORDER BY corte DESC LIMIT 1
+    """, (repuesto_id, clave[0]), fetch_one=True)
+
+    if corte:
+        base = corte['saldo']
+        desde = datetime.combine(corte['corte'], datetime.min.time())
+        eventos = sql_eventos('= %s', desde=True, hasta=True)
+        params = (repuesto_id, desde, hasta) * 2
+    else:
+        inicial = execute_query(
+            "SELECT IFNULL(cantidad_inicial, 0) as saldo FROM repuestos WHERE id = %s",
+            (repuesto_id,), fetch_one=True
+        )
+        base = inicial['saldo'] if inicial else 0
+        eventos = sql_eventos('= %s', hasta=True)
+        params = (repuesto_id, hasta) * 2
+
+    fila = execute_query(f"""
+        SELECT IFNULL(SUM(e.delta), 0) as neto
+        FROM ({eventos}) e
+        WHERE {CLAVE_MENOR}
+    """, params + _params_clave(clave), fetch_one=True)
+    return base + int(fila['neto'])
+
+
+def _condicion_seek(col_fecha, col_id, op):
+    """
+    Predicado de búsqueda por clave (fecha, fuente, id) para una rama del kardex.
+    La fuente de la rama es una constante y llega como parámetro.
+    """
+    return (f"({col_fecha} {op} %s OR ({col_fecha} = %s AND "
+            f"(%s {op} %s OR (%s = %s AND {col_id} {op} %s))))")
+
+
+def _sql_pagina(orden):
+    """
+    Página de eventos por clave. Cada rama lee en orden de índice y se corta en
+    LIMIT antes de unirse, así el costo depende del tamaño de página y no de la historia.
+    """
+    op = '>' if orden == 'ASC' else '<'
+    fecha_ajuste = 'COALESCE(h.fecha_aprobacion, h.created_at)'
+    return f"""
+        SELECT p.*, SUM(p.delta) OVER (ORDER BY p.fecha, p.fuente, p.id) as acumulado,
+               u.nombre_completo as usuario
+        FROM (
+            SELECT e.* FROM (
+                (SELECT m.created_at as fecha, 0 as fuente, m.id, {DELTA_MOVIMIENTO} as delta,
+                        t.nombre as concepto, m.estado, m.precio_unitario, m.usuario_id,
+                        m.observaciones
+                 FROM movimientos_inventario m
+                 LEFT JOIN tipos_movimiento t ON m.tipo_movimiento_id = t.id
+                 WHERE m.repuesto_id = %s AND m.estado IN ('CONFIRMADO', 'FACTURADO')
+                 AND {_condicion_seek('m.created_at', 'm.id', op)}
+                 ORDER BY m.created_at {orden}, m.id {orden}
+                 LIMIT %s)
+                UNION ALL
+                (SELECT {fecha_ajuste}, 1, h.id, h.diferencia,
+                        'Ajuste de inventario', h.estado, NULL, h.usuario_id, h.motivo
+                 FROM historial_ajustes_inventario h
+                 WHERE h.repuesto_id = %s AND h.estado = 'APROBADO'
+                 AND {_condicion_seek(fecha_ajuste, 'h.id', op)}
+                 ORDER BY {fecha_ajuste} {orden}, h.id {orden}
+                 LIMIT %s)
+            ) e
+            ORDER BY e.fecha {orden}, e.fuente {orden}, e.id {orden}
+            LIMIT %s
+        ) p
+        LEFT JOIN usuarios u ON p.usuario_id = u.id
+        ORDER BY p.fecha, p.fuente, p.id
+    """
+
+
+def pagina_kardex(repuesto_id, limite=50, despues=None, antes=None):
+    """
+    Una página del kardex de un repuesto con saldo acumulado.
+
+    Args:
+        limite: Eventos por página
+        despues: Clave (fecha, fuente, id); página con los eventos siguientes
+        antes: Clave; página con los eventos anteriores. Sin claves: últimos eventos
+
+    Returns:
+        Dict con 'eventos' (orden cronológico, cada uno con 'entrada', 'salida' y 'saldo'),
+        'saldo_anterior' (saldo antes de la página), 'anterior' y 'siguiente'
+        (claves de texto para las páginas vecinas, o None)
+    """
+    clave = despues or antes or (datetime.max.replace(microsecond=0), 2, 0)
+    orden = 'ASC' if despues else 'DESC'
+    fecha, fuente, id_ = clave
+    params = []
+    for constante in (0, 1):
+        params += [repuesto_id, fecha, fecha, constante, fuente, constante, fuente, id_, limite + 1]
+    filas = execute_query(_sql_pagina(orden), tuple(params) + (limite + 1,), fetch_all=True) or []
+
+    # Una fila extra indica que hay más eventos en la dirección de lectura
+    hay_mas = len(filas) > limite
+    desplazamiento = 0
+    if hay_mas:
+        if despues:
+            filas = filas[:limite]
+        else:
+            # La fila extra es la más antigua y su delta ya está en el acumulado
+            desplazamiento = filas[0]['acumulado']
+            filas = filas[1:]
+
+    if not filas:
+        return {'eventos': [], 'saldo_anterior': None, 'anterior': None, 'siguiente': None}
+
+    saldo_anterior = saldo_antes(repuesto_id, (filas[0]['fecha'], filas[0]['fuente'], filas[0]['id']))
+    for f in filas:
+        f['saldo'] = saldo_anterior + int(f['acumulado'] - desplazamiento)
+        f['entrada'] = f['delta'] if f['delta'] > 0 else None
+        f['salida'] = -f['delta'] if f['delta'] < 0 else None
+
+    if despues:
+        anterior, siguiente = True, hay_mas
+    else:
+        anterior, siguiente = hay_mas, antes is not None
+    return {
+        'eventos': filas,
+        'saldo_anterior': saldo_anterior,
+        'anterior': clave_texto(filas[0]) if anterior else None,
+        'siguiente': clave_texto(filas[-1]) if siguiente else None
+    }
+
+
+def generar_cortes(corte=None, tamano_lote=1000):
+    """
+    Registra el saldo de cada repuesto al inicio del día 'corte' (eventos con fecha < corte).
+    Cada corte parte del anterior, así que solo lee los eventos entre ambos.
+
+    Args:
+        corte: Fecha del corte (por defecto, el primer día del mes actual)
+        tamano_lote: Cantidad de IDs de repuesto por transacción
+
+    Returns:
+        Dict con 'corte', 'repuestos', 'lotes' y 'segundos'
+    """
+    inicio = time.monotonic()
+    corte = corte or date.today().replace(day=1)
+    limite = datetime.combine(corte, datetime.min.time())
+    limites = execute_query("SELECT MIN(id) as minimo, MAX(id) as maximo FROM repuestos", fetch_one=True)
+    resultado = {'corte': corte, 'repuestos': 0, 'lotes': 0}
+
+    if limites['minimo'] is not None:
+        for desde in range(limites['minimo'], limites['maximo'] + 1, tamano_lote):
+            hasta = desde + tamano_lote - 1
+
+            # Corte anterior de cada repuesto (o su saldo inicial)
+            bases = execute_query("""
+                SELECT r.id, k.corte, IFNULL(k.saldo, IFNULL(r.cantidad_inicial, 0)) as saldo
+                FROM repuestos r
+                LEFT JOIN kardex_saldos k ON k.repuesto_id = r.id
+                    AND k.corte = (SELECT MAX(k2.corte) FROM kardex_saldos k2
+                                   WHERE k2.repuesto_id = r.id AND k2.corte < %s)
+                WHERE r.id BETWEEN %s AND %s
+            """, (corte, desde, hasta), fetch_all=True)
+            if not bases:
+                continue
+
+            # Eventos entre el corte anterior de cada repuesto y el nuevo corte
+            netos = {f['repuesto_id']: int(f['neto']) for f in execute_query(f"""
+                SELECT e.repuesto_id, SUM(e.delta) as neto
+                FROM ({sql_eventos('BETWEEN %s AND %s', hasta=True)}) e
+                LEFT JOIN (
+                    SELECT repuesto_id, MAX(corte) as corte FROM kardex_saldos
+                    WHERE repuesto_id BETWEEN %s AND %s AND corte < %s
+                    GROUP BY repuesto_id
+                ) k ON k.repuesto_id = e.repuesto_id
+                WHERE k.corte IS NULL OR e.fecha >= k.corte
+                GROUP BY e.repuesto_id
+            """, (desde, hasta, limite) * 2 + (desde, hasta, corte), fetch_all=True)}
+
+            execute_many("""
+                INSERT INTO kardex_saldos (repuesto_id, corte, saldo)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE saldo = VALUES(saldo)
+            """, [(b['id'], corte, b['saldo'] + netos.get(b['id'], 0)) for b in bases])
+            resultado['repuestos'] += len(bases)
+            resultado['lotes'] += 1
+
+    resultado['segundos'] = round(time.monotonic() - inicio, 2)
+    logger.info(f"Cortes de kardex al {corte}: {resultado['repuestos']} repuestos "
+                f"en {resultado['lotes']} lotes ({resultado['segundos']} s)")
+    return resultado
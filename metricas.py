@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas en formato Prometheus (/metrics)
+- Latencia de cada petición por endpoint, método y código de estado (before/after_request)
+- Cantidad y latencia de las sentencias SQL por tipo (database.execute_*), errores,
+  conexiones abiertas y su tiempo de conexión
+- Aciertos y fallos de las cachés (detalle de repuestos, reportes) y entradas en memoria
+- Eventos de negocio: facturas creadas, pagadas y anuladas, pagos, reservas, alertas
+- Con varios procesos (servidor.py) cada proceso escribe sus valores en archivos
+  mapeados en memoria bajo PROMETHEUS_MULTIPROC_DIR y /metrics los suma al leerlos
+- /metrics solo responde a administradores o a peticiones desde la propia máquina
+
+prometheus_client es opcional: sin él las funciones de registro no hacen nada y
+/metrics responde 501.
+"""
+
+from flask import request, g, abort
+import logging
+import os
+import time
+
+# Variable de entorno del modo multiproceso de prometheus_client
+VARIABLE_MULTIPROCESO = 'PROMETHEUS_MULTIPROC_DIR'
+
+# Las métricas sin etiquetas crean su archivo al importarse: el directorio debe existir
+if os.environ.get(VARIABLE_MULTIPROCESO):
+    os.makedirs(os.environ[VARIABLE_MULTIPROCESO], exist_ok=True)
+
+try:
+    from prometheus_client import (
+        Counter, Gauge, Histogram, CollectorRegistry, REGISTRY,
+        generate_latest, CONTENT_TYPE_LATEST, multiprocess
+    )
+except ImportError:  # pragma: no cover - dependencia opcional
+    Counter = None
+
+logger = logging.getLogger(__name__)
+
+TIPOS_SQL = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE'}
+
+_LATENCIAS_SQL = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+if Counter is not None:
+    HTTP_PETICIONES = Histogram(
+        'taller_http_peticion_segundos', 'Duración de las peticiones HTTP',
+        ['endpoint', 'metodo', 'estado']
+    )
+    SQL_SENTENCIAS = Histogram(
+        'taller_sql_sentencia_segundos', 'Duración de las sentencias SQL', ['tipo'],
+        buckets=_LATENCIAS_SQL
+    )
+    SQL_ERRORES = Counter('taller_sql_errores_total', 'Sentencias SQL con error', ['tipo'])
+    BD_CONEXIONES = Counter(
+        'taller_bd_conexiones_total', 'Conexiones a la base de datos', ['resultado']
+    )
+    BD_CONEXION_SEGUNDOS = Histogram(
+        'taller_bd_conexion_segundos', 'Tiempo para abrir una conexión a la base de datos',
+        buckets=_LATENCIAS_SQL
+    )
+    BD_CONEXIONES_ACTIVAS = Gauge(
+        'taller_bd_conexiones_activas', 'Conexiones abiertas en este momento',
+        multiprocess_mode='livesum'
+    )
+    CACHE_CONSULTAS = Counter(
+        'taller_cache_consultas_total', 'Consultas a cachés', ['cache', 'resultado']
+    )
+    CACHE_ENTRADAS = Gauge(
+        'taller_cache_entradas', 'Entradas en las cachés en memoria', ['cache'],
+        multiprocess_mode='livesum'
+    )
+    EVENTOS = Counter('taller_eventos_total', 'Eventos de negocio', ['evento'])
+
+
+def _tipo_sql(sentencia):
+    partes = sentencia.lstrip().split(None, 1)
+    tipo = partes[0].upper() if partes else ''
+    return tipo if tipo in TIPOS_SQL else 'OTRA'
+
+
+def observar_sql(sentencia, segundos, error=False):
+    """Registra una sentencia ejecutada por database.execute_*"""
+    if Counter is None:
+        return
+    tipo = _tipo_sql(sentencia)
+    SQL_SENTENCIAS.labels(tipo).observe(segundos)
+    if error:
+        SQL_ERRORES.labels(tipo).inc()
+
+
+def observar_conexion(segundos, error=False):
+    """Registra la apertura de una conexión (o su fallo)"""
+    if Counter is None:
+        return
+    BD_CONEXIONES.labels('error' if error else 'ok').inc()
+    if not error:
+        BD_CONEXION_SEGUNDOS.observe(segundos)
+        BD_CONEXIONES_ACTIVAS.inc()
+
+
+def conexion_cerrada():
+    if Counter is not None:
+        BD_CONEXIONES_ACTIVAS.dec()
+
+
+def registrar_cache(cache, acierto):
+    """Acierto o fallo de una caché ('detalles', 'reportes')"""
+    if Counter is not None:
+        CACHE_CONSULTAS.labels(cache, 'acierto' if acierto else 'fallo').inc()
+
+
+def entradas_cache(cache, cantidad):
+    """Entradas actuales de una caché en memoria de este proceso"""
+    if Counter is not None:
+        CACHE_ENTRADAS.labels(cache).set(cantidad)
+
+
+def registrar_evento(evento, cantidad=1):
+    """Evento de negocio: factura_creada, factura_pagada, factura_anulada, pago, reserva, alerta"""
+    if Counter is not None and cantidad:
+        EVENTOS.labels(evento).inc(cantidad)
+
+
+# ==================== MODO MULTIPROCESO ====================
+
+def multiproceso():
+    return bool(os.environ.get(VARIABLE_MULTIPROCESO))
+
+
+def proceso_terminado(pid):
+    """Descarta los medidores 'live' de un proceso que terminó (hook child_exit de gunicorn)"""
+    if Counter is not None and multiproceso():
+        multiprocess.mark_process_dead(pid)
+
+
+def _exposicion():
+    if multiproceso():
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+        return generate_latest(registro)
+    return generate_latest(REGISTRY)
+
+
+# ==================== FLASK ====================
+
+def _autorizado(app):
+    if app.config.get('METRICAS_PERMITIR_LOCAL', False) and request.remote_addr in ('127.0.0.1', '::1'):
+        return True
+    from auth import get_current_user
+    user = get_current_user()
+    return bool(user) and user['rol_nombre'] in ('SUPER_USUARIO', 'ADMINISTRADOR')
+
+
+def init_metricas(app):
+    """
+    Registra la medición de peticiones y el endpoint /metrics (Config.METRICAS_*).
+    Debe llamarse antes de los demás before_request para medir la petición completa.
+    """
+    if not app.config.get('METRICAS_HABILITADAS', True):
+        return None
+
+    @app.before_request
+    def iniciar_medicion():
+        g.metricas_inicio = time.perf_counter()
+
+    @app.after_request
+    def registrar_peticion(respuesta):
+        inicio = g.pop('metricas_inicio', None)
+        if inicio is not None and Counter is not None:
+            HTTP_PETICIONES.labels(
+                request.endpoint or 'sin_ruta', request.method, str(respuesta.status_code)
+            ).observe(time.perf_counter() - inicio)
+        return respuesta
+
+    def metricas():
+        if not _autorizado(app):
+            abort(403)
+        if Counter is None:
+            return 'Métricas no disponibles: pip install prometheus-client\n', 501, {
+                'Content-Type': 'text/plain; charset=utf-8'
+            }
+        return _exposicion(), 200, {'Content-Type': CONTENT_TYPE_LATEST, 'Cache-Control': 'no-store'}
+
+    app.add_url_rule('/metrics', 'metricas', metricas)
+    return True
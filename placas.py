@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Búsqueda de vehículos por placa
+- Clave normalizada (mayúsculas, solo letras y números: las mismas reglas que
+  formatearPlaca en static/js/validacion_placas.js) guardada en
+  vehiculos_clientes.placa_normalizada por trigger e indexada
+- Búsqueda exacta (placa completa) o por prefijo sobre la clave: recorre el índice en
+  lugar de evaluar LIKE '%x%' en cada fila
+- Vehículo y cliente en una sola consulta para /api/vehiculos/por-placa
+"""
+
+from database import execute_query
+import re
+
+_NO_ALFANUMERICO = re.compile(r'[^A-Z0-9]')
+
+# Autos: ABC123 / Motos: ABC12D
+_PATRON_PLACA = re.compile(r'^[A-Z]{3}(\d{3}|\d{2}[A-Z])$')
+
+# Caracteres mínimos para buscar por prefijo (igual que el autocompletado)
+MINIMO_PREFIJO = 3
+
+
+def normalizar_placa(placa):
+    """'abc-123 ' -> 'ABC123'"""
+    return _NO_ALFANUMERICO.sub('', (placa or '').upper())
+
+
+def placa_valida(placa):
+    """True si la placa (ya normalizada o no) tiene formato de auto o de moto"""
+    return bool(_PATRON_PLACA.match(normalizar_placa(placa)))
+
+
+def patron_placa(texto):
+    """
+    Parámetro LIKE de prefijo sobre placa_normalizada para un texto de búsqueda.
+
+    Returns:
+        'ABC1%' (usa el índice), o None si el texto no contiene letras ni números
+    """
+    clave = normalizar_placa(texto)
+    # Solo A-Z y 0-9: no hay comodines que escapar
+    return f"{clave}%" if clave else None
+
+
+def buscar_por_placa(texto, limite=10):
+    """
+    Vehículos activos cuya placa coincide con el texto (exacta si es una placa
+    completa, por prefijo si no), con los datos del cliente.
+
+    Returns:
+        Lista de dicts ordenada por placa (vacía si el texto es muy corto)
+    """
+    clave = normalizar_placa(texto)
+    if len(clave) < MINIMO_PREFIJO:
+        return []
+
+    if placa_valida(clave):
+        condicion, parametro = "vc.placa_normalizada = %s", clave
+    else:
+        condicion, parametro = "vc.placa_normalizada LIKE %s", f"{clave}%"
+
+    return execute_query(f"""
+        SELECT vc.id, vc.placa, vc.anio, vc.color, vc.kilometraje_actual,
+               mv.nombre as modelo, ma.nombre as marca,
+               c.id as cliente_id, c.nombre_completo as cliente,
+               c.tipo_documento as cliente_tipo_documento,
+               c.numero_documento as cliente_documento,
+               c.telefono as cliente_telefono
+        FROM vehiculos_clientes vc
+        JOIN clientes c ON vc.cliente_id = c.id
+        JOIN modelos_vehiculos mv ON vc.modelo_vehiculo_id = mv.id
+        JOIN marcas_vehiculos ma ON mv.marca_id = ma.id
+        WHERE {condicion} AND vc.activo = TRUE
+        ORDER BY vc.placa_normalizada
+        LIMIT %s
+    """, (parametro, limite), fetch_all=True)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Pronóstico de demanda y punto de reorden
+- Carga el consumo diario por repuesto (ventas facturadas y salidas confirmadas)
+  en arreglos NumPy y calcula todo el catálogo a la vez
+- Demanda por media móvil o suavizado exponencial, con su desviación diaria
+- Cobertura en días (stock disponible / demanda) y mínimo sugerido
+  (demanda durante el tiempo de entrega + stock de seguridad)
+- Guarda el resultado en pronosticos_repuestos; las alertas PROXIMAMENTE_AGOTADO
+  se generan a partir de esa tabla (alertas.evaluar_alertas_pronostico)
+
+NumPy es opcional: sin él la aplicación funciona y solo este cálculo no está disponible.
+"""
+
+from database import execute_query, execute_many, get_db, transaccion
+from pymysql.cursors import SSCursor
+from datetime import date, timedelta
+import logging
+import time
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dependencia opcional
+    np = None
+
+logger = logging.getLogger(__name__)
+
+METODOS = ('media', 'suavizado')
+
+
+def numpy_disponible():
+    """True si NumPy está instalado"""
+    return np is not None
+
+
+def cargar_consumo_diario(desde, ids):
+    """
+    Consumo diario disperso desde la fecha dada: arreglos (indice_repuesto, dia, cantidad),
+    con indice_repuesto = posición en 'ids' (ids ordenados de repuestos activos).
+    Se lee con un cursor sin buffer en bloques para no materializar tuplas de Python.
+    """
+    cursor = get_db().cursor(SSCursor)
+    bloques = []
+    try:
+        cursor.execute("""
+            SELECT m.repuesto_id, DATEDIFF(m.created_at, %s) as dia, SUM(m.cantidad) as cantidad
+            FROM movimientos_inventario m
+            LEFT JOIN tipos_movimiento t ON m.tipo_movimiento_id = t.id
+            WHERE m.created_at >= %s
+            AND (m.estado = 'FACTURADO' OR (m.estado = 'CONFIRMADO' AND t.tipo = 'SALIDA'))
+            GROUP BY m.repuesto_id, dia
+        """, (desde, desde))
+        while True:
+            filas = cursor.fetchmany(50000)
+            if not filas:
+                break
+            bloques.append(np.array(filas, dtype=np.float64))
+    finally:
+        cursor.close()
+
+    if not bloques:
+        vacio = np.zeros(0)
+        return vacio.astype(np.int64), vacio.astype(np.int64), vacio
+
+    datos = np.concatenate(bloques)
+    repuesto_ids = datos[:, 0].astype(np.int64)
+    posicion = np.searchsorted(ids, repuesto_ids)
+    posicion = np.minimum(posicion, len(ids) - 1)
+    # Solo repuestos activos (los ids están ordenados)
+    validos = ids[posicion] == repuesto_ids
+    return posicion[validos], datos[validos, 1].astype(np.int64), datos[validos, 2]
+
+
+def _media_movil(indice, dia, cantidad, n, dias, ventana):
+    """Media y varianza diaria de los últimos 'ventana' días (los días sin consumo cuentan como 0)"""
+    ventana = min(ventana, dias)
+    recientes = dia >= dias - ventana
+    suma = np.bincount(indice[recientes], weights=cantidad[recientes], minlength=n)
+    suma_cuadrados = np.bincount(indice[recientes], weights=cantidad[recientes] ** 2, minlength=n)
+    media = suma / ventana
+    return media, np.maximum(suma_cuadrados / ventana - media ** 2, 0)
+
+
+def _suavizado(indice, dia, cantidad, n, dias, alfa):
+    """Suavizado exponencial simple de todo el catálogo, un paso vectorial por día"""
+    orden = np.argsort(dia, kind='stable')
+    indice, dia, cantidad = indice[orden], dia[orden], cantidad[orden]
+    limites = np.searchsorted(dia, np.arange(dias + 1))
+
+    # Nivel inicial: consumo medio del período
+    nivel = np.bincount(indice, weights=cantidad, minlength=n) / dias
+    varianza = np.zeros(n)
+    x = np.zeros(n)
+    for d in range(dias):
+        a, b = limites[d], limites[d + 1]
+        x[indice[a:b]] = cantidad[a:b]
+        error = x - nivel
+        nivel += alfa * error
+        varianza = (1 - alfa) * (varianza + alfa * error ** 2)
+        x[indice[a:b]] = 0
+    return nivel, varianza
+
+
+def calcular_pronosticos(metodo='suavizado', historia_dias=730, ventana=90, alfa=0.1,
+                         dias_entrega=7, factor_seguridad=1.65):
+    """
+    Calcula demanda, cobertura y mínimo sugerido para todos los repuestos activos
+    y los guarda en pronosticos_repuestos.
+
+    Args:
+        metodo: 'media' (media móvil de 'ventana' días) o 'suavizado' (exponencial con 'alfa')
+        historia_dias: Días de historia de consumo a cargar
+        dias_entrega: Tiempo de reposición en días
+        factor_seguridad: Factor z del stock de seguridad (1.65 = 95 % de nivel de servicio)
+
+    Returns:
+        Dict con 'repuestos', 'con_demanda', 'en_riesgo', 'eventos' y 'segundos'
+    """
+    if np is None:
+        raise RuntimeError('El pronóstico de demanda requiere NumPy (pip install numpy)')
+    if metodo not in METODOS:
+        raise ValueError(f'Método de pronóstico no válido: {metodo}')
+
+    inicio = time.monotonic()
+    get_db().commit()
+
+    repuestos = execute_query("""
+        SELECT id, cantidad_actual, cantidad_reservada
+        FROM repuestos WHERE activo = TRUE ORDER BY id
+    """, fetch_all=True)
+    resultado = {'repuestos': len(repuestos), 'con_demanda': 0, 'en_riesgo': 0, 'eventos': 0}
+    if not repuestos:
+        resultado['segundos'] = round(time.monotonic() - inicio, 2)
+        return resultado
+
+    ids = np.fromiter((r['id'] for r in repuestos), dtype=np.int64, count=len(repuestos))
+    actual = np.fromiter((r['cantidad_actual'] for r in repuestos), dtype=np.float64, count=len(repuestos))
+    reservada = np.fromiter((r['cantidad_reservada'] for r in repuestos), dtype=np.float64, count=len(repuestos))
+    n = len(ids)
+
+    # Días completos de historia (hoy no se incluye: está incompleto)
+    hoy = date.today()
+    desde = hoy - timedelta(days=historia_dias)
+    indice, dia, cantidad = cargar_consumo_diario(desde, ids)
+    completos = dia < historia_dias
+    indice, dia, cantidad = indice[completos], dia[completos], cantidad[completos]
+    resultado['eventos'] = int(len(cantidad))
+
+    if metodo == 'media':
+        demanda, varianza = _media_movil(indice, dia, cantidad, n, historia_dias, ventana)
+    else:
+        demanda, varianza = _suavizado(indice, dia, cantidad, n, historia_dias, alfa)
+    desviacion = np.sqrt(varianza)
+
+    disponible = np.maximum(actual - reservada, 0)
+    con_demanda = demanda > 1e-9
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dias_para_agotar = np.where(con_demanda, disponible / demanda, np.inf)
+    minimo_sugerido = np.ceil(demanda * dias_entrega + factor_seguridad * desviacion * np.sqrt(dias_entrega))
+    # El stock disponible no cubre la demanda hasta que llegue una reposición
+    en_riesgo = con_demanda & (dias_para_agotar <= dias_entrega)
+
+    resultado['con_demanda'] = int(con_demanda.sum())
+    resultado['en_riesgo'] = int(en_riesgo.sum())
+
+    filas = [
+        (int(ids[i]), round(float(demanda[i]), 4), round(float(desviacion[i]), 4),
+         None if not np.isfinite(dias_para_agotar[i]) else round(float(dias_para_agotar[i]), 1),
+         int(minimo_sugerido[i]), bool(en_riesgo[i]), metodo)
+        for i in range(n)
+    ]
+    with transaccion():
+        for i in range(0, n, 5000):
+            execute_many("""
+                INSERT INTO pronosticos_repuestos
+                (repuesto_id, demanda_diaria, desviacion_diaria, dias_para_agotar,
+                 minimo_sugerido, en_riesgo, metodo, calculado_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+                ON DUPLICATE KEY UPDATE
+                    demanda_diaria = VALUES(demanda_diaria), desviacion_diaria = VALUES(desviacion_diaria),
+                    dias_para_agotar = VALUES(dias_para_agotar), minimo_sugerido = VALUES(minimo_sugerido),
+                    en_riesgo = VALUES(en_riesgo), metodo = VALUES(metodo), calculado_at = NOW()
+            """, filas[i:i + 5000], commit=False)
+        # Repuestos desactivados desde el cálculo anterior
+        execute_query("""
+            DELETE p FROM pronosticos_repuestos p
+            JOIN repuestos r ON p.repuesto_id = r.id
+            WHERE r.activo = FALSE
+        """)
+
+    resultado['segundos'] = round(time.monotonic() - inicio, 2)
+    logger.info(
+        f"Pronóstico ({metodo}): {resultado['repuestos']} repuestos, {resultado['eventos']} días-repuesto "
+        f"con consumo, {resultado['en_riesgo']} en riesgo ({resultado['segundos']} s)"
+    )
+    return resultado
+
+
+def pronostico_repuesto(repuesto_id):
+    """Último pronóstico calculado para un repuesto (None si no hay)"""
+    return execute_query(
+        "SELECT * FROM pronosticos_repuestos WHERE repuesto_id = %s",
+        (repuesto_id,), fetch_one=True
+    )
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de reservas de stock
+- Reservar, liberar y consumir stock con un único UPDATE condicional por línea
+- La verificación de disponibilidad se hace en la misma sentencia (sin carreras)
+- El éxito se informa por el número de filas afectadas
+- Con commit=False la operación queda en la transacción en curso
+- Reserva por lotes para solicitudes con varias líneas (número constante de consultas)
+"""
+
+from database import execute_query, execute_update
+from metricas import registrar_evento
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StockInsuficiente(Exception):
+    """No hay stock disponible para una o más líneas de una reserva por lote"""
+
+    def __init__(self, faltantes):
+        self.faltantes = faltantes
+        super().__init__(f"Stock insuficiente para {len(faltantes)} repuesto(s)")
+
+
+class ReservaInsuficiente(Exception):
+    """La reserva del repuesto es menor que la cantidad a liberar (stock descuadrado)"""
+
+
+def reservar_stock(repuesto_id, cantidad, usuario_id=None, commit=True):
+    """
+    Reserva stock si hay disponible suficiente (actual - reservado).
+
+    Returns:
+        True si la reserva se aplicó, False si no hay stock disponible
+    """
+    if cantidad <= 0:
+        return True
+
+    filas = execute_update("""
+        UPDATE repuestos
+        SET cantidad_reservada = cantidad_reservada + %s,
+            updated_by = COALESCE(%s, updated_by)
+        WHERE id = %s AND cantidad_actual - cantidad_reservada >= %s
+    """, (cantidad, usuario_id, repuesto_id, cantidad), commit=commit)
+    if filas != 1:
+        return False
+    registrar_evento('reserva')
+    return True
+
+
+def liberar_reserva(repuesto_id, cantidad, usuario_id=None, commit=True):
+    """
+    Libera stock reservado. Nunca deja cantidad_reservada negativa.
+
+    Returns:
+        True si se liberó la cantidad completa, False si la reserva era menor
+    """
+    if cantidad <= 0:
+        return True
+
+    filas = execute_update("""
+        UPDATE repuestos
+        SET cantidad_reservada = cantidad_reservada - %s,
+            updated_by = COALESCE(%s, updated_by)
+        WHERE id = %s AND cantidad_reservada >= %s
+    """, (cantidad, usuario_id, repuesto_id, cantidad), commit=commit)
+
+    if filas != 1:
+        logger.warning(f"Reserva insuficiente al liberar {cantidad} unidades del repuesto {repuesto_id}")
+        return False
+    return True
+
+
+def consumir_stock(repuesto_id, cantidad, usuario_id=None, reservado=False, commit=True):
+    """
+    Descuenta stock físico al facturar.
+    - reservado=True (línea de una solicitud): consume la reserva de esa línea; exige
+      que la reserva y el stock físico alcancen
+    - reservado=False (venta directa, sin reserva previa): exige disponible (actual -
+      reservado) y no toca las reservas de otros documentos
+
+    Returns:
+        True si se descontó, False si el stock no alcanza (no se modifica nada)
+    """
+    if cantidad <= 0:
+        return True
+
+    if reservado:
+        filas = execute_update("""
+            UPDATE repuestos
+            SET cantidad_actual = cantidad_actual - %s,
+                cantidad_reservada = cantidad_reservada - %s,
+                updated_by = COALESCE(%s, updated_by)
+            WHERE id = %s AND cantidad_reservada >= %s AND cantidad_actual >= %s
+        """, (cantidad, cantidad, usuario_id, repuesto_id, cantidad, cantidad), commit=commit)
+    else:
+        filas = execute_update("""
+            UPDATE repuestos
+            SET cantidad_actual = cantidad_actual - %s,
+                updated_by = COALESCE(%s, updated_by)
+            WHERE id = %s AND cantidad_actual - cantidad_reservada >= %s
+        """, (cantidad, usuario_id, repuesto_id, cantidad), commit=commit)
+
+    if filas != 1:
+        logger.warning(f"Stock insuficiente al consumir {cantidad} unidades del repuesto {repuesto_id} "
+                       f"({'reservado' if reservado else 'venta directa'})")
+        return False
+    return True
+
+
+def reservar_lote(lineas, usuario_id=None):
+    """
+    Reserva varias líneas en la transacción en curso (usar dentro de transaccion()).
+    Bloquea todas las filas con un SELECT ... FOR UPDATE, verifica la
+    disponibilidad de todas y aplica las reservas con un solo UPDATE.
+
+    Args:
+        lineas: Lista de tuplas (repuesto_id, cantidad); un repuesto puede repetirse
+        usuario_id: Usuario que realiza la reserva
+
+    Returns:
+        Dict repuesto_id -> fila del repuesto (id, codigo, nombre, precio_venta, disponible)
+
+    Raises:
+        StockInsuficiente: Si alguna línea no tiene stock; no se reserva nada
+    """
+    cantidades = {}
+    for repuesto_id, cantidad in lineas:
+        if cantidad <= 0:
+            raise ValueError(f"Cantidad inválida para el repuesto {repuesto_id}: {cantidad}")
+        repuesto_id = int(repuesto_id)
+        cantidades[repuesto_id] = cantidades.get(repuesto_id, 0) + cantidad
+
+    if not cantidades:
+        return {}
+
+    ids = list(cantidades)
+    placeholders = ', '.join(['%s'] * len(ids))
+
+    repuestos = execute_query(f"""
+        SELECT id, codigo, nombre, precio_venta,
+               (cantidad_actual - cantidad_reservada) as disponible
+        FROM repuestos
+        WHERE id IN ({placeholders}) AND activo = TRUE
+        FOR UPDATE
+    """, tuple(ids), fetch_all=True)
+    por_id = {r['id']: r for r in repuestos}
+
+    faltantes = []
+    for repuesto_id, cantidad in cantidades.items():
+        repuesto = por_id.get(repuesto_id)
+        disponible = repuesto['disponible'] if repuesto else 0
+        if cantidad > disponible:
+            faltantes.append({
+                'repuesto_id': repuesto_id,
+                'nombre': repuesto['nombre'] if repuesto else None,
+                'solicitado': cantidad,
+                'disponible': disponible
+            })
+
+    if faltantes:
+        raise StockInsuficiente(faltantes)
+
+    casos = ' '.join(['WHEN %s THEN %s'] * len(ids))
+    params = [valor for repuesto_id in ids for valor in (repuesto_id, cantidades[repuesto_id])]
+    params.append(usuario_id)
+    params.extend(ids)
+
+    execute_update(f"""
+        UPDATE repuestos
+        SET cantidad_reservada = cantidad_reservada + CASE id {casos} END,
+            updated_by = COALESCE(%s, updated_by)
+        WHERE id IN ({placeholders})
+    """, tuple(params))
+    registrar_evento('reserva', len(ids))
+
+    return por_id
+
+
+def stock_disponible(repuesto_id):
+    """Stock disponible actual de un repuesto (para mensajes al usuario)"""
+    repuesto = execute_query(
+        "SELECT cantidad_actual - cantidad_reservada as disponible FROM repuestos WHERE id = %s",
+        (repuesto_id,), fetch_one=True
+    )
+    return repuesto['disponible'] if repuesto else 0
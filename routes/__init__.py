@@ -11,6 +11,10 @@ reportes_bp = Blueprint('reportes', __name__, url_prefix='/reportes')
 categorias_bp = Blueprint('categorias', __name__, url_prefix='/categorias')
 mensajes_bp = Blueprint('mensajes', __name__, url_prefix='/mensajes')
 audit_bp = Blueprint('audit', __name__, url_prefix='/audit')
+catalogo_bp = Blueprint('catalogo', __name__, url_prefix='/api/catalogo')
+importacion_bp = Blueprint('importacion', __name__, url_prefix='/importacion')
+conteos_bp = Blueprint('conteos', __name__, url_prefix='/conteos')
+kardex_bp = Blueprint('kardex', __name__, url_prefix='/kardex')
 
 def register_blueprints(app):
     """Registra todos los blueprints en la aplicación"""
@@ -21,6 +25,10 @@ def register_blueprints(app):
     from . import categorias
     from . import mensajes
     from . import audit
+    from . import catalogo
+    from . import importacion
+    from . import conteos
+    from . import kardex
     
     app.register_blueprint(solicitudes_bp)
     app.register_blueprint(facturacion_bp)
@@ -29,3 +37,7 @@ def register_blueprints(app):
     app.register_blueprint(categorias_bp)
     app.register_blueprint(mensajes_bp)
     app.register_blueprint(audit_bp)
+    app.register_blueprint(catalogo_bp)
+    app.register_blueprint(importacion_bp)
+    app.register_blueprint(conteos_bp)
+    app.register_blueprint(kardex_bp)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Catálogo para formularios
+- Instantánea de repuestos y clientes en formato columnar y comprimida
+- Versionada con el contador de catalogo_versiones (ETag)
+- Con ?desde=<version> solo envía las filas que cambiaron desde esa versión
+- Los formularios la cargan en segundo plano en lugar de incluir todo en el HTML
+"""
+
+from flask import request, jsonify, make_response, abort
+from decimal import Decimal
+from database import execute_query
+from auth import login_required
+from . import catalogo_bp
+import gzip
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Catálogos disponibles: tabla, columnas enviadas y orden
+CATALOGOS = {
+    'repuestos': {
+        'tabla': 'repuestos',
+        # Sin cantidades: el stock cambia con cada movimiento y se consulta al elegir el
+        # repuesto (/api/repuestos/<id>/disponibilidad)
+        'columnas': ('id', 'codigo', 'nombre', 'categoria_id', 'precio_venta', 'activo'),
+        'orden': 'nombre'
+    },
+    'clientes': {
+        'tabla': 'clientes',
+        'columnas': ('id', 'numero_documento', 'nombre_completo', 'activo'),
+        'orden': 'nombre_completo'
+    }
+}
+
+
+def version_catalogo(nombre):
+    """Versión actual de un catálogo"""
+    fila = execute_query(
+        "SELECT version FROM catalogo_versiones WHERE catalogo = %s",
+        (nombre,), fetch_one=True
+    )
+    return fila['version'] if fila else 0
+
+
+def _valor_json(valor):
+    """Convierte valores de MySQL a tipos JSON compactos"""
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return valor
+
+
+@catalogo_bp.route('/<nombre>')
+@login_required
+def instantanea(nombre):
+    """
+    Instantánea columnar de un catálogo:
+    {"version": N, "desde": D, "completo": bool, "orden": col, "columnas": [...], "datos": {col: [valores]}}
+    Completa: solo filas activas. Diferencial (desde > 0): filas cambiadas, incluidas las desactivadas.
+    """
+    definicion = CATALOGOS.get(nombre)
+    if not definicion:
+        abort(404)
+
+    desde = request.args.get('desde', 0, type=int)
+    version = version_catalogo(nombre)
+
+    # Diferencia desde una versión futura o desconocida: enviar completo
+    if desde > version:
+        desde = 0
+
+    etag = f'{nombre}-{desde}-{version}' if desde else f'{nombre}-{version}'
+    if request.if_none_match.contains(etag):
+        respuesta = make_response('', 304)
+        respuesta.set_etag(etag)
+        return respuesta
+
+    columnas = definicion['columnas']
+    if desde:
+        filas = execute_query(f"""
+            SELECT {', '.join(columnas)} FROM {definicion['tabla']}
+            WHERE version_catalogo > %s
+            ORDER BY {definicion['orden']}
+        """, (desde,), fetch_all=True)
+    else:
+        filas = execute_query(f"""
+            SELECT {', '.join(columnas)} FROM {definicion['tabla']}
+            WHERE activo = TRUE
+            ORDER BY {definicion['orden']}
+        """, fetch_all=True)
+
+    contenido = json.dumps({
+        'version': version,
+        'desde': desde,
+        'completo': not desde,
+        'orden': definicion['orden'],
+        'columnas': list(columnas),
+        'datos': {col: [_valor_json(f[col]) for f in filas] for col in columnas}
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    respuesta = make_response(contenido)
+    respuesta.mimetype = 'application/json'
+    if 'gzip' in request.accept_encodings:
+        respuesta.set_data(gzip.compress(contenido, compresslevel=6))
+        respuesta.headers['Content-Encoding'] = 'gzip'
+    respuesta.headers['Vary'] = 'Accept-Encoding'
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    respuesta.set_etag(etag)
+    return respuesta
+
+
+@catalogo_bp.route('/versiones')
+@login_required
+def versiones():
+    """Versión actual de cada catálogo (para saber si hay cambios sin descargar)"""
+    filas = execute_query("SELECT catalogo, version FROM catalogo_versiones", fetch_all=True)
+    return jsonify({f['catalogo']: f['version'] for f in filas})
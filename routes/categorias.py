@@ -7,9 +7,10 @@ Modulo de Categorias de Repuestos
 - API JSON para dropdowns en formularios
 """
 
-from flask import render_template, request, redirect, url_for, flash, jsonify, current_app
+from flask import render_template, request, redirect, url_for, flash, current_app
 from datetime import datetime
 from database import execute_query
+from condicional import versiones_catalogo, validadores, no_modificado, json_con_validadores
 from auth import (
     login_required, role_required, get_current_user, registrar_audit_log
 )
@@ -31,9 +32,7 @@ def lista():
     categorias = execute_query("""
         SELECT c.*,
                u_created.nombre_completo as creado_por_nombre,
-               u_updated.nombre_completo as actualizado_por_nombre,
-               (SELECT COUNT(*) FROM repuestos r
-                WHERE r.categoria_id = c.id AND r.activo = TRUE) as total_repuestos
+               u_updated.nombre_completo as actualizado_por_nombre
         FROM categorias_repuestos c
         LEFT JOIN usuarios u_created ON c.created_by = u_created.id
         LEFT JOIN usuarios u_updated ON c.updated_by = u_updated.id
@@ -264,9 +263,15 @@ def eliminar(id):
 @login_required
 def api_lista():
     """Retorna lista de categorias activas en formato JSON para dropdowns"""
+    version = versiones_catalogo('categorias')['categorias']
+    etag, modificado = validadores('cat', version['version'], fechas=[version['updated_at']])
+    respuesta = no_modificado(etag, modificado)
+    if respuesta:
+        return respuesta
+
     categorias = execute_query(
         "SELECT id, nombre, descripcion FROM categorias_repuestos WHERE activo = TRUE ORDER BY nombre ASC",
         fetch_all=True
     )
 
-    return jsonify([dict(c) for c in categorias])
+    return json_con_validadores([dict(c) for c in categorias], etag, modificado)
@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Conteos Físicos (inventario cíclico)
+- Sesiones de conteo por categoría y/o ubicación (estante)
+- Las cantidades contadas se registran en pantalla o se cargan/escanean por código
+- Al cerrar, las diferencias contra cantidad_actual se calculan con un solo JOIN
+  y se crean todos los ajustes PENDIENTE de una vez
+- El aprobador acepta o rechaza el lote completo en una sola transacción
+"""
+
+from flask import render_template, request, redirect, url_for, flash
+from database import execute_query, execute_update, execute_many, transaccion
+from alertas import verificar_alertas_stock
+from auth import (
+    login_required, role_required, get_current_user,
+    can_approve_adjustments, registrar_audit_log
+)
+from . import conteos_bp
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== RUTAS DE CONTEOS ====================
+
+@conteos_bp.route('/')
+@login_required
+@role_required('ADMINISTRADOR', 'ALMACENISTA')
+def lista():
+    """Sesiones de conteo con su avance"""
+    estado = request.args.get('estado', '')
+
+    where = "WHERE s.estado = %s" if estado else ""
+    params = (estado,) if estado else ()
+
+    sesiones = execute_query(f"""
+        SELECT s.*, c.nombre as categoria_nombre,
+               u.nombre_completo as creado_por_nombre,
+               (SELECT COUNT(*) FROM conteos_items ci WHERE ci.sesion_id = s.id) as total_items,
+               (SELECT COUNT(*) FROM conteos_items ci
+                WHERE ci.sesion_id = s.id AND ci.cantidad_contada IS NOT NULL) as items_contados
+        FROM conteos_sesiones s
+        LEFT JOIN categorias_repuestos c ON s.categoria_id = c.id
+        JOIN usuarios u ON s.creado_por = u.id
+        {where}
+        ORDER BY s.created_at DESC
+        LIMIT 100
+    """, params, fetch_all=True)
+
+    categorias = execute_query(
+        "SELECT id, nombre FROM categorias_repuestos WHERE activo = TRUE ORDER BY nombre",
+        fetch_all=True
+    )
+
+    return render_template('conteos/lista.html',
+                         sesiones=sesiones,
+                         categorias=categorias,
+                         estado_filtro=estado)
+
+
+@conteos_bp.route('/nueva', methods=['POST'])
+@login_required
+@role_required('ADMINISTRADOR', 'ALMACENISTA')
+def nueva():
+    """Abre una sesión de conteo con los repuestos de la categoría/ubicación"""
+    user = get_current_user()
+    categoria_id = request.form.get('categoria_id') or None
+    ubicacion = request.form.get('ubicacion', '').strip() or None
+    descripcion = request.form.get('descripcion', '').strip()
+
+    if not categoria_id and not ubicacion:
+        flash('Seleccione una categoría o indique una ubicación', 'warning')
+        return redirect(url_for('conteos.lista'))
+
+    try:
+        condiciones = ["r.activo = TRUE"]
+        params = []
+        if categoria_id:
+            condiciones.append("r.categoria_id = %s")
+            params.append(categoria_id)
+        if ubicacion:
+            condiciones.append("r.ubicacion_fisica LIKE %s")
+            params.append(f'{ubicacion}%')
+
+        with transaccion():
+            sesion_id = execute_query("""
+                INSERT INTO conteos_sesiones (descripcion, categoria_id, ubicacion, creado_por)
+                VALUES (%s, %s, %s, %s)
+            """, (descripcion, categoria_id, ubicacion, user['id']))
+
+            total = execute_update(f"""
+                INSERT INTO conteos_items (sesion_id, repuesto_id, cantidad_sistema)
+                SELECT %s, r.id, r.cantidad_actual
+                FROM repuestos r
+                WHERE {' AND '.join(condiciones)}
+            """, (sesion_id, *params))
+
+            if not total:
+                raise ValueError('Sin repuestos')
+
+        registrar_audit_log(
+            usuario_id=user['id'], tabla='conteos_sesiones', registro_id=sesion_id,
+            accion='CREAR', tipo_cambio='INVENTARIO',
+            datos_nuevos={'categoria_id': categoria_id, 'ubicacion': ubicacion, 'total_items': total}
+        )
+
+        flash(f'Sesión de conteo #{sesion_id} abierta con {total} repuestos', 'success')
+        return redirect(url_for('conteos.ver', id=sesion_id))
+
+    except ValueError:
+        flash('No hay repuestos activos para la categoría/ubicación indicada', 'warning')
+    except Exception as e:
+        logger.error(f"Error abriendo sesión de conteo: {e}")
+        flash('Error al abrir la sesión de conteo', 'danger')
+
+    return redirect(url_for('conteos.lista'))
+
+
+@conteos_bp.route('/<int:id>')
+@login_required
+@role_required('ADMINISTRADOR', 'ALMACENISTA')
+def ver(id):
+    """Detalle de la sesión: cantidades contadas y diferencias"""
+    sesion = _obtener_sesion(id)
+    if not sesion:
+        flash('Sesión de conteo no encontrada', 'danger')
+        return redirect(url_for('conteos.lista'))
+
+    # Mientras está abierta, la diferencia es contra el stock actual;
+    # después se muestra el ajuste registrado al cerrar
+    items = execute_query("""
+        SELECT ci.*, r.codigo, r.nombre, r.ubicacion_fisica, r.cantidad_actual,
+               (ci.cantidad_contada - r.cantidad_actual) as diferencia_actual,
+               h.cantidad_anterior, h.diferencia, h.estado as estado_ajuste
+        FROM conteos_items ci
+        JOIN repuestos r ON ci.repuesto_id = r.id
+        LEFT JOIN historial_ajustes_inventario h ON h.id = ci.ajuste_id
+        WHERE ci.sesion_id = %s
+        ORDER BY r.ubicacion_fisica, r.codigo
+    """, (id,), fetch_all=True)
+
+    return render_template('conteos/ver.html',
+                         sesion=sesion,
+                         items=items,
+                         puede_aprobar=can_approve_adjustments())
+
+
+@conteos_bp.route('/<int:id>/registrar', methods=['POST'])
+@login_required
+@role_required('ADMINISTRADOR', 'ALMACENISTA')
+def registrar(id):
+    """
+    Registra cantidades contadas:
+    - Campos cantidad_<repuesto_id> del formulario de la sesión
+    - Texto/archivo con líneas 'codigo' o 'codigo,cantidad' (lector de código de barras):
+      un código repetido suma sus cantidades
+    """
+    user = get_current_user()
+    sesion = _obtener_sesion(id)
+    if not sesion or sesion['estado'] != 'ABIERTA':
+        flash('La sesión no está abierta', 'warning')
+        return redirect(url_for('conteos.ver', id=id))
+
+    try:
+        # Cantidades por ID desde la tabla del formulario
+        por_id = []
+        for campo, valor in request.form.items():
+            if campo.startswith('cantidad_') and valor.strip() != '':
+                cantidad = int(valor)
+                if cantidad < 0:
+                    raise ValueError(valor)
+                por_id.append((cantidad, user['id'], id, int(campo[len('cantidad_'):])))
+
+        # Cantidades por código desde el texto escaneado o el archivo
+        texto = request.form.get('lecturas', '')
+        archivo = request.files.get('archivo')
+        if archivo and archivo.filename:
+            texto += '\n' + archivo.read().decode('utf-8-sig', errors='replace')
+
+        por_codigo = {}
+        for linea in texto.splitlines():
+            partes = [p.strip() for p in linea.replace(';', ',').split(',')]
+            if not partes[0] or partes[0].lower() == 'codigo':
+                continue
+            cantidad = int(partes[1]) if len(partes) > 1 and partes[1] else 1
+            por_codigo[partes[0]] = por_codigo.get(partes[0], 0) + cantidad
+
+        sin_coincidencia = []
+        with transaccion():
+            if por_id:
+                execute_many("""
+                    UPDATE conteos_items
+                    SET cantidad_contada = %s, contado_por = %s, contado_at = NOW()
+                    WHERE sesion_id = %s AND repuesto_id = %s
+                """, por_id, commit=False)
+
+            if por_codigo:
+                codigos = list(por_codigo)
+                placeholders = ', '.join(['%s'] * len(codigos))
+                encontrados = execute_query(f"""
+                    SELECT r.codigo, r.id FROM conteos_items ci
+                    JOIN repuestos r ON ci.repuesto_id = r.id
+                    WHERE ci.sesion_id = %s AND r.codigo IN ({placeholders})
+                """, (id, *codigos), fetch_all=True)
+                ids = {f['codigo']: f['id'] for f in encontrados}
+                sin_coincidencia = [c for c in codigos if c not in ids]
+
+                # Las lecturas escaneadas se suman a lo ya contado
+                if ids:
+                    execute_many("""
+                        UPDATE conteos_items
+                        SET cantidad_contada = GREATEST(COALESCE(cantidad_contada, 0) + %s, 0),
+                            contado_por = %s, contado_at = NOW()
+                        WHERE sesion_id = %s AND repuesto_id = %s
+                    """, [(por_codigo[c], user['id'], id, ids[c]) for c in ids], commit=False)
+
+        flash(f'Conteo registrado: {len(por_id) + len(por_codigo) - len(sin_coincidencia)} repuestos', 'success')
+        if sin_coincidencia:
+            flash(f'Códigos fuera de esta sesión: {", ".join(sin_coincidencia[:20])}', 'warning')
+
+    except ValueError:
+        flash('Las cantidades contadas deben ser números enteros no negativos', 'danger')
+    except Exception as e:
+        logger.error(f"Error registrando conteo: {e}")
+        flash('Error al registrar el conteo', 'danger')
+
+    return redirect(url_for('conteos.ver', id=id))
+
+
+@conteos_bp.route('/<int:id>/cerrar', methods=['POST'])
+@login_required
+@role_required('ADMINISTRADOR', 'ALMACENISTA')
+def cerrar(id):
+    """Calcula las diferencias y crea todos los ajustes PENDIENTE de la sesión"""
+    user = get_current_user()
+    sesion = _obtener_sesion(id)
+    if not sesion or sesion['estado'] != 'ABIERTA':
+        flash('La sesión no está abierta', 'warning')
+        return redirect(url_for('conteos.ver', id=id))
+
+    try:
+        with transaccion():
+            # Diferencias contra cantidad_actual con un solo JOIN
+            total_ajustes = execute_update("""
+                INSERT INTO historial_ajustes_inventario
+                (repuesto_id, cantidad_anterior, cantidad_nueva, diferencia, usuario_id, motivo,
+                 estado, sesion_conteo_id)
+                SELECT ci.repuesto_id, r.cantidad_actual, ci.cantidad_contada,
+                       ci.cantidad_contada - r.cantidad_actual, %s, %s, 'PENDIENTE', ci.sesion_id
+                FROM conteos_items ci
+                JOIN repuestos r ON ci.repuesto_id = r.id
+                WHERE ci.sesion_id = %s
+                AND ci.cantidad_contada IS NOT NULL
+                AND ci.cantidad_contada <> r.cantidad_actual
+            """, (user['id'], f'Conteo físico #{id}', id))
+
+            # Vincular cada item con su ajuste
+            execute_query("""
+                UPDATE conteos_items ci
+                JOIN historial_ajustes_inventario h
+                  ON h.sesion_conteo_id = ci.sesion_id AND h.repuesto_id = ci.repuesto_id
+                SET ci.ajuste_id = h.id
+                WHERE ci.sesion_id = %s
+            """, (id,))
+
+            nuevo_estado = 'EN_REVISION' if total_ajustes else 'APROBADA'
+            execute_query("""
+                UPDATE conteos_sesiones
+                SET estado = %s, cerrado_por = %s, fecha_cierre = NOW(), total_ajustes = %s
+                WHERE id = %s AND estado = 'ABIERTA'
+            """, (nuevo_estado, user['id'], total_ajustes, id))
+
+            if total_ajustes:
+                _notificar_revision(id, total_ajustes)
+
+        registrar_audit_log(
+            usuario_id=user['id'], tabla='conteos_sesiones', registro_id=id,
+            accion='ACTUALIZAR', tipo_cambio='INVENTARIO',
+            datos_anteriores={'estado': 'ABIERTA'},
+            datos_nuevos={'estado': nuevo_estado, 'total_ajustes': total_ajustes}
+        )
+
+        if total_ajustes:
+            flash(f'Conteo cerrado: {total_ajustes} diferencias enviadas para aprobación', 'info')
+        else:
+            flash('Conteo cerrado sin diferencias', 'success')
+
+    except Exception as e:
+        logger.error(f"Error cerrando sesión de conteo: {e}")
+        flash('Error al cerrar la sesión de conteo', 'danger')
+
+    return redirect(url_for('conteos.ver', id=id))
+
+
+@conteos_bp.route('/<int:id>/aprobar', methods=['POST'])
+@login_required
+@role_required('ADMINISTRADOR')
+def aprobar(id):
+    """
+    Aprueba todos los ajustes de la sesión en una transacción.
+    Se aplica la diferencia contada, de modo que los movimientos registrados
+    entre el cierre y la aprobación se conservan. Si con esos movimientos alguna
+    diferencia dejaría el stock por debajo de lo reservado (o negativo), no se
+    aprueba nada y se informan los repuestos afectados.
+    """
+    user = get_current_user()
+    sesion = _obtener_sesion(id)
+    if not sesion or sesion['estado'] != 'EN_REVISION':
+        flash('La sesión no está pendiente de aprobación', 'warning')
+        return redirect(url_for('conteos.ver', id=id))
+
+    try:
+        conflictos = []
+        with transaccion():
+            # Bloquea los repuestos ajustados: nadie mueve su stock hasta el commit
+            repuestos = execute_query("""
+                SELECT h.repuesto_id, h.diferencia, r.codigo, r.nombre,
+                       r.cantidad_actual, r.cantidad_reservada
+                FROM historial_ajustes_inventario h
+                JOIN repuestos r ON h.repuesto_id = r.id
+                WHERE h.sesion_conteo_id = %s AND h.estado = 'PENDIENTE'
+                FOR UPDATE
+            """, (id,), fetch_all=True)
+
+            conflictos = [
+                r for r in repuestos
+                if r['cantidad_actual'] + r['diferencia'] < r['cantidad_reservada']
+            ]
+
+            if not conflictos:
+                # Exactamente la diferencia que queda APROBADA
+                execute_query("""
+                    UPDATE repuestos r
+                    JOIN historial_ajustes_inventario h ON h.repuesto_id = r.id
+                    SET r.cantidad_actual = r.cantidad_actual + h.diferencia,
+                        r.updated_by = %s
+                    WHERE h.sesion_conteo_id = %s AND h.estado = 'PENDIENTE'
+                """, (user['id'], id))
+
+                aprobados = execute_update("""
+                    UPDATE historial_ajustes_inventario
+                    SET estado = 'APROBADO', aprobado_por = %s, fecha_aprobacion = NOW()
+                    WHERE sesion_conteo_id = %s AND estado = 'PENDIENTE'
+                """, (user['id'], id))
+
+                _finalizar_sesion(id, 'APROBADA', user['id'])
+
+        if conflictos:
+            detalle = ', '.join(
+                f"{r['codigo']} (stock {r['cantidad_actual']}, diferencia {r['diferencia']:+d}, "
+                f"reservado {r['cantidad_reservada']})"
+                for r in conflictos[:10]
+            )
+            if len(conflictos) > 10:
+                detalle += f' y {len(conflictos) - 10} más'
+            flash(f'No se aprobó el conteo: con los movimientos posteriores al cierre, '
+                  f'{len(conflictos)} ajuste(s) dejarían el stock por debajo de lo reservado: '
+                  f'{detalle}. Libere las reservas o rechace el conteo y vuelva a contar.', 'warning')
+            return redirect(url_for('conteos.ver', id=id))
+
+        verificar_alertas_stock([r['repuesto_id'] for r in repuestos])
+
+        registrar_audit_log(
+            usuario_id=user['id'], tabla='conteos_sesiones', registro_id=id,
+            accion='APROBAR', tipo_cambio='INVENTARIO',
+            datos_nuevos={'ajustes_aprobados': aprobados}
+        )
+        flash(f'Conteo aprobado: {aprobados} ajustes aplicados al inventario', 'success')
+
+    except Exception as e:
+        logger.error(f"Error aprobando sesión de conteo: {e}")
+        flash('Error al aprobar el conteo. No se aplicó ningún ajuste.', 'danger')
+
+    return redirect(url_for('conteos.ver', id=id))
+
+
+@conteos_bp.route('/<int:id>/rechazar', methods=['POST'])
+@login_required
+@role_required('ADMINISTRADOR')
+def rechazar(id):
+    """Rechaza todos los ajustes de la sesión en una transacción"""
+    user = get_current_user()
+    motivo = request.form.get('motivo_rechazo', '')
+    sesion = _obtener_sesion(id)
+    if not sesion or sesion['estado'] != 'EN_REVISION':
+        flash('La sesión no está pendiente de aprobación', 'warning')
+        return redirect(url_for('conteos.ver', id=id))
+
+    try:
+        with transaccion():
+            rechazados = execute_update("""
+                UPDATE historial_ajustes_inventario
+                SET estado = 'RECHAZADO', aprobado_por = %s, fecha_aprobacion = NOW(), motivo_rechazo = %s
+                WHERE sesion_conteo_id = %s AND estado = 'PENDIENTE'
+            """, (user['id'], motivo, id))
+
+            _finalizar_sesion(id, 'RECHAZADA', user['id'], motivo)
+
+        registrar_audit_log(
+            usuario_id=user['id'], tabla='conteos_sesiones', registro_id=id,
+            accion='RECHAZAR', tipo_cambio='INVENTARIO',
+            datos_nuevos={'ajustes_rechazados': rechazados, 'motivo_rechazo': motivo}
+        )
+        flash('Conteo rechazado', 'info')
+
+    except Exception as e:
+        logger.error(f"Error rechazando sesión de conteo: {e}")
+        flash('Error al rechazar el conteo', 'danger')
+
+    return redirect(url_for('conteos.ver', id=id))
+
+
+@conteos_bp.route('/<int:id>/cancelar', methods=['POST'])
+@login_required
+@role_required('ADMINISTRADOR', 'ALMACENISTA')
+def cancelar(id):
+    """Cancela una sesión abierta sin generar ajustes"""
+    user = get_current_user()
+    filas = execute_update("""
+        UPDATE conteos_sesiones SET estado = 'CANCELADA', cerrado_por = %s, fecha_cierre = NOW()
+        WHERE id = %s AND estado = 'ABIERTA'
+    """, (user['id'], id), commit=True)
+
+    if filas:
+        registrar_audit_log(
+            usuario_id=user['id'], tabla='conteos_sesiones', registro_id=id,
+            accion='ANULAR', tipo_cambio='INVENTARIO',
+            datos_nuevos={'estado': 'CANCELADA'}
+        )
+        flash('Sesión de conteo cancelada', 'info')
+    else:
+        flash('La sesión no está abierta', 'warning')
+    return redirect(url_for('conteos.lista'))
+
+
+# ==================== FUNCIONES AUXILIARES ====================
+
+def _obtener_sesion(id):
+    """Sesión de conteo con nombres de categoría y usuarios"""
+    return execute_query("""
+        SELECT s.*, c.nombre as categoria_nombre,
+               u.nombre_completo as creado_por_nombre,
+               ua.nombre_completo as aprobado_por_nombre
+        FROM conteos_sesiones s
+        LEFT JOIN categorias_repuestos c ON s.categoria_id = c.id
+        JOIN usuarios u ON s.creado_por = u.id
+        LEFT JOIN usuarios ua ON s.aprobado_por = ua.id
+        WHERE s.id = %s
+    """, (id,), fetch_one=True)
+
+
+def _notificar_revision(sesion_id, total_ajustes):
+    """Una alerta AJUSTE_PENDIENTE por sesión, notificada a administradores"""
+    alerta_id = execute_query("""
+        INSERT INTO alertas_inventario
+        (tipo_alerta, nivel_prioridad, mensaje, datos_adicionales)
+        VALUES ('AJUSTE_PENDIENTE', 'ALTA', %s, %s)
+    """, (
+        f'Conteo físico #{sesion_id} con {total_ajustes} diferencias pendiente de aprobación',
+        json.dumps({'sesion_conteo_id': sesion_id, 'total_ajustes': total_ajustes})
+    ))
+
+    execute_query("""
+        INSERT IGNORE INTO notificaciones_usuarios (usuario_id, alerta_id)
+        SELECT u.id, %s FROM usuarios u
+        JOIN roles r ON u.rol_id = r.id
+        WHERE r.nombre IN ('SUPER_USUARIO', 'ADMINISTRADOR') AND u.activo = TRUE
+    """, (alerta_id,))
+
+
+def _finalizar_sesion(sesion_id, estado, usuario_id, motivo=None):
+    """Marca la sesión como aprobada/rechazada y resuelve su alerta (dentro de la transacción)"""
+    execute_query("""
+        UPDATE conteos_sesiones
+        SET estado = %s, aprobado_por = %s, fecha_aprobacion = NOW(), motivo_rechazo = %s
+        WHERE id = %s
+    """, (estado, usuario_id, motivo, sesion_id))
+
+    execute_query("""
+        UPDATE alertas_inventario
+        SET estado = 'RESUELTA', resuelta_por = %s, fecha_resolucion = NOW()
+        WHERE tipo_alerta = 'AJUSTE_PENDIENTE'
+        AND estado IN ('NUEVA', 'EN_PROCESO')
+        AND JSON_EXTRACT(datos_adicionales, '$.sesion_conteo_id') = %s
+    """, (usuario_id, sesion_id))
@@ -11,12 +11,18 @@ Módulo de Facturación
 from flask import render_template, request, redirect, url_for, flash, jsonify, current_app
 from datetime import datetime, date, timedelta
 from decimal import Decimal, ROUND_HALF_UP
-from database import execute_query
+from database import execute_query, execute_update, transaccion
+from reservas import reservar_stock, consumir_stock, stock_disponible, StockInsuficiente
+from alertas import verificar_alertas_stock
+from secuencias import generar_numero_documento
+from placas import patron_placa
+from metricas import registrar_evento
 from auth import (
     login_required, role_required, get_current_user,
     can_confirm_sales, can_create_sales, registrar_audit_log
 )
 from . import facturacion_bp
+from .reportes import invalidar_cache_reportes
 import logging
 import json
 
@@ -26,28 +32,14 @@ logger = logging.getLogger(__name__)
 IVA_PORCENTAJE = Decimal('19.00')
 
 
+class OperacionRechazada(Exception):
+    """La factura bloqueada ya no admite la operación (estado o saldo cambiaron); el mensaje es para el usuario"""
+
+
 def generar_numero_factura():
     """Genera un número único de factura en formato FAC-YYYYMMDD-XXXX"""
-    fecha = datetime.now().strftime('%Y%m%d')
     prefijo = current_app.config.get('PREFIJO_FACTURA', 'FAC')
-
-    # Obtener el último número del día
-    ultimo = execute_query("""
-        SELECT numero_factura FROM facturas
-        WHERE numero_factura LIKE %s
-        ORDER BY id DESC LIMIT 1
-    """, (f'{prefijo}-{fecha}-%',), fetch_one=True)
-
-    if ultimo:
-        try:
-            ultimo_num = int(ultimo['numero_factura'].split('-')[-1])
-            nuevo_num = ultimo_num + 1
-        except Exception:
-            nuevo_num = 1
-    else:
-        nuevo_num = 1
-
-    return f"{prefijo}-{fecha}-{nuevo_num:04d}"
+    return generar_numero_documento(prefijo)
 
 
 # ==================== RUTAS DE FACTURACIÓN ====================
@@ -78,12 +70,14 @@ def lista_facturas():
         params.append(estado)
 
     if search:
-        where_clauses.append("""
-            (f.numero_factura LIKE %s OR c.nombre_completo LIKE %s
-             OR v.placa LIKE %s OR c.numero_documento LIKE %s)
-        """)
         search_param = f"%{search}%"
-        params.extend([search_param, search_param, search_param, search_param])
+        condiciones = ["f.numero_factura LIKE %s", "c.nombre_completo LIKE %s", "c.numero_documento LIKE %s"]
+        params.extend([search_param, search_param, search_param])
+        placa_param = patron_placa(search)
+        if placa_param:
+            condiciones.append("v.placa_normalizada LIKE %s")
+            params.append(placa_param)
+        where_clauses.append(f"({' OR '.join(condiciones)})")
 
     where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
 
@@ -103,8 +97,7 @@ def lista_facturas():
                c.nombre_completo as cliente_nombre,
                c.numero_documento as cliente_documento,
                v.placa,
-               uv.nombre_completo as vendedor_nombre,
-               (SELECT IFNULL(SUM(pf.monto), 0) FROM pagos_factura pf WHERE pf.factura_id = f.id) as total_pagado
+               uv.nombre_completo as vendedor_nombre
         FROM facturas f
         JOIN clientes c ON f.cliente_id = c.id
         JOIN vehiculos_clientes v ON f.vehiculo_cliente_id = v.id
@@ -323,6 +316,7 @@ def crear_factura():
             user['id'], str(subtotal_con_descuento), str(impuesto), str(descuento_global),
             str(total), metodo_pago, fecha_vencimiento, observaciones
         ), commit=True)
+        registrar_evento('factura_creada')
 
         # Crear detalles de factura
         for item in items_detalle:
@@ -537,41 +531,54 @@ def registrar_pago(id):
             flash('El monto del pago debe ser mayor a cero', 'warning')
             return redirect(url_for('facturacion.ver_factura', id=id))
 
-        # Calcular total ya pagado
-        pagado_result = execute_query("""
-            SELECT IFNULL(SUM(monto), 0) as total_pagado
-            FROM pagos_factura WHERE factura_id = %s
-        """, (id,), fetch_one=True)
-        total_pagado = Decimal(str(pagado_result['total_pagado']))
-
-        total_factura = Decimal(str(factura['total']))
-        saldo_pendiente = total_factura - total_pagado
-
-        if monto > saldo_pendiente:
-            flash(f'El monto del pago (${monto:,.2f}) excede el saldo pendiente (${saldo_pendiente:,.2f})', 'warning')
-            return redirect(url_for('facturacion.ver_factura', id=id))
-
-        # Registrar el pago
-        pago_id = execute_query("""
-            INSERT INTO pagos_factura
-            (factura_id, monto, metodo_pago, referencia, observaciones, recibido_por)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (
-            id, str(monto), metodo_pago_pago, referencia, observaciones_pago, user['id']
-        ), commit=True)
+        # Pago, estado y descuento de inventario en una sola transacción: si el stock
+        # no alcanza no queda registrado nada
+        with transaccion():
+            # Factura bloqueada hasta el commit: dos pagos simultáneos se validan uno
+            # después del otro contra el saldo real
+            factura = execute_query(
+                "SELECT * FROM facturas WHERE id = %s FOR UPDATE", (id,), fetch_one=True
+            )
+            if factura['estado'] not in ('PENDIENTE', 'EN_ESPERA'):
+                raise OperacionRechazada(
+                    f'La factura {factura["numero_factura"]} ya está {factura["estado"]}: no se registró el pago'
+                )
+
+            # Total ya pagado (facturas.total_pagado, mantenido por los triggers de pagos_factura)
+            total_pagado = Decimal(str(factura['total_pagado']))
+            total_factura = Decimal(str(factura['total']))
+            saldo_pendiente = total_factura - total_pagado
+
+            if monto > saldo_pendiente:
+                raise OperacionRechazada(
+                    f'El monto del pago (${monto:,.2f}) excede el saldo pendiente (${saldo_pendiente:,.2f})'
+                )
+
+            nuevo_total_pagado = total_pagado + monto
+            pagada = nuevo_total_pagado >= total_factura
+
+            pago_id = execute_query("""
+                INSERT INTO pagos_factura
+                (factura_id, monto, metodo_pago, referencia, observaciones, recibido_por)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (
+                id, str(monto), metodo_pago_pago, referencia, observaciones_pago, user['id']
+            ), commit=False)
 
-        nuevo_total_pagado = total_pagado + monto
+            # Si la factura estaba EN_ESPERA, pasarla a PENDIENTE automáticamente
+            if factura['estado'] == 'EN_ESPERA' and not pagada:
+                execute_query("""
+                    UPDATE facturas SET estado = 'PENDIENTE', updated_at = NOW()
+                    WHERE id = %s
+                """, (id,), commit=False)
 
-        # Si la factura estaba EN_ESPERA, pasarla a PENDIENTE automáticamente
-        if factura['estado'] == 'EN_ESPERA':
-            execute_query("""
-                UPDATE facturas SET estado = 'PENDIENTE', updated_at = NOW()
-                WHERE id = %s
-            """, (id,), commit=True)
+            # Si el total pagado cubre el total de la factura => PAGADA
+            if pagada:
+                repuestos_ids = _procesar_factura_pagada(id, factura, user)
+        registrar_evento('pago')
 
-        # Si el total pagado cubre el total de la factura => PAGADA
-        if nuevo_total_pagado >= total_factura:
-            _procesar_factura_pagada(id, factura, user)
+        if pagada:
+            _notificar_factura_pagada(id, factura, user, repuestos_ids)
             flash(f'Pago registrado exitosamente. Factura {factura["numero_factura"]} PAGADA en su totalidad.', 'success')
         else:
             saldo_restante = total_factura - nuevo_total_pagado
@@ -595,6 +602,14 @@ def registrar_pago(id):
             }
         )
 
+    except OperacionRechazada as e:
+        flash(str(e), 'warning')
+    except StockInsuficiente as e:
+        faltante = e.faltantes[0]
+        flash(f'No se registró el pago: la factura {factura["numero_factura"]} no se puede marcar '
+              f'PAGADA porque no hay stock para descontar {faltante["solicitado"]} unidades de '
+              f'{faltante["nombre"]} (disponible: {faltante["disponible"]}). '
+              f'Registre la entrada de inventario y vuelva a intentarlo.', 'danger')
     except (ValueError, KeyError) as e:
         logger.error(f"Error en datos de pago: {e}")
         flash('Datos de pago inválidos. Verifique el monto.', 'danger')
@@ -607,39 +622,51 @@ def registrar_pago(id):
 
 def _procesar_factura_pagada(factura_id, factura, user):
     """
-    Procesa una factura cuando queda completamente pagada:
+    Procesa una factura cuando queda completamente pagada, en la transacción en curso
+    (usar dentro de transaccion(); las consultas no hacen commit):
     - Cambia estado a PAGADA
-    - Deduce inventario (cantidad_actual y cantidad_reservada)
+    - Deduce inventario: cantidad_actual, y la reserva solo en líneas de una solicitud
     - Crea movimientos de inventario con estado FACTURADO
     - Si viene de solicitud, actualiza solicitud e items a FACTURADO/FACTURADA
-    - Verifica alertas de stock
+
+    Returns:
+        Lista de repuesto_id de la factura (para verificar alertas tras el commit)
+
+    Raises:
+        StockInsuficiente: Si el stock físico no alcanza para alguna línea; la
+            transacción debe deshacerse (no se crea ningún movimiento FACTURADO)
+        OperacionRechazada: Si la factura ya no estaba PENDIENTE ni EN_ESPERA
     """
-    # Actualizar estado de la factura
-    execute_query("""
+    # Actualizar estado de la factura (solo una vez, aunque haya pagos simultáneos)
+    if execute_update("""
         UPDATE facturas SET estado = 'PAGADA', updated_at = NOW()
-        WHERE id = %s
-    """, (factura_id,), commit=True)
+        WHERE id = %s AND estado IN ('PENDIENTE', 'EN_ESPERA')
+    """, (factura_id,)) != 1:
+        raise OperacionRechazada(f'La factura {factura["numero_factura"]} ya no está pendiente de pago')
 
     # Obtener detalles de la factura
     detalles = execute_query("""
-        SELECT df.*, r.nombre as repuesto_nombre
+        SELECT df.*, r.nombre as repuesto_nombre, r.cantidad_actual, r.cantidad_reservada
         FROM detalles_factura df
         JOIN repuestos r ON df.repuesto_id = r.id
         WHERE df.factura_id = %s
     """, (factura_id,), fetch_all=True)
 
     for detalle in detalles:
-        # Deducir del inventario real y de la cantidad reservada
-        execute_query("""
-            UPDATE repuestos
-            SET cantidad_actual = cantidad_actual - %s,
-                cantidad_reservada = GREATEST(cantidad_reservada - %s, 0),
-                updated_by = %s
-            WHERE id = %s
-        """, (
-            detalle['cantidad'], detalle['cantidad'],
-            user['id'], detalle['repuesto_id']
-        ), commit=True)
+        # Las líneas de una solicitud consumen su reserva; las ventas directas solo
+        # el disponible, sin tocar reservas ajenas
+        reservado = bool(detalle['item_solicitud_id'] or factura['solicitud_id'])
+        if not consumir_stock(detalle['repuesto_id'], detalle['cantidad'], user['id'],
+                              reservado=reservado, commit=False):
+            logger.error(f"Factura {factura['numero_factura']}: stock insuficiente para descontar "
+                         f"{detalle['cantidad']} unidades de {detalle['repuesto_nombre']}")
+            raise StockInsuficiente([{
+                'repuesto_id': detalle['repuesto_id'],
+                'nombre': detalle['repuesto_nombre'],
+                'solicitado': detalle['cantidad'],
+                'disponible': (detalle['cantidad_actual'] if reservado
+                               else detalle['cantidad_actual'] - detalle['cantidad_reservada'])
+            }])
 
         # Crear movimiento de inventario tipo salida por facturación
         movimiento_id = execute_query("""
@@ -659,7 +686,7 @@ def _procesar_factura_pagada(factura_id, factura, user):
             user['id'],
             factura['solicitud_id'],
             f'Facturación - Factura {factura["numero_factura"]}'
-        ), commit=True)
+        ), commit=False)
 
         # Vincular movimiento al detalle de factura
         if movimiento_id:
@@ -667,10 +694,7 @@ def _procesar_factura_pagada(factura_id, factura, user):
                 UPDATE detalles_factura
                 SET movimiento_inventario_id = %s
                 WHERE id = %s
-            """, (movimiento_id, detalle['id']), commit=True)
-
-        # Verificar alertas de stock bajo
-        _verificar_alertas_stock(detalle['repuesto_id'])
+            """, (movimiento_id, detalle['id']), commit=False)
 
     # Si la factura viene de una solicitud, actualizar solicitud e items
     if factura['solicitud_id']:
@@ -679,14 +703,30 @@ def _procesar_factura_pagada(factura_id, factura, user):
             UPDATE items_solicitud
             SET estado = 'FACTURADO'
             WHERE solicitud_id = %s AND estado = 'ENTREGADO'
-        """, (factura['solicitud_id'],), commit=True)
+        """, (factura['solicitud_id'],), commit=False)
 
         # Actualizar solicitud a FACTURADA
         execute_query("""
             UPDATE solicitudes_repuestos
             SET estado = 'FACTURADA', facturado_por = %s, fecha_facturacion = NOW()
             WHERE id = %s
-        """, (user['id'], factura['solicitud_id']), commit=True)
+        """, (user['id'], factura['solicitud_id']), commit=False)
+
+    return [d['repuesto_id'] for d in detalles]
+
+
+def _notificar_factura_pagada(factura_id, factura, user, repuestos_ids):
+    """
+    Efectos de una factura PAGADA ya confirmada (tras el commit de _procesar_factura_pagada):
+    métricas, alertas de stock, caché de reportes, audit log y notificación
+    """
+    registrar_evento('factura_pagada')
+
+    # Verificar alertas de stock bajo de todos los repuestos de la factura
+    verificar_alertas_stock(repuestos_ids)
+
+    # El cambio de estado afecta los reportes de ventas del día de la factura
+    invalidar_cache_reportes(factura['created_at'].date(), ('VENTAS', 'GENERAL'))
 
     # Registrar en audit log
     registrar_audit_log(
@@ -714,7 +754,11 @@ def _procesar_factura_pagada(factura_id, factura, user):
 @login_required
 @role_required('ADMINISTRADOR')
 def anular_factura(id):
-    """Anular una factura. Revierte movimientos de inventario si estaba PAGADA."""
+    """
+    Anular una factura. Revierte movimientos de inventario si estaba PAGADA.
+    Todo en una transacción con la factura bloqueada: si no se puede volver a
+    reservar el stock de la solicitud no se anula nada.
+    """
     user = get_current_user()
 
     factura = execute_query(
@@ -736,96 +780,119 @@ def anular_factura(id):
         return redirect(url_for('facturacion.ver_factura', id=id))
 
     try:
-        estado_anterior = factura['estado']
+        repuestos_devueltos = []
 
-        # Si la factura estaba PAGADA, revertir inventario
-        if estado_anterior == 'PAGADA':
-            detalles = execute_query("""
-                SELECT df.*, r.nombre as repuesto_nombre
-                FROM detalles_factura df
-                JOIN repuestos r ON df.repuesto_id = r.id
-                WHERE df.factura_id = %s
-            """, (id,), fetch_all=True)
-
-            for detalle in detalles:
-                # Devolver stock al inventario
-                execute_query("""
-                    UPDATE repuestos
-                    SET cantidad_actual = cantidad_actual + %s,
-                        updated_by = %s
-                    WHERE id = %s
-                """, (detalle['cantidad'], user['id'], detalle['repuesto_id']), commit=True)
-
-                # Crear movimiento de inventario de reversa
-                execute_query("""
-                    INSERT INTO movimientos_inventario
-                    (repuesto_id, tipo_movimiento_id, cantidad, precio_unitario,
-                     usuario_id, solicitud_id, estado, observaciones)
-                    VALUES (
-                        %s,
-                        (SELECT id FROM tipos_movimiento WHERE nombre = 'Devolución Técnico' LIMIT 1),
-                        %s, %s, %s, %s, 'CONFIRMADO',
-                        %s
-                    )
-                """, (
-                    detalle['repuesto_id'],
-                    detalle['cantidad'],
-                    str(detalle['precio_unitario']),
-                    user['id'],
-                    factura['solicitud_id'],
-                    f'Reversa por anulación de factura {factura["numero_factura"]}'
-                ), commit=True)
-
-                # Verificar alertas de stock
-                _verificar_alertas_stock(detalle['repuesto_id'])
-
-        # Si la factura viene de una solicitud, devolver a estado ENTREGADA
-        if factura['solicitud_id']:
-            solicitud = execute_query(
-                "SELECT estado FROM solicitudes_repuestos WHERE id = %s",
-                (factura['solicitud_id'],), fetch_one=True
+        # Reversa de inventario, solicitud, reservas y estado en una sola transacción
+        with transaccion():
+            # Factura bloqueada: un pago o una anulación simultáneos esperan al commit
+            factura = execute_query(
+                "SELECT * FROM facturas WHERE id = %s FOR UPDATE", (id,), fetch_one=True
             )
+            if factura['estado'] == 'ANULADA':
+                raise OperacionRechazada('Esta factura ya está anulada')
+            estado_anterior = factura['estado']
+
+            # Si la factura estaba PAGADA, revertir inventario
+            if estado_anterior == 'PAGADA':
+                detalles = execute_query("""
+                    SELECT df.*, r.nombre as repuesto_nombre
+                    FROM detalles_factura df
+                    JOIN repuestos r ON df.repuesto_id = r.id
+                    WHERE df.factura_id = %s
+                """, (id,), fetch_all=True)
+
+                for detalle in detalles:
+                    # Devolver stock al inventario
+                    execute_query("""
+                        UPDATE repuestos
+                        SET cantidad_actual = cantidad_actual + %s,
+                            updated_by = %s
+                        WHERE id = %s
+                    """, (detalle['cantidad'], user['id'], detalle['repuesto_id']), commit=False)
+
+                    # Crear movimiento de inventario de reversa
+                    execute_query("""
+                        INSERT INTO movimientos_inventario
+                        (repuesto_id, tipo_movimiento_id, cantidad, precio_unitario,
+                         usuario_id, solicitud_id, estado, observaciones)
+                        VALUES (
+                            %s,
+                            (SELECT id FROM tipos_movimiento WHERE nombre = 'Devolución Técnico' LIMIT 1),
+                            %s, %s, %s, %s, 'CONFIRMADO',
+                            %s
+                        )
+                    """, (
+                        detalle['repuesto_id'],
+                        detalle['cantidad'],
+                        str(detalle['precio_unitario']),
+                        user['id'],
+                        factura['solicitud_id'],
+                        f'Reversa por anulación de factura {factura["numero_factura"]}'
+                    ), commit=False)
+
+                repuestos_devueltos = [d['repuesto_id'] for d in detalles]
+
+            # Si la factura viene de una solicitud, devolver a estado ENTREGADA
+            if factura['solicitud_id']:
+                solicitud = execute_query(
+                    "SELECT estado FROM solicitudes_repuestos WHERE id = %s FOR UPDATE",
+                    (factura['solicitud_id'],), fetch_one=True
+                )
+
+                if solicitud and solicitud['estado'] == 'FACTURADA':
+                    # Devolver items a ENTREGADO
+                    execute_query("""
+                        UPDATE items_solicitud
+                        SET estado = 'ENTREGADO'
+                        WHERE solicitud_id = %s AND estado = 'FACTURADO'
+                    """, (factura['solicitud_id'],), commit=False)
+
+                    # Devolver solicitud a ENTREGADA
+                    execute_query("""
+                        UPDATE solicitudes_repuestos
+                        SET estado = 'ENTREGADA', facturado_por = NULL, fecha_facturacion = NULL
+                        WHERE id = %s
+                    """, (factura['solicitud_id'],), commit=False)
+
+                    # Si estaba PAGADA, re-reservar stock para la solicitud: sin reserva
+                    # no se anula (la solicitud quedaría ENTREGADA sin respaldo)
+                    if estado_anterior == 'PAGADA':
+                        detalles_sol = execute_query("""
+                            SELECT i.repuesto_id, i.cantidad_entregada, r.nombre
+                            FROM items_solicitud i
+                            JOIN repuestos r ON i.repuesto_id = r.id
+                            WHERE i.solicitud_id = %s AND i.estado = 'ENTREGADO'
+                        """, (factura['solicitud_id'],), fetch_all=True)
+
+                        for det_sol in detalles_sol:
+                            if not reservar_stock(det_sol['repuesto_id'], det_sol['cantidad_entregada'],
+                                                  user['id'], commit=False):
+                                raise StockInsuficiente([{
+                                    'repuesto_id': det_sol['repuesto_id'],
+                                    'nombre': det_sol['nombre'],
+                                    'solicitado': det_sol['cantidad_entregada'],
+                                    'disponible': stock_disponible(det_sol['repuesto_id'])
+                                }])
+
+            # Anular la factura
+            execute_query("""
+                UPDATE facturas
+                SET estado = 'ANULADA',
+                    anulado_por = %s,
+                    fecha_anulacion = NOW(),
+                    motivo_anulacion = %s,
+                    updated_at = NOW()
+                WHERE id = %s
+            """, (user['id'], motivo_anulacion, id), commit=False)
 
-            if solicitud and solicitud['estado'] == 'FACTURADA':
-                # Devolver items a ENTREGADO
-                execute_query("""
-                    UPDATE items_solicitud
-                    SET estado = 'ENTREGADO'
-                    WHERE solicitud_id = %s AND estado = 'FACTURADO'
-                """, (factura['solicitud_id'],), commit=True)
+        # Verificar alertas de stock de todos los repuestos devueltos
+        if repuestos_devueltos:
+            verificar_alertas_stock(repuestos_devueltos)
+        registrar_evento('factura_anulada')
 
-                # Devolver solicitud a ENTREGADA
-                execute_query("""
-                    UPDATE solicitudes_repuestos
-                    SET estado = 'ENTREGADA', facturado_por = NULL, fecha_facturacion = NULL
-                    WHERE id = %s
-                """, (factura['solicitud_id'],), commit=True)
-
-                # Si estaba PAGADA, re-reservar stock para la solicitud
-                if estado_anterior == 'PAGADA':
-                    detalles_sol = execute_query("""
-                        SELECT repuesto_id, cantidad_entregada
-                        FROM items_solicitud
-                        WHERE solicitud_id = %s AND estado = 'ENTREGADO'
-                    """, (factura['solicitud_id'],), fetch_all=True)
-
-                    for det_sol in detalles_sol:
-                        execute_query("""
-                            UPDATE repuestos
-                            SET cantidad_reservada = cantidad_reservada + %s
-                            WHERE id = %s
-                        """, (det_sol['cantidad_entregada'], det_sol['repuesto_id']), commit=True)
-
-        # Anular la factura
-        execute_query("""
-            UPDATE facturas
-            SET estado = 'ANULADA',
-                anulado_por = %s,
-                fecha_anulacion = NOW(),
-                motivo_anulacion = %s,
-                updated_at = NOW()
-            WHERE id = %s
-        """, (user['id'], motivo_anulacion, id), commit=True)
+        # Invalidar reportes del día de la factura y los que incluyen la reversa de hoy
+        invalidar_cache_reportes(factura['created_at'].date(), ('VENTAS', 'GENERAL'))
+        invalidar_cache_reportes(date.today())
 
         # Registrar en audit log
         registrar_audit_log(
@@ -857,6 +924,13 @@ def anular_factura(id):
         else:
             flash(f'Factura {factura["numero_factura"]} anulada exitosamente.', 'success')
 
+    except OperacionRechazada as e:
+        flash(str(e), 'warning')
+    except StockInsuficiente as e:
+        faltante = e.faltantes[0]
+        flash(f'No se anuló la factura: no hay stock para volver a reservar {faltante["solicitado"]} '
+              f'unidades de {faltante["nombre"]} para la solicitud (disponible: {faltante["disponible"]}).',
+              'danger')
     except Exception as e:
         logger.error(f"Error anulando factura: {e}")
         flash('Error al anular la factura', 'danger')
@@ -925,69 +999,6 @@ def api_solicitudes_facturables():
 
 # ==================== FUNCIONES AUXILIARES ====================
 
-def _verificar_alertas_stock(repuesto_id):
-    """Verifica y crea alertas de stock bajo para un repuesto"""
-    try:
-        repuesto = execute_query("""
-            SELECT id, codigo, nombre, cantidad_actual, cantidad_minima
-            FROM repuestos WHERE id = %s
-        """, (repuesto_id,), fetch_one=True)
-
-        if not repuesto:
-            return
-
-        # Resolver alertas si el stock está bien
-        if repuesto['cantidad_actual'] > repuesto['cantidad_minima']:
-            execute_query("""
-                UPDATE alertas_inventario
-                SET estado = 'RESUELTA', resolved_at = NOW()
-                WHERE repuesto_id = %s AND estado = 'ACTIVA'
-                AND tipo_alerta IN ('STOCK_BAJO', 'AGOTADO')
-            """, (repuesto_id,), commit=True)
-            return
-
-        # Determinar tipo de alerta
-        if repuesto['cantidad_actual'] == 0:
-            tipo_alerta = 'AGOTADO'
-            nivel = 'CRITICA'
-            mensaje = f"AGOTADO: {repuesto['nombre']} ({repuesto['codigo']}) - Sin stock tras facturación"
-        elif repuesto['cantidad_actual'] <= repuesto['cantidad_minima']:
-            tipo_alerta = 'STOCK_BAJO'
-            nivel = 'ALTA'
-            mensaje = f"Stock bajo: {repuesto['nombre']} ({repuesto['codigo']}) - {repuesto['cantidad_actual']} unidades"
-        else:
-            return
-
-        # Verificar si ya existe alerta activa del mismo tipo
-        alerta_existente = execute_query("""
-            SELECT id FROM alertas_inventario
-            WHERE repuesto_id = %s AND estado = 'ACTIVA' AND tipo_alerta = %s
-        """, (repuesto_id, tipo_alerta), fetch_one=True)
-
-        if not alerta_existente:
-            alerta_id = execute_query("""
-                INSERT INTO alertas_inventario
-                (repuesto_id, tipo_alerta, nivel_prioridad, mensaje)
-                VALUES (%s, %s, %s, %s)
-            """, (repuesto_id, tipo_alerta, nivel, mensaje), commit=True)
-
-            # Notificar a administradores y almacenistas
-            usuarios = execute_query("""
-                SELECT u.id FROM usuarios u
-                JOIN roles r ON u.rol_id = r.id
-                WHERE r.nombre IN ('SUPER_USUARIO', 'ADMINISTRADOR', 'ALMACENISTA') AND u.activo = TRUE
-            """, fetch_all=True)
-
-            for usuario in usuarios:
-                execute_query("""
-                    INSERT INTO notificaciones_usuarios (usuario_id, alerta_id)
-                    VALUES (%s, %s)
-                """, (usuario['id'], alerta_id), commit=True)
-
-    except Exception as e:
-        logger.error(f"Error verificando alertas de stock: {e}")
-
-
 def _crear_alerta_factura(factura_id, numero_factura, tipo_alerta, mensaje):
     """Crea una alerta/notificación relacionada con facturación"""
     try:
@@ -1013,6 +1024,7 @@ def _crear_alerta_factura(factura_id, numero_factura, tipo_alerta, mensaje):
                 INSERT INTO notificaciones_usuarios (usuario_id, alerta_id)
                 VALUES (%s, %s)
             """, (usuario['id'], alerta_id), commit=True)
+        registrar_evento('alerta')
 
     except Exception as e:
         logger.error(f"Error creando alerta de facturación: {e}")
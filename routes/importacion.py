@@ -0,0 +1,517 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Importación CSV
+- Repuestos: alta o actualización por código
+- Entradas de inventario: recepción de un pedido de proveedor en un solo archivo
+- El archivo se lee en streaming y se procesa por lotes (IMPORTACION_LOTE filas)
+- Validación por fila; el modo simulación muestra las diferencias sin escribir
+- Cada lote se escribe con inserciones múltiples en su propia transacción
+- Un solo barrido de alertas al final y un registro de auditoría con el checksum del archivo
+"""
+
+from flask import render_template, request, redirect, url_for, flash, current_app
+from decimal import Decimal, InvalidOperation
+from database import execute_query, execute_many, transaccion
+from alertas import verificar_alertas_stock, barrer_alertas_stock
+from auth import login_required, role_required, get_current_user, registrar_audit_log
+from . import importacion_bp
+import csv
+import hashlib
+import itertools
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Miles con punto y sin decimales: 1.500 / 54.568.950
+_MILES_CON_PUNTO = re.compile(r'^\d{1,3}(\.\d{3})+$')
+
+# Columnas reconocidas por tipo de importación
+COLUMNAS = {
+    'repuestos': {
+        'obligatorias': ('codigo',),
+        'opcionales': ('nombre', 'descripcion', 'categoria', 'precio_venta', 'cantidad_actual',
+                       'cantidad_minima', 'ubicacion_fisica', 'marca_fabricante')
+    },
+    'entradas': {
+        'obligatorias': ('codigo', 'cantidad'),
+        'opcionales': ('precio_unitario', 'observaciones')
+    }
+}
+
+# Campos de repuesto actualizables desde el archivo (la cantidad solo aplica a repuestos nuevos)
+CAMPOS_ACTUALIZABLES = ('nombre', 'descripcion', 'categoria_id', 'precio_venta', 'cantidad_minima',
+                        'ubicacion_fisica', 'marca_fabricante')
+
+# Límites del reporte para mantener la memoria acotada con archivos grandes
+MAX_DETALLE_REPORTE = 200
+MAX_ERRORES_REPORTE = 200
+
+
+# ==================== RUTAS DE IMPORTACIÓN ====================
+
+@importacion_bp.route('/', methods=['GET', 'POST'])
+@login_required
+@role_required('ADMINISTRADOR', 'ALMACENISTA')
+def importar():
+    """Formulario de importación y procesamiento del archivo"""
+    tipos_movimiento = execute_query(
+        "SELECT * FROM tipos_movimiento WHERE tipo = 'ENTRADA' ORDER BY nombre",
+        fetch_all=True
+    )
+
+    if request.method == 'POST':
+        tipo = request.form.get('tipo')
+        archivo = request.files.get('archivo')
+        simulacion = request.form.get('simulacion') == '1'
+        tipo_movimiento_id = request.form.get('tipo_movimiento_id') or None
+
+        if tipo not in COLUMNAS:
+            flash('Tipo de importación inválido', 'danger')
+            return redirect(url_for('importacion.importar'))
+
+        if not archivo or not archivo.filename.lower().endswith('.csv'):
+            flash('Debe seleccionar un archivo .csv', 'warning')
+            return redirect(url_for('importacion.importar'))
+
+        if tipo == 'entradas' and not tipo_movimiento_id:
+            flash('Seleccione el tipo de entrada', 'warning')
+            return redirect(url_for('importacion.importar'))
+
+        try:
+            sha256 = _checksum(archivo)
+            anterior = execute_query("""
+                SELECT i.created_at, u.nombre_completo as usuario_nombre
+                FROM importaciones i
+                LEFT JOIN usuarios u ON i.usuario_id = u.id
+                WHERE i.tipo = %s AND i.sha256 = %s
+                ORDER BY i.id DESC LIMIT 1
+            """, (tipo, sha256), fetch_one=True)
+
+            # Una recepción ya importada sumaría el stock dos veces
+            if anterior and tipo == 'entradas' and not simulacion and request.form.get('permitir_repetido') != '1':
+                flash(f'Este archivo ya fue importado el {anterior["created_at"].strftime("%d/%m/%Y %H:%M")}. '
+                      'Marque "Permitir archivo repetido" para importarlo de nuevo.', 'warning')
+                return redirect(url_for('importacion.importar'))
+
+            reporte = procesar_importacion(
+                tipo, archivo, sha256, get_current_user(),
+                aplicar=not simulacion, tipo_movimiento_id=tipo_movimiento_id
+            )
+            reporte['importado_antes'] = anterior
+
+            if reporte.get('error_formato'):
+                flash(reporte['error_formato'], 'danger')
+                return redirect(url_for('importacion.importar'))
+
+            return render_template('importacion/resultado.html', reporte=reporte)
+
+        except Exception as e:
+            logger.error(f"Error importando archivo CSV: {e}")
+            flash('Error al procesar el archivo. Los lotes ya confirmados se conservan; revise el audit log.', 'danger')
+            return redirect(url_for('importacion.importar'))
+
+    return render_template('importacion/form.html',
+                         tipos_movimiento=tipos_movimiento,
+                         columnas=COLUMNAS)
+
+
+# ==================== PROCESAMIENTO ====================
+
+def procesar_importacion(tipo, archivo, sha256, user, aplicar=False, tipo_movimiento_id=None):
+    """
+    Procesa un archivo CSV por lotes.
+
+    Args:
+        tipo: 'repuestos' o 'entradas'
+        archivo: FileStorage subido
+        sha256: Checksum del archivo
+        user: Usuario que importa
+        aplicar: False para simulación (solo reporte de diferencias)
+        tipo_movimiento_id: Tipo de movimiento para las entradas
+
+    Returns:
+        Dict con el reporte de la importación
+    """
+    inicio = time.monotonic()
+    reporte = {
+        'tipo': tipo, 'archivo': archivo.filename, 'sha256': sha256, 'simulacion': not aplicar,
+        'filas': 0, 'creados': 0, 'actualizados': 0, 'sin_cambios': 0, 'entradas': 0, 'unidades': 0,
+        'errores': [], 'total_errores': 0, 'detalle': [], 'detalle_omitido': 0,
+        'lotes': 0, 'importacion_id': None
+    }
+
+    lector = _lector_csv(archivo)
+    faltantes = [c for c in COLUMNAS[tipo]['obligatorias'] if c not in (lector.fieldnames or [])]
+    if faltantes:
+        reporte['error_formato'] = f'Faltan columnas obligatorias: {", ".join(faltantes)}'
+        return reporte
+
+    contexto = {
+        'user': user,
+        'aplicar': aplicar,
+        'tipo_movimiento_id': tipo_movimiento_id,
+        'vistos': set(),
+        'repuestos_afectados': set(),
+        'acumulado': {}
+    }
+    if tipo == 'repuestos':
+        contexto['categorias'] = _mapa_categorias()
+
+    procesar_lote = _lote_repuestos if tipo == 'repuestos' else _lote_entradas
+    tamano_lote = current_app.config.get('IMPORTACION_LOTE', 500)
+
+    for lote in _lotes(lector, tamano_lote):
+        reporte['filas'] += len(lote)
+        reporte['lotes'] += 1
+        procesar_lote(lote, contexto, reporte)
+
+    if aplicar:
+        _finalizar_importacion(tipo, contexto, reporte)
+
+    reporte['segundos'] = round(time.monotonic() - inicio, 2)
+    return reporte
+
+
+def _lote_repuestos(lote, contexto, reporte):
+    """Valida un lote de repuestos, calcula diferencias y lo escribe si corresponde"""
+    codigos = list({(fila.get('codigo') or '').strip() for _, fila in lote} - {''})
+    existentes = {}
+    if codigos:
+        placeholders = ', '.join(['%s'] * len(codigos))
+        existentes = {_clave_codigo(r['codigo']): r for r in execute_query(f"""
+            SELECT id, codigo, nombre, descripcion, categoria_id, precio_venta, cantidad_minima,
+                   ubicacion_fisica, marca_fabricante
+            FROM repuestos WHERE codigo IN ({placeholders})
+        """, tuple(codigos), fetch_all=True)}
+
+    nuevos = []
+    cambios = []
+
+    for linea, fila in lote:
+        codigo = (fila.get('codigo') or '').strip()
+        clave = _clave_codigo(codigo)
+        try:
+            if clave in contexto['vistos']:
+                raise ValueError('Código repetido en el archivo')
+            datos = _validar_repuesto(fila, contexto['categorias'], clave in existentes)
+        except ValueError as e:
+            _agregar_error(reporte, linea, codigo, str(e))
+            continue
+
+        contexto['vistos'].add(clave)
+        actual = existentes.get(clave)
+
+        if not actual:
+            nuevos.append(datos)
+            reporte['creados'] += 1
+            _agregar_detalle(reporte, linea, codigo, 'CREAR',
+                             {k: [None, v] for k, v in datos.items() if v not in (None, '')})
+            continue
+
+        diferencias = {
+            campo: [actual[campo], datos[campo]]
+            for campo in CAMPOS_ACTUALIZABLES
+            if datos.get(campo) is not None and str(datos[campo]) != str(actual[campo] if actual[campo] is not None else '')
+        }
+        if not diferencias:
+            reporte['sin_cambios'] += 1
+            continue
+
+        cambios.append((actual['id'], datos))
+        reporte['actualizados'] += 1
+        _agregar_detalle(reporte, linea, codigo, 'ACTUALIZAR', diferencias)
+
+    if not contexto['aplicar'] or not (nuevos or cambios):
+        return
+
+    user_id = contexto['user']['id']
+    with transaccion():
+        if nuevos:
+            execute_many("""
+                INSERT INTO repuestos
+                (codigo, nombre, descripcion, categoria_id, precio_venta, cantidad_actual,
+                 cantidad_minima, ubicacion_fisica, marca_fabricante, created_by)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, [(
+                d['codigo'], d['nombre'], d['descripcion'] or '', d['categoria_id'], d['precio_venta'],
+                d['cantidad_actual'] or 0, d['cantidad_minima'] if d['cantidad_minima'] is not None else 5,
+                d['ubicacion_fisica'] or '', d['marca_fabricante'] or '', user_id
+            ) for d in nuevos], commit=False)
+
+        if cambios:
+            # Columnas ausentes o vacías en el archivo conservan el valor actual
+            execute_many("""
+                UPDATE repuestos
+                SET nombre = COALESCE(%s, nombre), descripcion = COALESCE(%s, descripcion),
+                    categoria_id = COALESCE(%s, categoria_id), precio_venta = COALESCE(%s, precio_venta),
+                    cantidad_minima = COALESCE(%s, cantidad_minima),
+                    ubicacion_fisica = COALESCE(%s, ubicacion_fisica),
+                    marca_fabricante = COALESCE(%s, marca_fabricante),
+                    updated_by = %s
+                WHERE id = %s
+            """, [tuple(d[c] for c in CAMPOS_ACTUALIZABLES) + (user_id, repuesto_id)
+                  for repuesto_id, d in cambios], commit=False)
+
+
+def _lote_entradas(lote, contexto, reporte):
+    """Valida un lote de entradas de inventario y lo escribe si corresponde"""
+    codigos = list({(fila.get('codigo') or '').strip() for _, fila in lote} - {''})
+    existentes = {}
+    if codigos:
+        placeholders = ', '.join(['%s'] * len(codigos))
+        existentes = {_clave_codigo(r['codigo']): r for r in execute_query(f"""
+            SELECT id, codigo, nombre, cantidad_actual
+            FROM repuestos WHERE codigo IN ({placeholders}) AND activo = TRUE
+        """, tuple(codigos), fetch_all=True)}
+
+    movimientos = []
+    por_repuesto = {}
+
+    for linea, fila in lote:
+        codigo = (fila.get('codigo') or '').strip()
+        try:
+            repuesto = existentes.get(_clave_codigo(codigo))
+            if not repuesto:
+                raise ValueError('Repuesto no encontrado o inactivo')
+            cantidad = _entero(fila.get('cantidad'), 'cantidad', minimo=1)
+            precio = _decimal(fila.get('precio_unitario'), 'precio_unitario') if (fila.get('precio_unitario') or '').strip() else Decimal('0')
+        except ValueError as e:
+            _agregar_error(reporte, linea, codigo, str(e))
+            continue
+
+        # Stock acumulado por repuesto a lo largo del archivo (para el reporte)
+        anterior = repuesto['cantidad_actual'] + contexto['acumulado'].get(repuesto['id'], 0)
+        contexto['acumulado'][repuesto['id']] = contexto['acumulado'].get(repuesto['id'], 0) + cantidad
+
+        movimientos.append((
+            repuesto['id'], contexto['tipo_movimiento_id'], cantidad, precio,
+            contexto['user']['id'], (fila.get('observaciones') or '').strip() or f'Importación {reporte["archivo"]}'
+        ))
+        por_repuesto[repuesto['id']] = por_repuesto.get(repuesto['id'], 0) + cantidad
+        reporte['entradas'] += 1
+        reporte['unidades'] += cantidad
+        _agregar_detalle(reporte, linea, codigo, 'ENTRADA',
+                         {'cantidad_actual': [anterior, anterior + cantidad]})
+
+    if not contexto['aplicar'] or not movimientos:
+        return
+
+    ids = list(por_repuesto)
+    placeholders = ', '.join(['%s'] * len(ids))
+    casos = ' '.join(['WHEN %s THEN %s'] * len(ids))
+    params = [valor for repuesto_id in ids for valor in (repuesto_id, por_repuesto[repuesto_id])]
+
+    with transaccion():
+        execute_many("""
+            INSERT INTO movimientos_inventario
+            (repuesto_id, tipo_movimiento_id, cantidad, precio_unitario,
+             usuario_id, estado, observaciones)
+            VALUES (%s, %s, %s, %s, %s, 'CONFIRMADO', %s)
+        """, movimientos, commit=False)
+
+        execute_query(f"""
+            UPDATE repuestos
+            SET cantidad_actual = cantidad_actual + CASE id {casos} END,
+                updated_by = %s
+            WHERE id IN ({placeholders})
+        """, tuple(params) + (contexto['user']['id'],) + tuple(ids))
+
+    contexto['repuestos_afectados'].update(ids)
+
+
+def _finalizar_importacion(tipo, contexto, reporte):
+    """Barrido de alertas, registro de la importación y audit log (una vez por archivo)"""
+    if tipo == 'repuestos':
+        # Altas y cambios de mínimo pueden abrir o cerrar alertas en cualquier parte del catálogo
+        if reporte['creados'] or reporte['actualizados']:
+            barrer_alertas_stock(current_app.config.get('ALERTAS_BARRIDO_LOTE', 5000))
+    elif contexto['repuestos_afectados']:
+        if len(contexto['repuestos_afectados']) <= current_app.config.get('ALERTAS_BARRIDO_LOTE', 5000):
+            verificar_alertas_stock(contexto['repuestos_afectados'])
+        else:
+            barrer_alertas_stock(current_app.config.get('ALERTAS_BARRIDO_LOTE', 5000))
+
+    user = contexto['user']
+    importacion_id = execute_query("""
+        INSERT INTO importaciones
+        (tipo, nombre_archivo, sha256, filas, creados, actualizados, entradas, errores, usuario_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (
+        tipo, reporte['archivo'], reporte['sha256'], reporte['filas'], reporte['creados'],
+        reporte['actualizados'], reporte['entradas'], reporte['total_errores'], user['id']
+    ), commit=True)
+    reporte['importacion_id'] = importacion_id
+
+    registrar_audit_log(
+        usuario_id=user['id'], tabla='importaciones', registro_id=importacion_id,
+        accion='CREAR', tipo_cambio='INVENTARIO',
+        datos_nuevos={
+            'tipo': tipo,
+            'archivo': reporte['archivo'],
+            'sha256': reporte['sha256'],
+            'filas': reporte['filas'],
+            'creados': reporte['creados'],
+            'actualizados': reporte['actualizados'],
+            'entradas': reporte['entradas'],
+            'unidades': reporte['unidades'],
+            'errores': reporte['total_errores']
+        }
+    )
+
+
+# ==================== FUNCIONES AUXILIARES ====================
+
+def _checksum(archivo):
+    """SHA-256 del archivo subido, leído por bloques; deja el stream al inicio"""
+    sha256 = hashlib.sha256()
+    for bloque in iter(lambda: archivo.stream.read(65536), b''):
+        sha256.update(bloque)
+    archivo.stream.seek(0)
+    return sha256.hexdigest()
+
+
+def _lineas(stream):
+    """Líneas del archivo decodificadas; acepta UTF-8 (con o sin BOM) y Latin-1 de Excel"""
+    for linea in stream:
+        try:
+            yield linea.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            yield linea.decode('latin-1')
+
+
+def _lector_csv(archivo):
+    """DictReader en streaming con separador detectado (',' o ';') y encabezados normalizados"""
+    lineas = _lineas(archivo.stream)
+    encabezado = next(lineas, '')
+    separador = ';' if encabezado.count(';') > encabezado.count(',') else ','
+    lector = csv.DictReader(itertools.chain([encabezado], lineas), delimiter=separador)
+    if lector.fieldnames:
+        lector.fieldnames = [(c or '').strip().lower() for c in lector.fieldnames]
+    return lector
+
+
+def _lotes(lector, tamano):
+    """Agrupa las filas del lector en lotes de (número de línea, fila)"""
+    lote = []
+    for fila in lector:
+        lote.append((lector.line_num, fila))
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _mapa_categorias():
+    """Categorías activas por nombre (minúsculas) y por ID"""
+    categorias = execute_query(
+        "SELECT id, nombre FROM categorias_repuestos WHERE activo = TRUE", fetch_all=True
+    )
+    mapa = {c['nombre'].strip().lower(): c['id'] for c in categorias}
+    mapa.update({str(c['id']): c['id'] for c in categorias})
+    return mapa
+
+
+def _validar_repuesto(fila, categorias, existe):
+    """
+    Valida una fila de repuesto. Los campos vacíos quedan en None (no se modifican).
+
+    Raises:
+        ValueError: Con el motivo del rechazo de la fila
+    """
+    def texto(campo, largo):
+        valor = (fila.get(campo) or '').strip()
+        if len(valor) > largo:
+            raise ValueError(f'{campo} supera {largo} caracteres')
+        return valor or None
+
+    datos = {
+        'codigo': texto('codigo', 50),
+        'nombre': texto('nombre', 200),
+        'descripcion': texto('descripcion', 5000),
+        'categoria_id': None,
+        'precio_venta': None,
+        'cantidad_actual': None,
+        'cantidad_minima': None,
+        'ubicacion_fisica': texto('ubicacion_fisica', 100),
+        'marca_fabricante': texto('marca_fabricante', 100)
+    }
+
+    if not datos['codigo']:
+        raise ValueError('El código es obligatorio')
+
+    categoria = (fila.get('categoria') or '').strip()
+    if categoria:
+        datos['categoria_id'] = categorias.get(categoria.lower())
+        if datos['categoria_id'] is None:
+            raise ValueError(f'Categoría desconocida: {categoria}')
+
+    if (fila.get('precio_venta') or '').strip():
+        datos['precio_venta'] = _decimal(fila['precio_venta'], 'precio_venta')
+    if (fila.get('cantidad_minima') or '').strip():
+        datos['cantidad_minima'] = _entero(fila['cantidad_minima'], 'cantidad_minima')
+    if (fila.get('cantidad_actual') or '').strip():
+        if existe:
+            raise ValueError('cantidad_actual solo aplica a repuestos nuevos; use una importación de entradas')
+        datos['cantidad_actual'] = _entero(fila['cantidad_actual'], 'cantidad_actual')
+
+    if not existe:
+        if not datos['nombre']:
+            raise ValueError('El nombre es obligatorio para repuestos nuevos')
+        if datos['precio_venta'] is None:
+            raise ValueError('El precio de venta es obligatorio para repuestos nuevos')
+
+    return datos
+
+
+def _clave_codigo(codigo):
+    """Clave de comparación de códigos: el índice UNIQUE de codigo no distingue mayúsculas"""
+    return codigo.strip().upper()
+
+
+def _entero(valor, campo, minimo=0):
+    """Convierte a entero validando el mínimo"""
+    try:
+        numero = int(str(valor).strip())
+    except (TypeError, ValueError):
+        raise ValueError(f'{campo} debe ser un número entero')
+    if numero < minimo:
+        raise ValueError(f'{campo} debe ser mayor o igual a {minimo}')
+    return numero
+
+
+def _decimal(valor, campo):
+    """
+    Convierte a Decimal no negativo; acepta formato colombiano (54.568,25) y miles
+    sin decimales (1.500 = mil quinientos). Con punto y sin coma, el punto es decimal
+    salvo que separe grupos de tres dígitos.
+    """
+    texto = str(valor).strip().replace(' ', '').replace('$', '')
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    elif _MILES_CON_PUNTO.match(texto):
+        texto = texto.replace('.', '')
+    try:
+        numero = Decimal(texto)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f'{campo} debe ser un número')
+    if numero < 0 or not numero.is_finite():
+        raise ValueError(f'{campo} debe ser un número positivo')
+    return numero.quantize(Decimal('0.01'))
+
+
+def _agregar_error(reporte, linea, codigo, mensaje):
+    """Registra un error de fila (el reporte guarda solo los primeros)"""
+    reporte['total_errores'] += 1
+    if len(reporte['errores']) < MAX_ERRORES_REPORTE:
+        reporte['errores'].append({'linea': linea, 'codigo': codigo, 'mensaje': mensaje})
+
+
+def _agregar_detalle(reporte, linea, codigo, accion, cambios):
+    """Registra una diferencia para el reporte (solo las primeras filas)"""
+    if len(reporte['detalle']) < MAX_DETALLE_REPORTE:
+        reporte['detalle'].append({'linea': linea, 'codigo': codigo, 'accion': accion, 'cambios': cambios})
+    else:
+        reporte['detalle_omitido'] += 1
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Kardex (tarjeta de stock por repuesto)
+- Movimientos que afectaron el stock con tipo, costo unitario y saldo acumulado
+- Paginación por clave (?antes= / ?despues=), sin OFFSET
+- Vista HTML y API JSON con los mismos datos
+"""
+
+from flask import render_template, request, jsonify, current_app, abort
+from database import execute_query
+from auth import login_required
+from kardex import pagina_kardex, leer_clave
+from . import kardex_bp
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _pagina_solicitada(repuesto_id):
+    """Página del kardex según los parámetros de la petición"""
+    limite = min(request.args.get('limite', current_app.config['ITEMS_PER_PAGE'], type=int) or 1, 500)
+    despues = leer_clave(request.args.get('despues'))
+    antes = leer_clave(request.args.get('antes')) if not despues else None
+    return pagina_kardex(repuesto_id, limite, despues=despues, antes=antes)
+
+
+def _repuesto(repuesto_id):
+    repuesto = execute_query("""
+        SELECT id, codigo, nombre, cantidad_actual, cantidad_reservada, cantidad_inicial
+        FROM repuestos WHERE id = %s
+    """, (repuesto_id,), fetch_one=True)
+    if not repuesto:
+        abort(404)
+    return repuesto
+
+
+@kardex_bp.route('/<int:repuesto_id>')
+@login_required
+def ver(repuesto_id):
+    """Kardex de un repuesto"""
+    repuesto = _repuesto(repuesto_id)
+    pagina = _pagina_solicitada(repuesto_id)
+    return render_template('kardex/ver.html', repuesto=repuesto, pagina=pagina)
+
+
+@kardex_bp.route('/api/<int:repuesto_id>')
+@login_required
+def api(repuesto_id):
+    """Kardex de un repuesto en JSON"""
+    repuesto = _repuesto(repuesto_id)
+    pagina = _pagina_solicitada(repuesto_id)
+    return jsonify({
+        'repuesto': {'id': repuesto['id'], 'codigo': repuesto['codigo'], 'nombre': repuesto['nombre'],
+                     'cantidad_actual': repuesto['cantidad_actual']},
+        'saldo_anterior': pagina['saldo_anterior'],
+        'anterior': pagina['anterior'],
+        'siguiente': pagina['siguiente'],
+        'eventos': [{
+            'fecha': e['fecha'].isoformat(),
+            'fuente': 'movimiento' if e['fuente'] == 0 else 'ajuste',
+            'id': e['id'],
+            'concepto': e['concepto'],
+            'estado': e['estado'],
+            'entrada': e['entrada'],
+            'salida': e['salida'],
+            'precio_unitario': float(e['precio_unitario']) if e['precio_unitario'] is not None else None,
+            'saldo': e['saldo'],
+            'usuario': e['usuario'],
+            'observaciones': e['observaciones']
+        } for e in pagina['eventos']]
+    })
@@ -2,8 +2,9 @@
 """
 Módulo de Reportes Periódicos
 - Generación de reportes por tipo y rango de fechas
-- Tipos: INVENTARIO, VENTAS, MOVIMIENTOS, ALERTAS, USUARIOS, GENERAL
-- Almacenamiento permanente de reportes generados
+- Tipos: INVENTARIO, VENTAS, MOVIMIENTOS, ALERTAS, USUARIOS, CLASIFICACION, GENERAL
+- Almacenamiento permanente de reportes generados (datos comprimidos con zlib)
+- Caché de resultados por tipo y rango de fechas (permanente para períodos cerrados)
 - Solo accesible por ADMIN, SUPER_USUARIO y ALMACENISTA/VENDEDOR (lectura)
 """
 
@@ -11,16 +12,33 @@ from flask import render_template, request, redirect, url_for, flash, jsonify, c
 from datetime import datetime, date, timedelta
 from decimal import Decimal
 from database import execute_query
+from valorizacion import valorizacion_total, valorizacion_por_categoria
+from clasificacion import resumen_clasificacion
+from metricas import registrar_cache
 from auth import (
     login_required, role_required, get_current_user,
     can_view_reports, registrar_audit_log
 )
 from . import reportes_bp
 import json
+import zlib
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Versión de la estructura de datos de los reportes. Incrementar al cambiar
+# el contenido de _generar_datos_reporte para invalidar la caché existente.
+VERSION_DATOS_REPORTE = 1
+
+# Tipos cuyo contenido depende solo de registros del período. INVENTARIO y
+# GENERAL reflejan el stock actual y ALERTAS el estado actual de cada alerta,
+# por lo que su caché siempre expira.
+TIPOS_PERIODO_CERRADO = ('VENTAS', 'MOVIMIENTOS', 'USUARIOS')
+
+# Códecs de datos_comprimidos: 'zlib' lo escribe la aplicación y 'mysql' la
+# migración v3->v4 con COMPRESS() (4 bytes de longitud + flujo zlib).
+CODEC_DATOS_REPORTE = 'zlib'
+
 
 # ==================== RUTAS DE REPORTES ====================
 
@@ -52,9 +70,11 @@ def lista_reportes():
         SELECT COUNT(*) as count FROM reportes_generados r WHERE {where_sql}
     """, tuple(params), fetch_one=True)['count']
 
+    # Solo columnas de metadatos: los datos del reporte se leen en ver_reporte
     params.extend([per_page, offset])
     reportes = execute_query(f"""
-        SELECT r.*,
+        SELECT r.id, r.tipo_reporte, r.titulo, r.fecha_inicio, r.fecha_fin,
+               r.generado_por, r.created_at,
                u.nombre_completo as generado_por_nombre
         FROM reportes_generados r
         JOIN usuarios u ON r.generado_por = u.id
@@ -65,7 +85,7 @@ def lista_reportes():
 
     total_pages = (total + per_page - 1) // per_page
 
-    tipos_reporte = ['INVENTARIO', 'VENTAS', 'MOVIMIENTOS', 'ALERTAS', 'USUARIOS', 'GENERAL']
+    tipos_reporte = ['INVENTARIO', 'VENTAS', 'MOVIMIENTOS', 'ALERTAS', 'USUARIOS', 'CLASIFICACION', 'GENERAL']
 
     return render_template('reportes/lista.html',
                          reportes=reportes,
@@ -80,7 +100,7 @@ def lista_reportes():
 @role_required('ADMINISTRADOR', 'ALMACENISTA')
 def form_generar():
     """Formulario para generar un nuevo reporte"""
-    tipos_reporte = ['INVENTARIO', 'VENTAS', 'MOVIMIENTOS', 'ALERTAS', 'USUARIOS', 'GENERAL']
+    tipos_reporte = ['INVENTARIO', 'VENTAS', 'MOVIMIENTOS', 'ALERTAS', 'USUARIOS', 'CLASIFICACION', 'GENERAL']
 
     # Fechas por defecto: último mes
     fecha_hasta = date.today()
@@ -112,19 +132,29 @@ def generar_reporte():
         if not titulo:
             titulo = f"Reporte {tipo_reporte} - {fecha_desde} a {fecha_hasta}"
 
+        # Reutilizar un reporte ya generado para el mismo tipo y período
+        reporte_cache = _buscar_reporte_en_cache(tipo_reporte, fecha_desde, fecha_hasta)
+        registrar_cache('reportes', reporte_cache is not None)
+        if reporte_cache:
+            flash(f'Ya existe el reporte "{reporte_cache["titulo"]}" vigente para este tipo y período', 'info')
+            return redirect(url_for('reportes.ver_reporte', id=reporte_cache['reporte_id']))
+
         # Generar datos del reporte según tipo
         datos = _generar_datos_reporte(tipo_reporte, fecha_desde, fecha_hasta)
 
         # Guardar reporte
         reporte_id = execute_query("""
             INSERT INTO reportes_generados
-            (tipo_reporte, titulo, fecha_inicio, fecha_fin, datos_json, generado_por)
-            VALUES (%s, %s, %s, %s, %s, %s)
+            (tipo_reporte, titulo, fecha_inicio, fecha_fin,
+             datos_comprimidos, datos_codec, generado_por)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
         """, (
             tipo_reporte, titulo, fecha_desde, fecha_hasta,
-            json.dumps(datos, default=str), user['id']
+            _comprimir_datos(datos), CODEC_DATOS_REPORTE, user['id']
         ), commit=True)
 
+        _guardar_en_cache(tipo_reporte, fecha_desde, fecha_hasta, reporte_id)
+
         registrar_audit_log(
             usuario_id=user['id'],
             tabla='reportes_generados',
@@ -168,15 +198,11 @@ def ver_reporte(id):
         flash('Reporte no encontrado', 'danger')
         return redirect(url_for('reportes.lista_reportes'))
 
-    # Parsear datos JSON
+    # Descomprimir y parsear datos JSON
     datos = {}
     try:
-        if reporte['datos_json']:
-            if isinstance(reporte['datos_json'], str):
-                datos = json.loads(reporte['datos_json'])
-            else:
-                datos = reporte['datos_json']
-    except (json.JSONDecodeError, TypeError):
+        datos = _leer_datos_reporte(reporte)
+    except (json.JSONDecodeError, zlib.error, TypeError, ValueError):
         datos = {}
 
     return render_template('reportes/ver.html',
@@ -184,6 +210,103 @@ def ver_reporte(id):
                          datos=datos)
 
 
+# ==================== ALMACENAMIENTO DE DATOS ====================
+
+def _comprimir_datos(datos):
+    """Serializa los datos del reporte a JSON y los comprime con zlib"""
+    return zlib.compress(json.dumps(datos, default=str).encode('utf-8'), 6)
+
+
+def _leer_datos_reporte(reporte):
+    """
+    Obtiene los datos de un reporte según su códec de almacenamiento.
+    Los reportes anteriores a la migración v3->v4 sin comprimir se leen de datos_json.
+    """
+    codec = reporte.get('datos_codec')
+    blob = reporte.get('datos_comprimidos')
+
+    if codec and blob:
+        if codec == 'zlib':
+            return json.loads(zlib.decompress(blob).decode('utf-8'))
+        if codec == 'mysql':
+            return json.loads(zlib.decompress(blob[4:]).decode('utf-8'))
+        raise ValueError(f"Códec de reporte desconocido: {codec}")
+
+    datos_json = reporte.get('datos_json')
+    if not datos_json:
+        return {}
+    if isinstance(datos_json, str):
+        return json.loads(datos_json)
+    return datos_json
+
+
+# ==================== CACHÉ DE REPORTES ====================
+
+def _buscar_reporte_en_cache(tipo, fecha_desde, fecha_hasta):
+    """Busca un reporte vigente para el tipo y período indicados"""
+    try:
+        return execute_query("""
+            SELECT rc.reporte_id, r.titulo
+            FROM reportes_cache rc
+            JOIN reportes_generados r ON rc.reporte_id = r.id
+            WHERE rc.tipo_reporte = %s AND rc.fecha_inicio = %s AND rc.fecha_fin = %s
+            AND rc.version_datos = %s
+            AND (rc.expira_at IS NULL OR rc.expira_at > NOW())
+        """, (tipo, fecha_desde, fecha_hasta, VERSION_DATOS_REPORTE), fetch_one=True)
+    except Exception as e:
+        logger.error(f"Error consultando caché de reportes: {e}")
+        return None
+
+
+def _guardar_en_cache(tipo, fecha_desde, fecha_hasta, reporte_id):
+    """Registra el reporte en caché; los períodos cerrados no expiran"""
+    try:
+        periodo_cerrado = (
+            tipo in TIPOS_PERIODO_CERRADO
+            and datetime.strptime(fecha_hasta, '%Y-%m-%d').date() < date.today()
+        )
+        expira_at = None
+        if not periodo_cerrado:
+            ttl = current_app.config.get('REPORTES_CACHE_TTL_MINUTOS', 15)
+            expira_at = datetime.now() + timedelta(minutes=ttl)
+
+        execute_query("""
+            INSERT INTO reportes_cache
+            (tipo_reporte, fecha_inicio, fecha_fin, version_datos, reporte_id, expira_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE reporte_id = VALUES(reporte_id),
+                                    expira_at = VALUES(expira_at),
+                                    created_at = NOW()
+        """, (tipo, fecha_desde, fecha_hasta, VERSION_DATOS_REPORTE, reporte_id, expira_at), commit=True)
+    except Exception as e:
+        logger.error(f"Error guardando reporte en caché: {e}")
+
+
+def invalidar_cache_reportes(fecha, tipos=None):
+    """
+    Elimina de la caché los reportes cuyo período incluye la fecha indicada.
+    Debe llamarse desde las operaciones que modifican datos de fechas pasadas
+    (anulaciones, pagos de facturas antiguas).
+
+    Args:
+        fecha: Fecha afectada (date o 'YYYY-MM-DD')
+        tipos: Tipos de reporte a invalidar; None invalida todos
+    """
+    try:
+        where_tipos = ""
+        params = [fecha, fecha]
+        if tipos:
+            where_tipos = f" AND tipo_reporte IN ({', '.join(['%s'] * len(tipos))})"
+            params.extend(tipos)
+
+        execute_query(f"""
+            DELETE FROM reportes_cache
+            WHERE fecha_inicio <= %s AND fecha_fin >= %s{where_tipos}
+        """, tuple(params), commit=True)
+    except Exception as e:
+        logger.error(f"Error invalidando caché de reportes: {e}")
+
+
 # ==================== FUNCIONES DE GENERACIÓN ====================
 
 def _generar_datos_reporte(tipo, fecha_desde, fecha_hasta):
@@ -205,6 +328,9 @@ def _generar_datos_reporte(tipo, fecha_desde, fecha_hasta):
         datos.update(_reporte_alertas(fecha_desde, fecha_hasta))
     elif tipo == 'USUARIOS':
         datos.update(_reporte_usuarios(fecha_desde, fecha_hasta))
+    elif tipo == 'CLASIFICACION':
+        # Última clasificación ABC/XYZ calculada (flask clasificar)
+        datos.update(resumen_clasificacion())
     elif tipo == 'GENERAL':
         datos.update(_reporte_inventario(fecha_desde, fecha_hasta))
         datos.update(_reporte_ventas(fecha_desde, fecha_hasta))
@@ -215,33 +341,23 @@ def _generar_datos_reporte(tipo, fecha_desde, fecha_hasta):
 
 
 def _reporte_inventario(fecha_desde, fecha_hasta):
-    """Datos de inventario"""
-    resumen = execute_query("""
-        SELECT
-            COUNT(*) as total_repuestos,
-            SUM(cantidad_actual) as total_unidades,
-            SUM(cantidad_actual * precio_venta) as valor_total,
-            SUM(CASE WHEN cantidad_actual = 0 THEN 1 ELSE 0 END) as agotados,
-            SUM(CASE WHEN cantidad_actual > 0 AND cantidad_actual <= cantidad_minima THEN 1 ELSE 0 END) as stock_bajo
-        FROM repuestos
-        WHERE activo = TRUE
-    """, fetch_one=True)
-
-    por_categoria = execute_query("""
-        SELECT c.nombre as categoria,
-               COUNT(r.id) as total,
-               SUM(r.cantidad_actual) as unidades,
-               SUM(r.cantidad_actual * r.precio_venta) as valor
-        FROM repuestos r
-        LEFT JOIN categorias_repuestos c ON r.categoria_id = c.id
-        WHERE r.activo = TRUE
-        GROUP BY c.id, c.nombre
-        ORDER BY valor DESC
-    """, fetch_all=True)
+    """Datos de inventario (agregados de valorizacion_inventario)"""
+    resumen = valorizacion_total()
+    por_categoria = valorizacion_por_categoria()
 
     return {
-        'inventario_resumen': dict(resumen) if resumen else {},
-        'inventario_por_categoria': [dict(c) for c in por_categoria] if por_categoria else []
+        'inventario_resumen': {
+            'total_repuestos': resumen['repuestos'],
+            'total_unidades': resumen['unidades'],
+            'valor_total': resumen['valor'],
+            'agotados': resumen['agotados'],
+            'stock_bajo': resumen['stock_bajo']
+        },
+        'inventario_por_categoria': [
+            {'categoria': c['categoria'], 'total': c['total'],
+             'unidades': c['unidades'], 'valor': c['valor']}
+            for c in por_categoria
+        ]
     }
 
 
@@ -9,8 +9,10 @@ Módulo de Solicitudes de Repuestos
 """
 
 from flask import render_template, request, redirect, url_for, flash, jsonify, current_app
-from datetime import datetime, date
-from database import execute_query
+from database import execute_query, transaccion
+from reservas import reservar_stock, liberar_reserva, reservar_lote, StockInsuficiente
+from secuencias import generar_numero_documento
+from placas import patron_placa
 from auth import (
     login_required, role_required, get_current_user, 
     can_create_requests, can_approve_requests, registrar_audit_log
@@ -23,26 +25,8 @@ logger = logging.getLogger(__name__)
 
 def generar_numero_solicitud():
     """Genera un número único de solicitud en formato SOL-YYYYMMDD-XXXX"""
-    fecha = datetime.now().strftime('%Y%m%d')
     prefijo = current_app.config.get('PREFIJO_SOLICITUD', 'SOL')
-    
-    # Obtener el último número del día
-    ultimo = execute_query("""
-        SELECT numero_solicitud FROM solicitudes_repuestos 
-        WHERE numero_solicitud LIKE %s
-        ORDER BY id DESC LIMIT 1
-    """, (f'{prefijo}-{fecha}-%',), fetch_one=True)
-    
-    if ultimo:
-        try:
-            ultimo_num = int(ultimo['numero_solicitud'].split('-')[-1])
-            nuevo_num = ultimo_num + 1
-        except:
-            nuevo_num = 1
-    else:
-        nuevo_num = 1
-    
-    return f"{prefijo}-{fecha}-{nuevo_num:04d}"
+    return generar_numero_documento(prefijo)
 
 
 # ==================== RUTAS DE SOLICITUDES ====================
@@ -72,11 +56,14 @@ def lista_solicitudes():
         params.append(estado)
     
     if search:
-        where_clauses.append("""
-            (s.numero_solicitud LIKE %s OR c.nombre_completo LIKE %s OR v.placa LIKE %s)
-        """)
         search_param = f"%{search}%"
-        params.extend([search_param, search_param, search_param])
+        condiciones = ["s.numero_solicitud LIKE %s", "c.nombre_completo LIKE %s"]
+        params.extend([search_param, search_param])
+        placa_param = patron_placa(search)
+        if placa_param:
+            condiciones.append("v.placa_normalizada LIKE %s")
+            params.append(placa_param)
+        where_clauses.append(f"({' OR '.join(condiciones)})")
     
     where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
     
@@ -143,58 +130,44 @@ def nueva_solicitud():
             repuesto_ids = request.form.getlist('repuesto_id[]')
             cantidades = request.form.getlist('cantidad[]')
             
-            if not repuesto_ids or not any(repuesto_ids):
+            lineas = [
+                (int(repuesto_id), int(cantidades[i]))
+                for i, repuesto_id in enumerate(repuesto_ids) if repuesto_id
+            ]
+            
+            if not lineas:
                 flash('Debe agregar al menos un repuesto a la solicitud', 'warning')
                 return redirect(url_for('solicitudes.nueva_solicitud'))
             
             # Generar número de solicitud
             numero_solicitud = generar_numero_solicitud()
             
-            # Crear la solicitud
-            solicitud_id = execute_query("""
-                INSERT INTO solicitudes_repuestos 
-                (numero_solicitud, tecnico_id, cliente_id, vehiculo_id, observaciones, fecha_requerida)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                numero_solicitud, user['id'], cliente_id, vehiculo_id, 
-                observaciones, fecha_requerida
-            ), commit=True)
-            
-            # Agregar items y reservar stock
-            for i, repuesto_id in enumerate(repuesto_ids):
-                if not repuesto_id:
-                    continue
-                    
-                cantidad = int(cantidades[i])
+            # Crear la solicitud, sus items y las reservas en una sola transacción
+            with transaccion():
+                solicitud_id = execute_query("""
+                    INSERT INTO solicitudes_repuestos 
+                    (numero_solicitud, tecnico_id, cliente_id, vehiculo_id, observaciones, fecha_requerida)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, (
+                    numero_solicitud, user['id'], cliente_id, vehiculo_id, 
+                    observaciones, fecha_requerida
+                ))
                 
-                # Obtener precio actual del repuesto
-                repuesto = execute_query(
-                    "SELECT precio_venta, cantidad_actual, cantidad_reservada FROM repuestos WHERE id = %s",
-                    (repuesto_id,), fetch_one=True
-                )
+                # Verificar y reservar todas las líneas a la vez
+                repuestos = reservar_lote(lineas, user['id'])
                 
-                # Verificar disponibilidad
-                stock_disponible = repuesto['cantidad_actual'] - repuesto['cantidad_reservada']
-                if cantidad > stock_disponible:
-                    flash(f'Stock insuficiente para uno de los repuestos. Disponible: {stock_disponible}', 'warning')
-                    # Rollback de la solicitud
-                    execute_query("DELETE FROM solicitudes_repuestos WHERE id = %s", (solicitud_id,), commit=True)
-                    return redirect(url_for('solicitudes.nueva_solicitud'))
+                # Insertar todos los items en estado RESERVADO con el precio actual
+                valores = []
+                params = []
+                for repuesto_id, cantidad in lineas:
+                    valores.append("(%s, %s, %s, %s, 'RESERVADO')")
+                    params.extend([solicitud_id, repuesto_id, cantidad, repuestos[repuesto_id]['precio_venta']])
                 
-                # Insertar item en estado RESERVADO
-                execute_query("""
+                execute_query(f"""
                     INSERT INTO items_solicitud 
                     (solicitud_id, repuesto_id, cantidad_solicitada, precio_unitario, estado)
-                    VALUES (%s, %s, %s, %s, 'RESERVADO')
-                """, (solicitud_id, repuesto_id, cantidad, repuesto['precio_venta']), commit=True)
-                
-                # Reservar stock (incrementar cantidad_reservada)
-                execute_query("""
-                    UPDATE repuestos 
-                    SET cantidad_reservada = cantidad_reservada + %s,
-                        updated_by = %s
-                    WHERE id = %s
-                """, (cantidad, user['id'], repuesto_id), commit=True)
+                    VALUES {', '.join(valores)}
+                """, tuple(params))
             
             # Registrar en audit log
             registrar_audit_log(
@@ -207,7 +180,7 @@ def nueva_solicitud():
                     'numero_solicitud': numero_solicitud,
                     'cliente_id': cliente_id,
                     'vehiculo_id': vehiculo_id,
-                    'total_items': len([r for r in repuesto_ids if r])
+                    'total_items': len(lineas)
                 }
             )
             
@@ -217,28 +190,17 @@ def nueva_solicitud():
             flash(f'Solicitud {numero_solicitud} creada exitosamente', 'success')
             return redirect(url_for('solicitudes.ver_solicitud', id=solicitud_id))
             
+        except StockInsuficiente as e:
+            faltante = e.faltantes[0]
+            flash(f'Stock insuficiente para {faltante["nombre"] or "uno de los repuestos"}. '
+                  f'Disponible: {faltante["disponible"]}', 'warning')
+            return redirect(url_for('solicitudes.nueva_solicitud'))
+            
         except Exception as e:
             logger.error(f"Error creando solicitud: {e}")
             flash('Error al crear la solicitud', 'danger')
     
-    # Obtener datos para el formulario
-    clientes = execute_query(
-        "SELECT id, nombre_completo, numero_documento FROM clientes WHERE activo = TRUE ORDER BY nombre_completo",
-        fetch_all=True
-    )
-    
-    # Obtener repuestos con stock disponible (ordenados alfabéticamente)
-    repuestos = execute_query("""
-        SELECT r.id, r.codigo, r.nombre, r.precio_venta,
-               r.cantidad_actual, r.cantidad_reservada,
-               (r.cantidad_actual - r.cantidad_reservada) as disponible,
-               c.nombre as categoria
-        FROM repuestos r
-        LEFT JOIN categorias_repuestos c ON r.categoria_id = c.id
-        WHERE r.activo = TRUE AND (r.cantidad_actual - r.cantidad_reservada) > 0
-        ORDER BY r.nombre ASC
-    """, fetch_all=True)
-    
+    # Repuestos y clientes se cargan en el navegador desde /api/catalogo
     # Obtener categorías para filtro
     categorias = execute_query(
         "SELECT * FROM categorias_repuestos WHERE activo = TRUE ORDER BY nombre",
@@ -247,8 +209,6 @@ def nueva_solicitud():
     
     return render_template('solicitudes/form.html',
                          solicitud=None,
-                         clientes=clientes,
-                         repuestos=repuestos,
                          categorias=categorias)
 
 
@@ -346,21 +306,20 @@ def aprobar_solicitud(id):
             if cantidad_aprobada is None:
                 cantidad_aprobada = item['cantidad_solicitada']
             
-            # Actualizar item
+            # Ajustar reserva a la cantidad aprobada
+            diferencia = item['cantidad_solicitada'] - cantidad_aprobada
+            if diferencia > 0:
+                liberar_reserva(item['repuesto_id'], diferencia, user['id'], commit=False)
+            elif diferencia < 0 and not reservar_stock(item['repuesto_id'], -diferencia, user['id'], commit=False):
+                flash('Stock insuficiente para aprobar más de lo solicitado; se aprobó la cantidad solicitada', 'warning')
+                cantidad_aprobada = item['cantidad_solicitada']
+            
+            # Actualizar item (confirma también el ajuste de reserva)
             execute_query("""
                 UPDATE items_solicitud 
                 SET cantidad_aprobada = %s, estado = 'APROBADO'
                 WHERE id = %s
             """, (cantidad_aprobada, item['id']), commit=True)
-            
-            # Ajustar reserva si se aprobó menos cantidad
-            diferencia = item['cantidad_solicitada'] - cantidad_aprobada
-            if diferencia > 0:
-                execute_query("""
-                    UPDATE repuestos 
-                    SET cantidad_reservada = cantidad_reservada - %s
-                    WHERE id = %s
-                """, (diferencia, item['repuesto_id']), commit=True)
         
         # Actualizar estado de solicitud
         execute_query("""
@@ -418,16 +377,12 @@ def rechazar_solicitud(id):
         )
         
         for item in items:
-            execute_query("""
-                UPDATE repuestos 
-                SET cantidad_reservada = cantidad_reservada - %s
-                WHERE id = %s
-            """, (item['cantidad_solicitada'], item['repuesto_id']), commit=True)
-            
-            execute_query(
-                "UPDATE items_solicitud SET estado = 'RECHAZADO' WHERE solicitud_id = %s",
-                (id,), commit=True
-            )
+            liberar_reserva(item['repuesto_id'], item['cantidad_solicitada'], user['id'], commit=False)
+        
+        execute_query(
+            "UPDATE items_solicitud SET estado = 'RECHAZADO' WHERE solicitud_id = %s",
+            (id,), commit=True
+        )
         
         # Actualizar estado de solicitud
         execute_query("""
@@ -563,11 +518,7 @@ def registrar_devolucion(id):
         """, (nueva_cantidad_devuelta, nueva_cantidad_devuelta, item_id), commit=True)
         
         # Liberar reserva de stock
-        execute_query("""
-            UPDATE repuestos 
-            SET cantidad_reservada = cantidad_reservada - %s
-            WHERE id = %s
-        """, (cantidad_devuelta, item['repuesto_id']), commit=True)
+        liberar_reserva(item['repuesto_id'], cantidad_devuelta, user['id'], commit=True)
         
         # Verificar si hay devolución parcial
         items_pendientes = execute_query("""
@@ -586,12 +537,12 @@ def registrar_devolucion(id):
                 (id,), commit=True
             )
         
-        # Registrar movimiento de entrada por devolución
+        # Registrar la devolución (DEVUELTO: libera reserva, no suma stock físico)
         execute_query("""
             INSERT INTO movimientos_inventario 
             (repuesto_id, tipo_movimiento_id, cantidad, usuario_id, solicitud_id, estado, observaciones)
             VALUES (%s, (SELECT id FROM tipos_movimiento WHERE nombre = 'Devolución Técnico'), 
-                    %s, %s, %s, 'CONFIRMADO', 'Devolución antes de facturar')
+                    %s, %s, %s, 'DEVUELTO', 'Devolución antes de facturar')
         """, (item['repuesto_id'], cantidad_devuelta, user['id'], id), commit=True)
         
         registrar_audit_log(
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Numeración de documentos (facturas, solicitudes)
+- Un contador por prefijo y día en la tabla secuencias
+- Asignación atómica con LAST_INSERT_ID(valor + n): sin colisiones entre usuarios concurrentes
+- La asignación se confirma de inmediato en una conexión aparte en modo autocommit, sin
+  tocar la transacción del documento (un rollback posterior deja un hueco, nunca un duplicado)
+- Opcional: cada proceso reserva un bloque de números (SECUENCIAS_BLOQUE > 1)
+"""
+
+from flask import current_app
+from datetime import date
+from database import get_db_autocommit
+from metricas import observar_sql
+import threading
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bloques reservados por este proceso: (prefijo, fecha) -> [siguiente, ultimo]
+_bloques = {}
+_bloques_lock = threading.Lock()
+
+
+def _reiniciar_tras_fork():
+    """
+    Proceso hijo (servidor prefork): descarta los bloques heredados. Si el padre tenía
+    un bloque reservado, padre e hijos entregarían los mismos números.
+    """
+    global _bloques, _bloques_lock
+    _bloques = {}
+    _bloques_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):  # Solo POSIX
+    os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+
+def _asignar_bloque(prefijo, fecha, cantidad):
+    """
+    Reserva 'cantidad' números consecutivos para (prefijo, fecha).
+
+    Returns:
+        Último número del bloque reservado
+    """
+    sentencia = """
+        INSERT INTO secuencias (prefijo, fecha, valor)
+        VALUES (%s, %s, LAST_INSERT_ID(%s))
+        ON DUPLICATE KEY UPDATE valor = LAST_INSERT_ID(valor + %s)
+    """
+    # Conexión autocommit propia: un commit aquí no debe confirmar a medias la
+    # transacción de quien pide el número
+    with get_db_autocommit().cursor() as cursor:
+        inicio = time.perf_counter()
+        try:
+            cursor.execute(sentencia, (prefijo, fecha, cantidad, cantidad))
+        except Exception:
+            observar_sql(sentencia, time.perf_counter() - inicio, error=True)
+            raise
+        observar_sql(sentencia, time.perf_counter() - inicio)
+        # LAST_INSERT_ID es por conexión: se lee en la misma
+        cursor.execute("SELECT LAST_INSERT_ID() as valor")
+        return cursor.fetchone()['valor']
+
+
+def siguiente_numero(prefijo, fecha=None):
+    """
+    Siguiente número de la secuencia de un prefijo para un día.
+
+    Args:
+        prefijo: Prefijo del documento (FAC, SOL)
+        fecha: Día de la secuencia (hoy por defecto)
+
+    Returns:
+        Número entero, empezando en 1 cada día
+    """
+    fecha = fecha or date.today()
+    bloque = max(int(current_app.config.get('SECUENCIAS_BLOQUE', 1)), 1)
+
+    if bloque == 1:
+        return _asignar_bloque(prefijo, fecha, 1)
+
+    clave = (prefijo, fecha)
+    with _bloques_lock:
+        # Descartar bloques de días anteriores
+        for vieja in [k for k in _bloques if k[1] != fecha]:
+            del _bloques[vieja]
+
+        actual = _bloques.get(clave)
+        if not actual or actual[0] > actual[1]:
+            ultimo = _asignar_bloque(prefijo, fecha, bloque)
+            actual = [ultimo - bloque + 1, ultimo]
+            _bloques[clave] = actual
+
+        numero = actual[0]
+        actual[0] += 1
+        return numero
+
+
+def generar_numero_documento(prefijo, fecha=None):
+    """Número de documento en formato PREFIJO-YYYYMMDD-XXXX"""
+    fecha = fecha or date.today()
+    return f"{prefijo}-{fecha.strftime('%Y%m%d')}-{siguiente_numero(prefijo, fecha):04d}"
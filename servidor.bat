@@ -0,0 +1,23 @@
+@echo off
+echo ========================================
+echo Sistema de Inventario - Servidor de Produccion
+echo ========================================
+echo.
+
+if not exist "venv\" (
+    echo Ejecute primero inicio.bat para crear el entorno virtual
+    pause
+    exit /b 1
+)
+
+call venv\Scripts\activate.bat
+pip install -r requirements.txt
+echo.
+
+echo La aplicacion estara disponible en: http://localhost:8000
+echo Presione Ctrl+C para detener el servidor
+echo.
+
+python servidor.py
+
+pause
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor de producción
+- gunicorn prefork: la aplicación se crea una sola vez en el proceso maestro (manifiesto
+  de estáticos, plantillas precompiladas) y los procesos la heredan por copy-on-write
+- Procesos e hilos por proceso según Config.SERVIDOR_*; cada proceso se recicla tras
+  SERVIDOR_MAX_PETICIONES (con variación aleatoria, para que no se reinicien a la vez)
+- Recarga ordenada: SIGHUP reemplaza los procesos sin cortar las peticiones en curso;
+  para cargar código nuevo, SIGUSR2 (nuevo maestro) y luego SIGQUIT al maestro anterior
+- Calentamiento por proceso al iniciar: conexión a la base de datos y caché de detalles
+  de repuestos. El estado por proceso (grupo de hilos de imágenes, caché de detalles,
+  bloques de secuencias) se reinicia en cada fork
+
+gunicorn solo funciona en Linux/macOS; en Windows se usa waitress (un proceso con hilos)
+si está instalado.
+
+Uso: python servidor.py [--config production] [--puerto 8000] [--procesos 4] [--hilos 4]
+"""
+
+import os
+import shutil
+
+# Métricas de todos los procesos en archivos compartidos (metricas.py), en un
+# subdirectorio por maestro: cache/metricas/<pid>
+_DIRECTORIO_METRICAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'metricas')
+
+
+def _proceso_vivo(pid):
+    if os.name != 'posix':
+        # Windows: un solo proceso (waitress) y os.kill terminaría el proceso
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _directorio_metricas():
+    """
+    Directorio de métricas de este maestro. Borra los de maestros que ya terminaron
+    (sus archivos se sumarían a los nuevos), nunca el de uno vivo: tras SIGUSR2 el
+    maestro anterior y sus procesos siguen atendiendo hasta recibir SIGQUIT.
+    """
+    os.makedirs(_DIRECTORIO_METRICAS, exist_ok=True)
+    for nombre in os.listdir(_DIRECTORIO_METRICAS):
+        if nombre.isdigit() and not _proceso_vivo(int(nombre)):
+            shutil.rmtree(os.path.join(_DIRECTORIO_METRICAS, nombre), ignore_errors=True)
+    directorio = os.path.join(_DIRECTORIO_METRICAS, str(os.getpid()))
+    # PID reutilizado de un maestro anterior
+    shutil.rmtree(directorio, ignore_errors=True)
+    return directorio
+
+
+if __name__ == '__main__':
+    # prometheus_client elige el modo al importarse, antes que cualquier módulo de la
+    # aplicación. Se reemplaza el valor heredado: el maestro nuevo de SIGUSR2 recibe el
+    # entorno del anterior
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = _directorio_metricas()
+
+from database import execute_query
+from detalle_repuestos import validadores_detalle, detalle_repuesto
+from metricas import proceso_terminado
+import click
+import gc
+import logging
+import multiprocessing
+import time
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # pragma: no cover - dependencia opcional (no existe en Windows)
+    BaseApplication = None
+
+try:
+    import waitress
+except ImportError:  # pragma: no cover - dependencia opcional
+    waitress = None
+
+logger = logging.getLogger(__name__)
+
+
+def procesos_por_defecto():
+    """2 x núcleos + 1 (recomendación de gunicorn para cargas con espera de E/S)"""
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def calentar_proceso(app):
+    """
+    Prepara un proceso recién creado antes de que atienda peticiones: verifica la
+    conexión a la base de datos y carga en la caché de detalles los repuestos más
+    facturados en los últimos 30 días (SERVIDOR_CALENTAR_DETALLES).
+
+    Returns:
+        Dict con 'detalles' cargados y 'segundos'
+    """
+    inicio = time.monotonic()
+    resultado = {'detalles': 0}
+    cantidad = app.config.get('SERVIDOR_CALENTAR_DETALLES', 50)
+    capacidad = app.config.get('DETALLE_REPUESTOS_CACHE', 500)
+    try:
+        with app.app_context():
+            execute_query("SELECT 1", fetch_one=True)
+            if cantidad and capacidad:
+                repuestos = execute_query("""
+                    SELECT df.repuesto_id, SUM(df.cantidad) as vendidas
+                    FROM detalles_factura df
+                    WHERE df.created_at >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+                    GROUP BY df.repuesto_id
+                    ORDER BY vendidas DESC
+                    LIMIT %s
+                """, (min(cantidad, capacidad),), fetch_all=True)
+                for r in repuestos:
+                    validez = validadores_detalle(r['repuesto_id'])
+                    if validez and detalle_repuesto(r['repuesto_id'], validez[0], capacidad):
+                        resultado['detalles'] += 1
+    except Exception as e:
+        # Un proceso sin calentar sigue siendo válido: las cachés se llenan con el uso
+        logger.error(f"Calentamiento del proceso {os.getpid()} incompleto: {e}")
+    resultado['segundos'] = round(time.monotonic() - inicio, 2)
+    logger.info(f"Proceso {os.getpid()} listo: {resultado['detalles']} detalles en caché "
+                f"({resultado['segundos']} s)")
+    return resultado
+
+
+def opciones_gunicorn(app, host=None, puerto=None, procesos=None, hilos=None):
+    """Configuración de gunicorn a partir de Config.SERVIDOR_* (los argumentos la reemplazan)"""
+    config = app.config
+    hilos = hilos or config.get('SERVIDOR_HILOS', 4)
+    opciones = {
+        'bind': f"{host or config.get('SERVIDOR_HOST', '0.0.0.0')}:{puerto or config.get('SERVIDOR_PUERTO', 8000)}",
+        'workers': procesos or config.get('SERVIDOR_PROCESOS') or procesos_por_defecto(),
+        'threads': hilos,
+        'worker_class': 'gthread' if hilos > 1 else 'sync',
+        'preload_app': True,
+        'max_requests': config.get('SERVIDOR_MAX_PETICIONES', 2000),
+        'max_requests_jitter': config.get('SERVIDOR_MAX_PETICIONES_VARIACION', 200),
+        'timeout': config.get('SERVIDOR_TIEMPO_LIMITE', 120),
+        'graceful_timeout': config.get('SERVIDOR_TIEMPO_GRACIA', 30),
+        'keepalive': config.get('SERVIDOR_KEEPALIVE', 5),
+        'accesslog': '-' if config.get('SERVIDOR_REGISTRO_ACCESOS', False) else None,
+        'errorlog': '-',
+        'proc_name': 'taller_inventario',
+        'post_worker_init': lambda worker: calentar_proceso(app),
+        'child_exit': lambda server, worker: proceso_terminado(worker.pid),
+    }
+    # Latido de los procesos en memoria: un disco lento no los hace parecer colgados
+    if os.path.isdir('/dev/shm'):
+        opciones['worker_tmp_dir'] = '/dev/shm'
+    return opciones
+
+
+if BaseApplication is not None:
+    class ServidorGunicorn(BaseApplication):
+        """gunicorn embebido con la aplicación ya creada (precargada en el maestro)"""
+
+        def __init__(self, aplicacion, opciones):
+            self.aplicacion = aplicacion
+            self.opciones = opciones
+            super().__init__()
+
+        def load_config(self):
+            for clave, valor in self.opciones.items():
+                if valor is not None:
+                    self.cfg.set(clave, valor)
+
+        def load(self):
+            return self.aplicacion
+
+
+def servir(app, host=None, puerto=None, procesos=None, hilos=None):
+    """Inicia el servidor de producción (bloquea hasta que se detiene)"""
+    if BaseApplication is not None:
+        opciones = opciones_gunicorn(app, host, puerto, procesos, hilos)
+        logger.info(f"gunicorn en {opciones['bind']}: {opciones['workers']} procesos "
+                    f"x {opciones['threads']} hilos")
+        # Los objetos de la aplicación precargada quedan fuera del recolector de basura:
+        # recorrerlos en cada proceso copiaría las páginas compartidas
+        gc.collect()
+        gc.freeze()
+        ServidorGunicorn(app, opciones).run()
+    elif waitress is not None:
+        hilos = (procesos or 1) * (hilos or app.config.get('SERVIDOR_HILOS', 4))
+        host = host or app.config.get('SERVIDOR_HOST', '0.0.0.0')
+        puerto = puerto or app.config.get('SERVIDOR_PUERTO', 8000)
+        logger.warning("gunicorn no está disponible (Windows): waitress en un solo proceso")
+        calentar_proceso(app)
+        waitress.serve(app, host=host, port=puerto, threads=hilos)
+    else:
+        raise click.ClickException(
+            'El servidor de producción requiere gunicorn (Linux/macOS) o waitress (Windows): '
+            'pip install gunicorn  /  pip install waitress'
+        )
+
+
+@click.command()
+@click.option('--config', 'config_name', default=lambda: os.environ.get('FLASK_CONFIG', 'production'),
+              show_default='production', help='Configuración (config.py)')
+@click.option('--host', help='Dirección de escucha (SERVIDOR_HOST)')
+@click.option('--puerto', type=int, help='Puerto (SERVIDOR_PUERTO)')
+@click.option('--procesos', type=int, help='Procesos (SERVIDOR_PROCESOS, por defecto 2 x núcleos + 1)')
+@click.option('--hilos', type=int, help='Hilos por proceso (SERVIDOR_HILOS)')
+def main(config_name, host, puerto, procesos, hilos):
+    """Servidor de producción de la aplicación"""
+    from app import create_app
+    app = create_app(config_name)
+    if app.debug:
+        logger.warning("La configuración tiene DEBUG activado: no usar en producción")
+    servir(app, host, puerto, procesos, hilos)
+
+
+if __name__ == '__main__':
+    main()
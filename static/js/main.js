@@ -158,101 +158,90 @@ function loadRepuestosDetalle(id) {
     body.html('<div class="text-center py-4"><div class="spinner-border text-primary"></div><p class="mt-2">Cargando...</p></div>');
     modal.modal('show');
 
-    $.ajax({
-        url: '/api/repuestos/' + id + '/detalle',
-        method: 'GET',
-        success: function(data) {
-            let html = `
-                <div class="row">
-                    <div class="col-md-6">
-                        <dl class="row">
-                            <dt class="col-5">Código:</dt><dd class="col-7"><code>${data.codigo}</code></dd>
-                            <dt class="col-5">Nombre:</dt><dd class="col-7">${data.nombre}</dd>
-                            <dt class="col-5">Categoría:</dt><dd class="col-7">${data.categoria_nombre || '-'}</dd>
-                            <dt class="col-5">Ubicación:</dt><dd class="col-7">${data.ubicacion_fisica || '-'}</dd>
-                            <dt class="col-5">Precio:</dt><dd class="col-7"><strong>${formatCOPMoneda(data.precio_venta)}</strong></dd>
-                            <dt class="col-5">Stock actual:</dt><dd class="col-7"><span class="badge bg-${data.cantidad_actual === 0 ? 'danger' : data.cantidad_actual <= data.cantidad_minima ? 'warning' : 'success'}">${data.cantidad_actual}</span></dd>
-                            <dt class="col-5">Stock mínimo:</dt><dd class="col-7">${data.cantidad_minima}</dd>
-                            <dt class="col-5">Reservado:</dt><dd class="col-7">${data.cantidad_reservada || 0}</dd>
-                        </dl>
-                    </div>`;
-
-            if (data.imagenes && data.imagenes.length > 0) {
-                html += `<div class="col-md-6">
-                    <div id="carouselDetalle" class="carousel slide" data-bs-ride="carousel">
-                        <div class="carousel-inner">`;
-                data.imagenes.forEach(function(img, i) {
-                    html += `<div class="carousel-item ${i === 0 ? 'active' : ''}">
-                        <img src="/uploads/repuestos/${img.ruta_archivo}" class="d-block w-100" style="max-height:200px;object-fit:contain">
-                    </div>`;
-                });
-                html += `</div>
-                    ${data.imagenes.length > 1 ? '<button class="carousel-control-prev" type="button" data-bs-target="#carouselDetalle" data-bs-slide="prev"><span class="carousel-control-prev-icon"></span></button><button class="carousel-control-next" type="button" data-bs-target="#carouselDetalle" data-bs-slide="next"><span class="carousel-control-next-icon"></span></button>' : ''}
-                </div></div>`;
-            }
+    obtenerJSON('/api/repuestos/' + id + '/detalle').done(function(data) {
+        let html = `
+            <div class="row">
+                <div class="col-md-6">
+                    <dl class="row">
+                        <dt class="col-5">Código:</dt><dd class="col-7"><code>${data.codigo}</code></dd>
+                        <dt class="col-5">Nombre:</dt><dd class="col-7">${data.nombre}</dd>
+                        <dt class="col-5">Categoría:</dt><dd class="col-7">${data.categoria_nombre || '-'}</dd>
+                        <dt class="col-5">Ubicación:</dt><dd class="col-7">${data.ubicacion_fisica || '-'}</dd>
+                        <dt class="col-5">Precio:</dt><dd class="col-7"><strong>${formatCOPMoneda(data.precio_venta)}</strong></dd>
+                        <dt class="col-5">Stock actual:</dt><dd class="col-7"><span class="badge bg-${data.cantidad_actual === 0 ? 'danger' : data.cantidad_actual <= data.cantidad_minima ? 'warning' : 'success'}">${data.cantidad_actual}</span></dd>
+                        <dt class="col-5">Stock mínimo:</dt><dd class="col-7">${data.cantidad_minima}</dd>
+                        <dt class="col-5">Reservado:</dt><dd class="col-7">${data.cantidad_reservada || 0}</dd>
+                    </dl>
+                </div>`;
+
+        if (data.imagenes && data.imagenes.length > 0) {
+            html += `<div class="col-md-6">
+                <div id="carouselDetalle" class="carousel slide" data-bs-ride="carousel">
+                    <div class="carousel-inner">`;
+            data.imagenes.forEach(function(img, i) {
+                html += `<div class="carousel-item ${i === 0 ? 'active' : ''}">
+                    <picture>
+                        ${img.media_webp ? `<source srcset="${img.media_webp}" type="image/webp">` : ''}
+                        <img src="${img.media}" class="d-block w-100" loading="lazy" style="max-height:200px;object-fit:contain">
+                    </picture>
+                </div>`;
+            });
+            html += `</div>
+                ${data.imagenes.length > 1 ? '<button class="carousel-control-prev" type="button" data-bs-target="#carouselDetalle" data-bs-slide="prev"><span class="carousel-control-prev-icon"></span></button><button class="carousel-control-next" type="button" data-bs-target="#carouselDetalle" data-bs-slide="next"><span class="carousel-control-next-icon"></span></button>' : ''}
+            </div></div>`;
+        }
 
-            html += '</div>';
+        html += '</div>';
 
-            if (data.descripcion_detallada) {
-                html += `<hr><h6>Descripción Detallada</h6><p>${data.descripcion_detallada}</p>`;
-            }
-
-            if (data.compatibilidad && data.compatibilidad.length > 0) {
-                html += '<hr><h6>Compatibilidad</h6><ul>';
-                data.compatibilidad.forEach(function(c) { html += `<li>${c}</li>`; });
-                html += '</ul>';
-            }
+        if (data.descripcion_detallada) {
+            html += `<hr><h6>Descripción Detallada</h6><p>${data.descripcion_detallada}</p>`;
+        }
 
-            if (data.equivalentes && data.equivalentes.length > 0) {
-                html += '<hr><h6>Equivalentes</h6><ul>';
-                data.equivalentes.forEach(function(e) { html += `<li><code>${e.codigo}</code> - ${e.nombre}</li>`; });
-                html += '</ul>';
-            }
+        if (data.compatibilidad && data.compatibilidad.length > 0) {
+            html += '<hr><h6>Compatibilidad</h6><ul>';
+            data.compatibilidad.forEach(function(c) { html += `<li>${c.marca} ${c.modelo}${c.observaciones ? ' - ' + c.observaciones : ''}</li>`; });
+            html += '</ul>';
+        }
 
-            body.html(html);
-        },
-        error: function() {
-            body.html('<div class="alert alert-danger">Error al cargar el detalle del repuesto</div>');
+        if (data.equivalentes && data.equivalentes.length > 0) {
+            html += '<hr><h6>Equivalentes</h6><ul>';
+            data.equivalentes.forEach(function(e) { html += `<li><code>${e.codigo_equivalente || '-'}</code> - ${e.marca_equivalente}</li>`; });
+            html += '</ul>';
         }
+
+        body.html(html);
+    }).fail(function() {
+        body.html('<div class="alert alert-danger">Error al cargar el detalle del repuesto</div>');
     });
 }
 
 function loadRepuestosPorCategoria(categoriaId, targetSelect) {
-    const url = categoriaId ? '/api/repuestos-por-categoria/' + categoriaId : '/api/repuestos/buscar?q=';
+    const url = categoriaId ? '/api/repuestos/por-categoria/' + categoriaId : '/api/repuestos/buscar?q=';
     $(targetSelect).html('<option value="">Cargando...</option>').prop('disabled', true);
-    $.ajax({
-        url: url,
-        success: function(repuestos) {
-            $(targetSelect).html('<option value="">Seleccione repuesto...</option>');
-            repuestos.forEach(function(r) {
-                const disponible = (r.cantidad_actual || 0) - (r.cantidad_reservada || 0);
-                $(targetSelect).append(`<option value="${r.id}" data-precio="${r.precio_venta}" data-stock="${disponible}">${r.codigo} - ${r.nombre} (Stock: ${disponible})</option>`);
-            });
-            $(targetSelect).prop('disabled', false);
-        },
-        error: function() {
-            $(targetSelect).html('<option value="">Error cargando repuestos</option>').prop('disabled', false);
-        }
+    obtenerJSON(url).done(function(repuestos) {
+        $(targetSelect).html('<option value="">Seleccione repuesto...</option>');
+        // Sin stock en la lista: se consulta con cargarDisponibilidad al elegir
+        repuestos.forEach(function(r) {
+            $(targetSelect).append(`<option value="${r.id}" data-precio="${r.precio_venta}">${r.codigo} - ${r.nombre}</option>`);
+        });
+        $(targetSelect).prop('disabled', false);
+    }).fail(function() {
+        $(targetSelect).html('<option value="">Error cargando repuestos</option>').prop('disabled', false);
     });
 }
 
 // ==================== VEHÍCULOS ====================
 
 function loadVehiculosCliente(clienteId) {
-    $.ajax({
-        url: '/api/vehiculos-cliente/' + clienteId,
-        method: 'GET',
-        success: function(vehiculos) {
-            const select = $('#vehiculo_cliente_id, #vehiculo_id');
-            select.empty().append('<option value="">Seleccione un vehículo</option>');
-            vehiculos.forEach(function(vehiculo) {
-                select.append(`<option value="${vehiculo.id}">${vehiculo.placa} - ${vehiculo.marca} ${vehiculo.modelo} ${vehiculo.anio || ''}</option>`);
-            });
-            select.prop('disabled', false);
-        },
-        error: function(error) {
-            console.error('Error cargando vehículos:', error);
-        }
+    obtenerJSON('/api/vehiculos-cliente/' + clienteId).done(function(vehiculos) {
+        const select = $('#vehiculo_cliente_id, #vehiculo_id');
+        select.empty().append('<option value="">Seleccione un vehículo</option>');
+        vehiculos.forEach(function(vehiculo) {
+            select.append(`<option value="${vehiculo.id}">${vehiculo.placa} - ${vehiculo.marca} ${vehiculo.modelo} ${vehiculo.anio || ''}</option>`);
+        });
+        select.prop('disabled', false);
+    }).fail(function(error) {
+        console.error('Error cargando vehículos:', error);
     });
 }
 
@@ -263,6 +252,129 @@ $(document).on('change', '#cliente_id', function() {
     }
 });
 
+// ==================== CACHÉ DE APIS (ETag) ====================
+
+// GET de una API JSON con copia local por ETag: envía If-None-Match con la versión
+// guardada y, si el servidor responde 304, usa la copia sin volver a descargarla.
+// Retorna una promesa con los datos.
+function obtenerJSON(url) {
+    const clave = 'etag:' + url;
+    let local = null;
+    try {
+        local = JSON.parse(sessionStorage.getItem(clave));
+    } catch (e) {
+        local = null;
+    }
+
+    return $.ajax({
+        url: url,
+        method: 'GET',
+        dataType: 'json',
+        headers: local ? { 'If-None-Match': local.etag } : {}
+    }).then(function(data, estado, xhr) {
+        if (xhr.status === 304 && local) {
+            return local.datos;
+        }
+        const etag = xhr.getResponseHeader('ETag');
+        if (etag) {
+            try {
+                sessionStorage.setItem(clave, JSON.stringify({ etag: etag, datos: data }));
+            } catch (e) {
+                // Sin espacio local: la próxima vez se descarga completo
+                sessionStorage.removeItem(clave);
+            }
+        }
+        return data;
+    });
+}
+
+// ==================== CATÁLOGO (REPUESTOS / CLIENTES) ====================
+
+// Carga un catálogo desde la instantánea versionada (/api/catalogo/<nombre>).
+// Guarda una copia local y en las visitas siguientes solo descarga las filas
+// que cambiaron desde la versión guardada. Retorna una promesa con las filas activas.
+function cargarCatalogo(nombre) {
+    const clave = 'catalogo_' + nombre;
+    let local = null;
+    try {
+        local = JSON.parse(localStorage.getItem(clave));
+    } catch (e) {
+        local = null;
+    }
+
+    return $.ajax({
+        url: '/api/catalogo/' + nombre,
+        method: 'GET',
+        data: local ? { desde: local.version } : {},
+        dataType: 'json'
+    }).then(function(resp) {
+        const cambios = filasDesdeColumnas(resp);
+        let filas;
+
+        if (resp.completo || !local) {
+            filas = cambios;
+        } else {
+            // Aplicar diferencias: reemplazar, agregar o quitar (inactivos)
+            const porId = {};
+            local.filas.forEach(function(f) { porId[f.id] = f; });
+            cambios.forEach(function(f) { porId[f.id] = f; });
+            filas = Object.keys(porId).map(function(id) { return porId[id]; })
+                .filter(function(f) { return f.activo; });
+            if (cambios.length) {
+                filas.sort(function(a, b) {
+                    return String(a[resp.orden]).localeCompare(String(b[resp.orden]), 'es');
+                });
+            }
+        }
+
+        try {
+            localStorage.setItem(clave, JSON.stringify({ version: resp.version, filas: filas }));
+        } catch (e) {
+            // Sin espacio local: se descargará completo la próxima vez
+            localStorage.removeItem(clave);
+        }
+        return filas;
+    });
+}
+
+// Stock actual de un repuesto al elegirlo: la instantánea del catálogo no trae cantidades
+// Retorna una promesa con {id, cantidad_actual, cantidad_reservada, disponible}
+function cargarDisponibilidad(repuestoId) {
+    return $.ajax({
+        url: '/api/repuestos/' + repuestoId + '/disponibilidad',
+        method: 'GET',
+        dataType: 'json',
+        cache: false
+    });
+}
+
+// Convierte la respuesta columnar {columnas, datos: {col: [...]}} en objetos por fila
+function filasDesdeColumnas(resp) {
+    const total = resp.columnas.length ? resp.datos[resp.columnas[0]].length : 0;
+    const filas = new Array(total);
+    for (let i = 0; i < total; i++) {
+        const fila = {};
+        resp.columnas.forEach(function(col) { fila[col] = resp.datos[col][i]; });
+        filas[i] = fila;
+    }
+    return filas;
+}
+
+// Llena un <select> con opciones construidas por 'opcion(fila)' -> {valor, texto, datos}
+function llenarSelect(select, filas, placeholder, opcion) {
+    const el = $(select)[0];
+    const fragmento = document.createDocumentFragment();
+    fragmento.appendChild(new Option(placeholder, ''));
+    filas.forEach(function(fila) {
+        const o = opcion(fila);
+        const opt = new Option(o.texto, o.valor);
+        Object.keys(o.datos || {}).forEach(function(k) { opt.dataset[k] = o.datos[k]; });
+        fragmento.appendChild(opt);
+    });
+    el.innerHTML = '';
+    el.appendChild(fragmento);
+}
+
 // ==================== FORMATO COLOMBIANO ====================
 
 function formatCOP(value) {
@@ -370,6 +482,9 @@ window.tallerInventario = {
     loadVehiculosCliente,
     loadRepuestosDetalle,
     loadRepuestosPorCategoria,
+    cargarCatalogo,
+    cargarDisponibilidad,
+    llenarSelect,
     formatCOP,
     formatCOPMoneda,
     formatCurrency,
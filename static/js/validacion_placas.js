@@ -18,6 +18,7 @@ function validarPlaca(placa) {
     return patronAuto.test(placa) || patronMoto.test(placa);
 }
 
+// Misma regla que placas.normalizar_placa (vehiculos_clientes.placa_normalizada)
 function formatearPlaca(input) {
     let valor = input.value.toUpperCase().replace(/[^A-Z0-9]/g, '');
     input.value = valor;
@@ -83,7 +84,7 @@ function buscarVehiculoPorPlaca(placa, callback) {
         return;
     }
     
-    fetch(`/api/vehiculos/buscar?placa=${encodeURIComponent(placa)}`)
+    fetch(`/api/vehiculos/por-placa?placa=${encodeURIComponent(placa)}`)
         .then(response => response.json())
         .then(data => callback(data))
         .catch(error => {
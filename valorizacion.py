@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Valorización de inventario
+- Lectura de los agregados por categoría de valorizacion_inventario (tiempo constante)
+- Los agregados los mantienen los triggers de repuestos en la misma transacción
+  que cada entrada, salida, factura, ajuste o edición
+- Verificación periódica: recalcula desde repuestos y reporta (o corrige) la deriva
+"""
+
+from database import execute_query, execute_update, get_db
+from decimal import Decimal
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Columnas agregadas por categoría
+COLUMNAS_VALORIZACION = ('repuestos', 'unidades', 'valor', 'agotados', 'stock_bajo')
+
+
+def valorizacion_total():
+    """
+    Totales de inventario activo: repuestos, unidades, valor, agotados y stock_bajo
+    """
+    fila = execute_query("""
+        SELECT COALESCE(SUM(repuestos), 0) as repuestos,
+               COALESCE(SUM(unidades), 0) as unidades,
+               COALESCE(SUM(valor), 0) as valor,
+               COALESCE(SUM(agotados), 0) as agotados,
+               COALESCE(SUM(stock_bajo), 0) as stock_bajo
+        FROM valorizacion_inventario
+    """, fetch_one=True)
+    return dict(fila) if fila else {c: 0 for c in COLUMNAS_VALORIZACION}
+
+
+def valorizacion_por_categoria():
+    """Valorización por categoría (solo categorías con repuestos activos), de mayor a menor valor"""
+    return execute_query("""
+        SELECT v.categoria_id, c.nombre as categoria,
+               v.repuestos as total, v.unidades, v.valor, v.agotados, v.stock_bajo
+        FROM valorizacion_inventario v
+        LEFT JOIN categorias_repuestos c ON v.categoria_id = c.id
+        WHERE v.repuestos > 0
+        ORDER BY v.valor DESC
+    """, fetch_all=True) or []
+
+
+def verificar_valorizacion(corregir=False):
+    """
+    Recalcula la valorización desde repuestos y la compara con los agregados.
+
+    Ambas lecturas se hacen en la misma transacción (misma instantánea). Con
+    corregir=True las filas de repuestos se leen con bloqueo compartido, de modo
+    que ningún cambio de stock se cruza con la corrección.
+
+    Args:
+        corregir: Si True, reescribe las categorías con deriva
+
+    Returns:
+        Dict con 'categorias', 'diferencias' (lista por categoría con esperado/registrado),
+        'corregidas' y 'segundos'
+    """
+    inicio = time.monotonic()
+    db = get_db()
+    db.commit()  # Iniciar una instantánea nueva
+
+    bloqueo = 'LOCK IN SHARE MODE' if corregir else ''
+    esperados = execute_query(f"""
+        SELECT IFNULL(categoria_id, 0) as categoria_id,
+               COUNT(*) as repuestos,
+               SUM(cantidad_actual) as unidades,
+               SUM(cantidad_actual * precio_venta) as valor,
+               SUM(cantidad_actual = 0) as agotados,
+               SUM(cantidad_actual > 0 AND cantidad_actual <= cantidad_minima) as stock_bajo
+        FROM repuestos
+        WHERE activo = TRUE
+        GROUP BY IFNULL(categoria_id, 0)
+        {bloqueo}
+    """, fetch_all=True)
+
+    registrados = execute_query(f"""
+        SELECT categoria_id, repuestos, unidades, valor, agotados, stock_bajo
+        FROM valorizacion_inventario
+        {'FOR UPDATE' if corregir else ''}
+    """, fetch_all=True)
+
+    vacio = {c: 0 for c in COLUMNAS_VALORIZACION}
+    esperados = {f['categoria_id']: f for f in esperados}
+    registrados = {f['categoria_id']: f for f in registrados}
+
+    diferencias = []
+    for categoria_id in sorted(set(esperados) | set(registrados)):
+        esperado = esperados.get(categoria_id, vacio)
+        registrado = registrados.get(categoria_id, vacio)
+        columnas = [c for c in COLUMNAS_VALORIZACION
+                    if Decimal(esperado[c] or 0) != Decimal(registrado[c] or 0)]
+        if columnas:
+            diferencias.append({
+                'categoria_id': categoria_id,
+                'columnas': columnas,
+                'esperado': {c: esperado[c] or 0 for c in COLUMNAS_VALORIZACION},
+                'registrado': {c: registrado[c] or 0 for c in COLUMNAS_VALORIZACION}
+            })
+
+    if corregir and diferencias:
+        for d in diferencias:
+            e = d['esperado']
+            execute_update("""
+                INSERT INTO valorizacion_inventario
+                (categoria_id, repuestos, unidades, valor, agotados, stock_bajo)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    repuestos = VALUES(repuestos), unidades = VALUES(unidades),
+                    valor = VALUES(valor), agotados = VALUES(agotados),
+                    stock_bajo = VALUES(stock_bajo)
+            """, (d['categoria_id'], e['repuestos'], e['unidades'], e['valor'],
+                  e['agotados'], e['stock_bajo']))
+    db.commit()
+
+    resultado = {
+        'categorias': len(esperados),
+        'diferencias': diferencias,
+        'corregidas': len(diferencias) if corregir else 0,
+        'segundos': round(time.monotonic() - inicio, 2)
+    }
+    if diferencias:
+        logger.warning(
+            f"Valorización con deriva en {len(diferencias)} categorías"
+            f"{' (corregidas)' if corregir else ''}"
+        )
+    return resultado